@@ -173,6 +173,40 @@ else:
     MEDIA_ROOT = "/app/media"
     MEDIA_URL = "/media/"
 
+# Экспорт не больше EXPORT_SYNC_MAX_ASSEMBLIES сборок отдается сразу, больший - фоновой задачей.
+# Готовые файлы фонового экспорта хранятся EXPORT_CACHE_TTL секунд
+EXPORT_SYNC_MAX_ASSEMBLIES = env.int("EXPORT_SYNC_MAX_ASSEMBLIES", 20_000)
+EXPORT_CACHE_DIR = os.path.join(BASE_DIR, "export_cache")
+EXPORT_CACHE_TTL = env.int("EXPORT_CACHE_TTL", 30 * 60)
+EXPORT_JOB_TIMEOUT = env.int("EXPORT_JOB_TIMEOUT", 30 * 60)
+EXPORT_WORKER_INTERVAL = env.int("EXPORT_WORKER_INTERVAL", 5)
+
+# Окно поиска повторяющихся товаров на дашборде в часах (0 - текущие сутки)
+REPEATED_PRODUCTS_WINDOW_HOURS = env.int("REPEATED_PRODUCTS_WINDOW_HOURS", 0)
+
+# Разделы дашборда кешируются до изменения данных, но не дольше STATISTICS_CACHE_TTL секунд
+STATISTICS_CACHE_TTL = env.int("STATISTICS_CACHE_TTL", 10 * 60)
+# Параллельный расчет разделов (экспорт статистики): размер пула и таймаут раздела в секундах
+STATISTICS_WORKERS = env.int("STATISTICS_WORKERS", 4)
+STATISTICS_SECTION_TIMEOUT = env.int("STATISTICS_SECTION_TIMEOUT", 30)
+# Уникальные товары и сборщики за периоды от STATISTICS_SKETCH_MIN_DAYS дней оцениваются по скетчам
+STATISTICS_SKETCH_MIN_DAYS = env.int("STATISTICS_SKETCH_MIN_DAYS", 31)
+# Период обновления материализованных представлений статистики в минутах
+STATISTICS_MATVIEW_REFRESH_MINUTES = env.int("STATISTICS_MATVIEW_REFRESH_MINUTES", 30)
+# Период фоновой пересборки скетчей часов и дней, данные которых изменились, в секундах
+SKETCH_REFRESH_INTERVAL = env.int("SKETCH_REFRESH_INTERVAL", 60)
+# Индекс хронической недостачи: окно в днях и период полураспада веса недостачи по давности
+CHRONIC_SHORTAGE_WINDOW_DAYS = env.int("CHRONIC_SHORTAGE_WINDOW_DAYS", 90)
+CHRONIC_SHORTAGE_HALF_LIFE_DAYS = env.int("CHRONIC_SHORTAGE_HALF_LIFE_DAYS", 14)
+# Прогноз недостачи по (отдел, час): глубина истории в днях и коэффициент экспоненциального сглаживания
+FORECAST_HISTORY_DAYS = env.int("FORECAST_HISTORY_DAYS", 56)
+FORECAST_SMOOTHING = env.float("FORECAST_SMOOTHING", 0.3)
+
+# Буфер посещений страниц: предельный размер, размер пачки записи и период сохранения в секундах
+VISIT_BUFFER_SIZE = env.int("VISIT_BUFFER_SIZE", 10_000)
+VISIT_FLUSH_SIZE = env.int("VISIT_FLUSH_SIZE", 500)
+VISIT_FLUSH_INTERVAL = env.float("VISIT_FLUSH_INTERVAL", 5)
+
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
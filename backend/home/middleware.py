@@ -4,6 +4,11 @@ from urllib.parse import urlparse, urlunparse
 from django.utils import timezone
 from loguru import logger
 
+from .visits import RecentVisits, visit_buffer
+
+# Последние посещения для отсечения перезагрузок (в памяти процесса, вместо записи в сессию)
+recent_visits = RecentVisits(size=50_000)
+
 
 class VisitCounterMiddleware:
     def __init__(self, get_response):
@@ -32,18 +37,14 @@ class VisitCounterMiddleware:
         if not self._should_track(request):
             return self.get_response(request)
 
-        # Получаем или создаем ключ сессии
-        if not request.session.session_key:
-            request.session.save()
+        response = self.get_response(request)
 
-        # Нормализуем URL (убираем параметры)
+        # Посещение записывается после ответа и не добавляет запросов к БД:
+        # пользователь берется, только если его уже загрузило представление
         full_url = request.build_absolute_uri()
         normalized_url = self._normalize_url(full_url)
-
-        # Сохраняем посещение
         self._save_visit(request, full_url, normalized_url)
 
-        response = self.get_response(request)
         return response
 
     def _should_track(self, request):
@@ -106,30 +107,24 @@ class VisitCounterMiddleware:
         return ip
 
     def _save_visit(self, request, full_url, normalized_url):
-        """Сохраняет информацию о посещении"""
+        """Добавляет посещение в буфер, в БД его сохраняет фоновый поток (home.visits)"""
         try:
             from .models import PageVisit
 
-            # Проверяем, не был ли этот URL уже посещен в этой сессии
-            # (для предотвращения дублирования при перезагрузках)
-            session_key = request.session.session_key
+            # Ключ сессии берется из cookie без создания сессии: пустой для анонимных запросов без сессии
+            session_key = request.session.session_key or ''
+            now = timezone.now()
 
-            # Можно добавить проверку на частые посещения
-            # например, не считать посещения чаще чем раз в 30 секунд
-            last_visit_key = f'last_visit_{normalized_url}'
-            last_visit_time = request.session.get(last_visit_key)
-            current_time = timezone.now().timestamp()
-
-            if last_visit_time and (current_time - last_visit_time < 30):
-                # Пропускаем слишком частые посещения
+            # Слишком частые посещения одного URL (перезагрузки) не считаем: не чаще раза в 30 секунд
+            visitor = session_key or self._get_client_ip(request)
+            if recent_visits.seen_within((visitor, normalized_url), 30, now.timestamp()):
                 return
 
-            # Сохраняем время последнего посещения
-            request.session[last_visit_key] = current_time
-
-            # Создаем запись о посещении
-            visit = PageVisit(
-                user=request.user if request.user.is_authenticated else None,
+            # request.user ленивый: обращение к нему загрузило бы сессию и пользователя.
+            # Если представление его не загружало, пользователя по ключу сессии определит фоновое сохранение
+            user = getattr(request, '_cached_user', None)
+            visit_buffer.add(PageVisit(
+                user=user if user is not None and user.is_authenticated else None,
                 session_key=session_key,
                 url=normalized_url,
                 full_url=full_url,
@@ -137,16 +132,12 @@ class VisitCounterMiddleware:
                 referer=request.META.get('HTTP_REFERER', ''),
                 user_agent=request.META.get('HTTP_USER_AGENT', ''),
                 method=request.method,
-                timestamp=timezone.now()
-            )
-            visit.save()
+                timestamp=now
+            ))
 
         except Exception as e:
             # Логируем ошибку, но не прерываем выполнение
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error saving visit: {e}")
-
+            logger.error(f"Ошибка учета посещения: {e}")
 
 from django.shortcuts import render
 from django.core.exceptions import PermissionDenied
@@ -1,3 +1,150 @@
-from django.test import TestCase
+import os
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.functional import SimpleLazyObject
+
+from .middleware import VisitCounterMiddleware
+from .models import PageVisit
+from .visits import RecentVisits, VisitBuffer, resolve_users
+
+
+def visit(number=0):
+    return PageVisit(session_key='', url=f'http://localhost/{number}/', full_url=f'http://localhost/{number}/')
+
+
+@mock.patch('home.visits.db.close_old_connections')
+class VisitBufferTests(TestCase):
+    """Буфер посещений: без фонового потока, сохранение вызывается напрямую"""
+
+    def buffer(self, capacity=100, flush_size=10):
+        buffer = VisitBuffer(capacity=capacity, flush_size=flush_size, flush_interval=60)
+        buffer._ensure_thread = mock.Mock()
+        return buffer
+
+    def test_overflow_drops_visits(self, close_old_connections):
+        buffer = self.buffer(capacity=2)
+        self.assertEqual([buffer.add(visit(number)) for number in range(3)], [True, True, False])
+        self.assertEqual(buffer.dropped, 1)
+
+        with mock.patch('home.visits.logger') as logger:
+            self.assertEqual(buffer.flush(), 2)
+        logger.warning.assert_called_once()
+        self.assertEqual(PageVisit.objects.count(), 2)
+
+        # Об отброшенных посещениях сообщается один раз, после сохранения снова есть место
+        with mock.patch('home.visits.logger') as logger:
+            self.assertTrue(buffer.add(visit()))
+            buffer.flush()
+        logger.warning.assert_not_called()
+
+    def test_flush_in_batches(self, close_old_connections):
+        buffer = self.buffer(flush_size=2)
+        for number in range(5):
+            buffer.add(visit(number))
+        # Набралось flush_size посещений - фоновый поток будится
+        self.assertTrue(buffer._wakeup.is_set())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 5)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(PageVisit.objects.count(), 5)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_users_resolved_by_session(self, close_old_connections):
+        user = get_user_model().objects.create_user(username='admin', password='admin')
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session.create()
+        anonymous = SessionStore()
+        anonymous.create()
+
+        buffer = self.buffer()
+        for session_key in (session.session_key, anonymous.session_key, 'missing', ''):
+            buffer.add(PageVisit(session_key=session_key, url='http://localhost/', full_url='http://localhost/'))
+
+        # Сессии, пользователи и вставка - три запроса на пачку
+        with self.assertNumQueries(3):
+            self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(
+            dict(PageVisit.objects.values_list('session_key', 'user')),
+            {session.session_key: user.pk, anonymous.session_key: None, 'missing': None, '': None},
+        )
+
+    def test_child_starts_empty(self, close_old_connections):
+        buffer = self.buffer()
+        buffer.add(visit())
+        buffer._thread = mock.Mock()
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if not buffer._visits and buffer._thread is None else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(len(buffer._visits), 1)
+
+
+class RecentVisitsTests(SimpleTestCase):
+    def test_reloads_within_window(self):
+        recent = RecentVisits(size=10)
+        key = ('session', '/particles/')
+        self.assertFalse(recent.seen_within(key, 30, 0))
+        self.assertTrue(recent.seen_within(key, 30, 29))
+        self.assertFalse(recent.seen_within(key, 30, 30))
+        self.assertTrue(recent.seen_within(key, 30, 45))
+        self.assertFalse(recent.seen_within(('session', '/home/'), 30, 45))
+
+    def test_oldest_keys_evicted(self):
+        recent = RecentVisits(size=2)
+        for key in ('a', 'b', 'c'):
+            recent.seen_within(key, 30, 0)
+        self.assertFalse(recent.seen_within('a', 30, 1))
+        self.assertTrue(recent.seen_within('c', 30, 1))
+
+
+@mock.patch('home.middleware.visit_buffer')
+class VisitCounterMiddlewareTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('home.middleware.recent_visits', RecentVisits(size=10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self):
+        request = RequestFactory().get('/particles/', {'assembler': 'Иванов'}, HTTP_HOST='localhost')
+        request.session = SessionStore()
+        return request
+
+    def test_user_not_loaded(self, visit_buffer):
+        # Представление не обращается к request.user: пользователь определяется при сохранении по сессии
+        user = get_user_model().objects.create_user(username='admin', password='admin')
+        request = self.request()
+        request.session[SESSION_KEY] = str(user.pk)
+        request.session.save()
+        request.session = SessionStore(request.session.session_key)
+        load_user = mock.Mock()
+        request.user = SimpleLazyObject(load_user)
+
+        with self.assertNumQueries(0):
+            VisitCounterMiddleware(lambda request: None)(request)
+
+        load_user.assert_not_called()
+        saved = visit_buffer.add.call_args.args[0]
+        self.assertIsNone(saved.user_id)
+        self.assertEqual(saved.url, 'http://localhost/particles/')
+
+        resolve_users([saved])
+        self.assertEqual(saved.user_id, user.pk)
+
+    def test_loaded_user_saved(self, visit_buffer):
+        request = self.request()
+        request._cached_user = get_user_model().objects.create_user(username='admin', password='admin')
+
+        VisitCounterMiddleware(lambda request: None)(request)
+
+        self.assertEqual(visit_buffer.add.call_args.args[0].user, request._cached_user)
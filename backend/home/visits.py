@@ -0,0 +1,169 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from importlib import import_module
+
+from django import db
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.utils import timezone
+from loguru import logger
+
+
+def resolve_users(visits):
+    """
+    Пользователь посещений, в запросе которых он не загружался: по ключу сессии.
+    Сессии и пользователи читаются одним запросом на всю пачку
+    """
+    keys = {visit.session_key for visit in visits if visit.user_id is None and visit.session_key}
+    if not keys:
+        return
+
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if hasattr(store, 'get_model_class'):
+        rows = store.get_model_class().objects.filter(
+            session_key__in=keys, expire_date__gt=timezone.now()
+        ).values_list('session_key', 'session_data')
+        sessions = {key: store().decode(data) for key, data in rows}
+    else:
+        # Сессии вне БД (кеш, cookie) загружаются по одной
+        sessions = {key: store(key).load() for key in keys}
+
+    user_model = get_user_model()
+    user_ids = {
+        key: user_model._meta.pk.to_python(session[SESSION_KEY])
+        for key, session in sessions.items()
+        if session.get(SESSION_KEY) is not None
+    }
+    # Пользователь мог быть удален после входа
+    existing = set(user_model.objects.filter(pk__in=set(user_ids.values())).values_list('pk', flat=True))
+
+    for visit in visits:
+        if visit.user_id is None and user_ids.get(visit.session_key) in existing:
+            visit.user_id = user_ids[visit.session_key]
+
+
+class VisitBuffer:
+    """
+    Ограниченный буфер посещений в памяти процесса.
+    Запросы только добавляют посещение (без обращения к БД), фоновый поток определяет
+    пользователей по сессиям (resolve_users) и сохраняет посещения через bulk_create,
+    когда набралось flush_size записей или прошло flush_interval секунд.
+    При переполнении посещение отбрасывается и учитывается в dropped, запрос не ждет.
+    Остаток сохраняется при завершении процесса. В дочернем процессе после fork буфер
+    начинается заново: посещения родителя сохранит сам родитель
+    """
+
+    def __init__(self, capacity, flush_size, flush_interval):
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._visits = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Блокировка могла быть захвачена потоком родителя, а сам поток в дочерний процесс не переходит
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._visits = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, visit):
+        """Добавляет посещение; False - буфер заполнен и посещение отброшено"""
+        with self._lock:
+            if len(self._visits) >= self.capacity:
+                self.dropped += 1
+                return False
+            self._visits.append(visit)
+            full = len(self._visits) >= self.flush_size
+
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def _ensure_thread(self):
+        # Поток запускается при первом посещении в каждом процессе: после fork воркера он сброшен в _reset
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='visit-buffer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Сохраняет накопленные посещения одной пачкой, возвращает их число"""
+        with self._lock:
+            visits, self._visits = self._visits, []
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+
+        if dropped:
+            logger.warning(f"Буфер посещений переполнен: отброшено {dropped} посещений")
+        if not visits:
+            return 0
+
+        from .models import PageVisit
+
+        started = time.monotonic()
+        try:
+            # Поток живет долго: соединение проверяется так же, как в начале и конце запроса
+            db.close_old_connections()
+            resolve_users(visits)
+            PageVisit.objects.bulk_create(visits, batch_size=self.flush_size)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения {len(visits)} посещений: {e}")
+            return 0
+        finally:
+            db.close_old_connections()
+
+        logger.debug(f"Сохранено посещений: {len(visits)} за {time.monotonic() - started:.3f} с")
+        return len(visits)
+
+
+class RecentVisits:
+    """
+    Время последнего посещения по ключу (сессия или IP, URL) для отсечения частых перезагрузок.
+    Хранит не больше size ключей, самые старые вытесняются
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._times = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen_within(self, key, seconds, now):
+        """True, если по ключу было посещение за последние seconds секунд; иначе запоминает now"""
+        with self._lock:
+            last = self._times.get(key)
+            if last is not None and now - last < seconds:
+                return True
+            self._times[key] = now
+            self._times.move_to_end(key)
+            if len(self._times) > self.size:
+                self._times.popitem(last=False)
+            return False
+
+
+visit_buffer = VisitBuffer(
+    capacity=settings.VISIT_BUFFER_SIZE,
+    flush_size=settings.VISIT_FLUSH_SIZE,
+    flush_interval=settings.VISIT_FLUSH_INTERVAL,
+)
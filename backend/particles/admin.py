@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import PartiallyPickedAssembly, PartiallyPickedProduct
+from .blacklist import rule_products, set_black_list
+from .models import BlacklistRule, ExportJob, PartiallyPickedAssembly, PartiallyPickedProduct
 from .utils import find_duplicate_assemblies, find_duplicate_products, cleanup_duplicates
 
 
@@ -24,6 +25,24 @@ def check_product_duplicates(modeladmin, request, queryset):
     modeladmin.message_user(request, msg)
 
 
+@admin.action(description='Добавить в черный список')
+def add_to_blacklist(modeladmin, request, queryset):
+    result = set_black_list(queryset, True)
+    modeladmin.message_user(
+        request,
+        f"Добавлено в черный список товаров: {result['products']}, пересчитано сборок: {result['assemblies']}"
+    )
+
+
+@admin.action(description='Убрать из черного списка')
+def remove_from_blacklist(modeladmin, request, queryset):
+    result = set_black_list(queryset, False)
+    modeladmin.message_user(
+        request,
+        f"Убрано из черного списка товаров: {result['products']}, пересчитано сборок: {result['assemblies']}"
+    )
+
+
 class PartiallyPickedProductInline(admin.TabularInline):
     model = PartiallyPickedProduct
     extra = 0
@@ -74,7 +93,7 @@ class PartiallyPickedProductAdmin(admin.ModelAdmin):
     search_fields = ['lm_code', 'title', 'assembly__order_number']
     readonly_fields = ['missing_quantity', 'created_at', 'updated_at']
 
-    actions = [check_product_duplicates]
+    actions = [check_product_duplicates, add_to_blacklist, remove_from_blacklist]
 
     fieldsets = (
         ('Основная информация', {
@@ -104,4 +123,39 @@ class PartiallyPickedProductAdmin(admin.ModelAdmin):
         )
 
     assembly_link.short_description = 'Сборка'
-    assembly_link.admin_order_field = 'assembly__order_number'
\ No newline at end of file
+    assembly_link.admin_order_field = 'assembly__order_number'
+
+
+@admin.action(description='Применить к уже сохраненным товарам')
+def apply_rules_to_existing(modeladmin, request, queryset):
+    products = 0
+    assemblies = 0
+    for rule in queryset.filter(is_active=True):
+        result = set_black_list(rule_products(rule), True)
+        products += result['products']
+        assemblies += result['assemblies']
+    modeladmin.message_user(
+        request,
+        f"Добавлено в черный список товаров: {products}, пересчитано сборок: {assemblies}"
+    )
+
+
+@admin.register(BlacklistRule)
+class BlacklistRuleAdmin(admin.ModelAdmin):
+    list_display = ['field', 'value', 'action', 'is_active', 'comment', 'updated_at']
+    list_filter = ['field', 'action', 'is_active']
+    list_editable = ['is_active']
+    search_fields = ['value', 'comment']
+    readonly_fields = ['created_at', 'updated_at']
+
+    actions = [apply_rules_to_existing]
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'export_format', 'status', 'rows_count', 'file_size',
+                    'requests_count', 'created_at', 'finished_at', 'expires_at']
+    list_filter = ['status', 'export_format']
+    readonly_fields = ['key', 'export_format', 'params', 'status', 'file_path', 'file_size',
+                       'rows_count', 'requests_count', 'error', 'created_at', 'started_at',
+                       'finished_at', 'expires_at']
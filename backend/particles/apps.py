@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ParticlesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'particles'
+
+    def ready(self):
+        from django.core.checks import Tags, register
+
+        from . import checks, distinct_sketches, heavy_hitters, rollups, stats_cache
+        from .signals import assemblies_changed
+
+        # Порядок важен: кеш статистики сбрасывается после пересчета агрегатов
+        assemblies_changed.connect(rollups.on_assemblies_changed, dispatch_uid='particles_rollups')
+        assemblies_changed.connect(distinct_sketches.on_assemblies_changed, dispatch_uid='particles_distinct_sketches')
+        assemblies_changed.connect(stats_cache.on_assemblies_changed, dispatch_uid='particles_stats_cache')
+        assemblies_changed.connect(heavy_hitters.on_assemblies_changed, dispatch_uid='particles_top_products')
+
+        register(checks.check_local_time_columns, Tags.database)
@@ -0,0 +1,173 @@
+import re
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .matviews import invalidate_materialized_views
+from .models import BlacklistRule, PartiallyPickedAssembly, PartiallyPickedProduct
+from .signals import send_assemblies_changed
+
+
+def select_products(ids=None, lm_codes=None, department_id=None, date_from=None, date_to=None):
+    """
+    Отбирает товары для массового изменения черного списка.
+    Даты относятся к времени создания сборки (включительно)
+    """
+    products = PartiallyPickedProduct.objects.all()
+
+    if ids:
+        products = products.filter(id__in=ids)
+
+    if lm_codes:
+        products = products.filter(lm_code__in=lm_codes)
+
+    if department_id:
+        products = products.filter(department_id=department_id)
+
+    if date_from:
+        products = products.filter(assembly__created_date__gte=date_from)
+    if date_to:
+        products = products.filter(assembly__created_date__lte=date_to)
+
+    return products
+
+
+def set_black_list(products, value):
+    """
+    Помечает/снимает игнорирование для набора товаров одним UPDATE
+    и пересчитывает метрики затронутых сборок одним запросом.
+
+    Возвращает количество измененных товаров и сборок
+    """
+    ids_sql, params = products.order_by().values('pk').query.sql_with_params()
+    table = PartiallyPickedProduct._meta.db_table
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET black_list = %s, updated_at = %s
+                WHERE black_list <> %s AND id IN ({ids_sql})
+                RETURNING assembly_id
+                """,
+                [value, timezone.now(), value, *params]
+            )
+            rows = cursor.fetchall()
+
+        assembly_ids = {row[0] for row in rows}
+        updated_assemblies = 0
+        if assembly_ids:
+            updated_assemblies = PartiallyPickedAssembly.recalculate_metrics(assembly_ids)
+            send_assemblies_changed(assembly_ids)
+            # Изменение может относиться к прошлым дням, уже попавшим в представления
+            transaction.on_commit(invalidate_materialized_views)
+
+    return {
+        'products': len(rows),
+        'assemblies': updated_assemblies,
+    }
+
+
+class BlacklistMatcher:
+    """
+    Скомпилированные правила черного списка.
+    Точные совпадения проверяются по множествам, подстроки названия - одним регулярным выражением на действие
+    """
+    EXACT_FIELDS = (
+        BlacklistRule.FIELD_LM_CODE,
+        BlacklistRule.FIELD_DEPARTMENT,
+        BlacklistRule.FIELD_ZONE,
+        BlacklistRule.FIELD_SOURCE,
+    )
+
+    def __init__(self, rules):
+        # {action: {field: {value, ...}}}
+        self.exact = {
+            BlacklistRule.ACTION_SKIP: {field: set() for field in self.EXACT_FIELDS},
+            BlacklistRule.ACTION_BLACKLIST: {field: set() for field in self.EXACT_FIELDS},
+        }
+        # {action: {подстрока в casefold, ...}}
+        self.titles = {BlacklistRule.ACTION_SKIP: set(), BlacklistRule.ACTION_BLACKLIST: set()}
+
+        for field, value, action in rules:
+            if not value:
+                continue
+            if field == BlacklistRule.FIELD_TITLE:
+                self.titles[action].add(value.casefold())
+            else:
+                self.exact[action][field].add(value)
+
+        # Отдельное выражение на каждое действие: нужен только факт вхождения любой подстроки,
+        # поэтому пересекающиеся подстроки разных правил не мешают друг другу
+        self.title_patterns = {
+            action: re.compile('|'.join(re.escape(item) for item in sorted(substrings, key=len, reverse=True)))
+            for action, substrings in self.titles.items()
+            if substrings
+        }
+
+    def __bool__(self):
+        return bool(self.title_patterns) or any(
+            values for fields in self.exact.values() for values in fields.values()
+        )
+
+    def match(self, lm_code=None, department_id=None, assembly_zone=None, source=None, title=None):
+        """Возвращает действие первого подходящего правила (пропуск важнее игнорирования) или None"""
+        values = {
+            BlacklistRule.FIELD_LM_CODE: lm_code,
+            BlacklistRule.FIELD_DEPARTMENT: department_id,
+            BlacklistRule.FIELD_ZONE: assembly_zone,
+            BlacklistRule.FIELD_SOURCE: source,
+        }
+
+        # Подстроки сравниваются в casefold (как и при компиляции), а не через re.IGNORECASE:
+        # casefold может менять длину строки ('ß' -> 'ss')
+        title = title.casefold() if title else ''
+
+        for action in (BlacklistRule.ACTION_SKIP, BlacklistRule.ACTION_BLACKLIST):
+            pattern = self.title_patterns.get(action)
+            if pattern is not None and pattern.search(title):
+                return action
+            for field, rule_values in self.exact[action].items():
+                value = values[field]
+                if value is not None and str(value) in rule_values:
+                    return action
+
+        return None
+
+
+_matcher_lock = threading.Lock()
+_matcher_state = {'version': None, 'matcher': BlacklistMatcher([])}
+
+
+def get_blacklist_matcher():
+    """
+    Возвращает скомпилированные правила процесса.
+    Перекомпиляция происходит только если изменилась версия правил
+    (количество и время последнего изменения), поэтому правки подхватываются без перезапуска
+    """
+    version = BlacklistRule.objects.aggregate(count=Count('id'), last=Max('updated_at'))
+    version = (version['count'], version['last'])
+
+    if _matcher_state['version'] != version:
+        with _matcher_lock:
+            if _matcher_state['version'] != version:
+                rules = BlacklistRule.objects.filter(is_active=True).values_list('field', 'value', 'action')
+                _matcher_state['matcher'] = BlacklistMatcher(rules)
+                _matcher_state['version'] = version
+
+    return _matcher_state['matcher']
+
+
+def rule_products(rule):
+    """Товары, уже сохраненные в БД и подходящие под правило"""
+    lookups = {
+        BlacklistRule.FIELD_LM_CODE: 'lm_code',
+        BlacklistRule.FIELD_DEPARTMENT: 'department_id',
+        BlacklistRule.FIELD_ZONE: 'assembly__assembly_zone',
+        BlacklistRule.FIELD_SOURCE: 'source',
+        BlacklistRule.FIELD_TITLE: 'title__icontains',
+    }
+    return PartiallyPickedProduct.objects.filter(**{lookups[rule.field]: rule.value})
@@ -0,0 +1,246 @@
+from datetime import timedelta
+from functools import cached_property
+
+from django.db.models import F, Max, Min, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .statistics import DashboardStatistics
+
+BUCKET_DAY = 'day'
+BUCKET_WEEK = 'week'
+BUCKET_MONTH = 'month'
+BUCKETS = (BUCKET_DAY, BUCKET_WEEK, BUCKET_MONTH)
+
+# Предел точек для автоматического выбора интервала: до полугода по дням, до трех лет по неделям
+MAX_DAY_BUCKETS = 180
+MAX_WEEK_BUCKETS = 156
+
+BUCKET_LABELS = {
+    BUCKET_DAY: '%d.%m',
+    BUCKET_WEEK: '%d.%m',
+    BUCKET_MONTH: '%m.%Y',
+}
+
+COLORS = [
+    'rgba(255, 99, 132, 0.5)',
+    'rgba(54, 162, 235, 0.5)',
+    'rgba(255, 206, 86, 0.5)',
+    'rgba(75, 192, 192, 0.5)',
+    'rgba(153, 102, 255, 0.5)',
+]
+
+
+def _bucket_start(day, bucket):
+    if bucket == BUCKET_WEEK:
+        return day - timedelta(days=day.weekday())
+    if bucket == BUCKET_MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(day, bucket):
+    if bucket == BUCKET_WEEK:
+        return day + timedelta(days=7)
+    if bucket == BUCKET_MONTH:
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+class ChartData:
+    """
+    Данные графиков дашборда (формат Chart.js) по агрегатам статистики.
+    Временные ряды группируются по дням, неделям или месяцам так,
+    чтобы даже за год получалось не больше нескольких сотен точек
+    """
+    CHART_TYPES = (
+        'daily_assemblies',
+        'missing_quantity_trend',
+        'assembler_performance',
+        'department_distribution',
+        'hourly',
+    )
+
+    def __init__(self, filters, bucket=None):
+        self.filters = filters
+        self.statistics = DashboardStatistics(filters)
+        self.requested_bucket = bucket if bucket in BUCKETS else None
+
+    def compute(self, chart_type):
+        return getattr(self, f'get_{chart_type}')()
+
+    # Интервалы
+
+    def bounds(self):
+        """Первый и последний день периода: из фильтров, а если их нет - по имеющимся данным"""
+        first, last = self.filters.date_from, self.filters.date_to
+        if first is None or last is None:
+            dates = self.statistics.assembly_rollups().aggregate(first=Min('date'), last=Max('date'))
+            first = first or dates['first']
+            last = last or dates['last']
+        return first, last
+
+    @cached_property
+    def period(self):
+        return self.bounds()
+
+    @cached_property
+    def bucket(self):
+        """
+        Интервал, по которому строятся ряды: запрошенный или выбранный по длине периода.
+        Ключ кеша строится по нему, поэтому неизвестный ?bucket= не плодит копии ответа
+        """
+        return self.resolve_bucket(*self.period)
+
+    def resolve_bucket(self, first, last):
+        if self.requested_bucket:
+            return self.requested_bucket
+        if first is None or last is None:
+            return BUCKET_DAY
+
+        days = (last - first).days + 1
+        if days <= MAX_DAY_BUCKETS:
+            return BUCKET_DAY
+        if days <= MAX_WEEK_BUCKETS * 7:
+            return BUCKET_WEEK
+        return BUCKET_MONTH
+
+    def time_series(self, **measures):
+        """
+        Ряд по интервалам с заполнением пропусков нулями.
+        Возвращает (интервал, [(начало интервала, {мера: значение}), ...])
+        """
+        first, last = self.period
+        bucket = self.bucket
+        if first is None or last is None:
+            return bucket, []
+
+        trunc = {
+            BUCKET_DAY: F('date'),
+            BUCKET_WEEK: TruncWeek('date'),
+            BUCKET_MONTH: TruncMonth('date'),
+        }[bucket]
+
+        rows = {
+            row['bucket']: row
+            for row in self.statistics.assembly_rollups().annotate(
+                bucket=trunc
+            ).values('bucket').annotate(**measures).order_by()
+        }
+
+        series = []
+        day = _bucket_start(first, bucket)
+        while day <= last:
+            row = rows.get(day, {})
+            series.append((day, {name: row.get(name) or 0 for name in measures}))
+            day = _next_bucket(day, bucket)
+
+        return bucket, series
+
+    @staticmethod
+    def labels(bucket, series):
+        return [day.strftime(BUCKET_LABELS[bucket]) for day, _ in series]
+
+    # Графики
+
+    def get_daily_assemblies(self):
+        bucket, series = self.time_series(count=Sum('assemblies_count'))
+        return {
+            'bucket': bucket,
+            'labels': self.labels(bucket, series),
+            'datasets': [{
+                'label': 'Количество сборок',
+                'data': [values['count'] for _, values in series],
+                'borderColor': 'rgb(75, 192, 192)',
+                'tension': 0.1
+            }]
+        }
+
+    def get_missing_quantity_trend(self):
+        bucket, series = self.time_series(
+            total_missing=Sum('missing_quantity'),
+            total_products=Sum('products_count'),
+        )
+        return {
+            'bucket': bucket,
+            'labels': self.labels(bucket, series),
+            'datasets': [
+                {
+                    'label': 'Недостающее количество',
+                    'data': [values['total_missing'] for _, values in series],
+                    'borderColor': 'rgb(255, 99, 132)',
+                    'tension': 0.1
+                },
+                {
+                    'label': 'Количество товаров',
+                    'data': [values['total_products'] for _, values in series],
+                    'borderColor': 'rgb(54, 162, 235)',
+                    'tension': 0.1
+                }
+            ]
+        }
+
+    def get_assembler_performance(self):
+        stats = self.statistics.assembly_rollups().values('assembler').annotate(
+            count=Sum('assemblies_count'),
+            products=Sum('products_count'),
+        ).order_by('-count')[:10]
+
+        return {
+            'labels': [item['assembler'] or 'Не указан' for item in stats],
+            'datasets': [
+                {
+                    'label': 'Количество сборок',
+                    'data': [item['count'] for item in stats],
+                    'backgroundColor': 'rgba(255, 99, 132, 0.5)',
+                },
+                {
+                    'label': 'Среднее кол-во товаров',
+                    'data': [
+                        round(item['products'] / item['count'], 2) if item['count'] else 0
+                        for item in stats
+                    ],
+                    'backgroundColor': 'rgba(54, 162, 235, 0.5)',
+                }
+            ]
+        }
+
+    def get_department_distribution(self):
+        stats = self.statistics.product_rollups().exclude(department_id='').values('department_id').annotate(
+            count=Sum('products_count'),
+            total_missing=Sum('missing_quantity'),
+        ).order_by('-count')[:10]
+
+        return {
+            'labels': [f"Отдел {item['department_id']}" for item in stats],
+            'datasets': [{
+                'label': 'Количество товаров',
+                'data': [item['count'] for item in stats],
+                'backgroundColor': COLORS,
+            }]
+        }
+
+    def get_hourly(self):
+        stats = {
+            item['hour']: item
+            for item in self.statistics.assembly_rollups().values('hour').annotate(
+                count=Sum('assemblies_count'),
+                missing=Sum('missing_quantity'),
+            ).order_by()
+        }
+        hours = range(24)
+
+        return {
+            'labels': [f'{hour}:00' for hour in hours],
+            'datasets': [
+                {
+                    'label': 'Количество сборок',
+                    'data': [stats.get(hour, {}).get('count', 0) for hour in hours],
+                    'backgroundColor': 'rgba(75, 192, 192, 0.5)',
+                },
+                {
+                    'label': 'Недостающее количество',
+                    'data': [stats.get(hour, {}).get('missing', 0) for hour in hours],
+                    'backgroundColor': 'rgba(255, 99, 132, 0.5)',
+                }
+            ]
+        }
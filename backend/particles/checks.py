@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core import checks
+from django.db import DatabaseError, connection
+
+# Генерируемые столбцы местного времени сборки (PartiallyPickedAssembly.created_date, created_hour)
+LOCAL_TIME_COLUMNS = ('created_date', 'created_hour')
+
+
+def check_local_time_columns(app_configs=None, databases=None, **kwargs):
+    """
+    Часовой пояс генерируемых столбцов сохраняется в БД при миграции. Если TIME_ZONE
+    потом изменился, даты и часы сборок расходятся с настройкой - столбцы нужно пересоздать
+    """
+    if not databases or connection.alias not in databases:
+        return []
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT column_name, generation_expression
+                FROM information_schema.columns
+                WHERE table_name = 'particles_partiallypickedassembly' AND column_name = ANY(%s)
+                """,
+                [list(LOCAL_TIME_COLUMNS)]
+            )
+            columns = cursor.fetchall()
+    except DatabaseError:
+        # БД еще не создана или недоступна - об этом сообщат другие проверки
+        return []
+
+    timezone_sql = f"timezone('{settings.TIME_ZONE}'::text"
+    return [
+        checks.Error(
+            f"Столбец {column} вычисляется не в часовом поясе TIME_ZONE={settings.TIME_ZONE}: {expression}",
+            hint="Пересоздайте столбцы created_date и created_hour миграцией или верните прежний TIME_ZONE",
+            obj='particles.PartiallyPickedAssembly',
+            id='particles.E001',
+        )
+        for column, expression in columns
+        if timezone_sql not in (expression or '')
+    ]
@@ -0,0 +1,134 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from loguru import logger
+
+from .models import ChronicShortage
+from .statistics import DashboardFilters, DashboardStatistics
+
+CHRONIC_LOCK_KEY = 'particles_chronic_shortages'
+
+# Веса составляющих индекса (каждая составляющая нормирована к [0, 1])
+WEIGHTS = {
+    'days_active': 0.5,
+    'weighted_missing': 0.3,
+    'assemblers_count': 0.2,
+}
+
+# Поля, по которым можно сортировать таблицу индекса
+SORT_FIELDS = (
+    'rank', 'score', 'days_active', 'occurrences', 'total_missing', 'weighted_missing',
+    'assemblers_count', 'last_seen', 'lm_code',
+)
+
+COLUMNS = (
+    'lm_code', 'title', 'department_id', 'days_active', 'occurrences',
+    'total_missing', 'weighted_missing', 'assemblers_count', 'last_seen',
+)
+
+
+def shortage_rows(first_day, last_day, half_life):
+    """
+    Показатели LM кодов за период одним запросом: дни с недостачей, попадания, недостача,
+    недостача с весом 0.5 ^ (давность в днях / half_life), число различных сборщиков.
+    Название и отдел - из последнего попадания
+    """
+    products = DashboardStatistics(DashboardFilters(date_from=first_day, date_to=last_day)).products().annotate(
+        day=F('assembly__created_date'),
+        assembler=F('assembly__assembler'),
+    ).values('id', 'lm_code', 'title', 'department_id', 'missing_quantity', 'day', 'assembler').order_by()
+    rows_sql, params = products.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT
+                rows.lm_code,
+                (ARRAY_AGG(rows.title ORDER BY rows.id DESC))[1],
+                (ARRAY_AGG(rows.department_id ORDER BY rows.id DESC))[1],
+                COUNT(DISTINCT rows.day),
+                COUNT(*),
+                COALESCE(SUM(rows.missing_quantity), 0),
+                COALESCE(SUM(rows.missing_quantity * power(0.5, (%s::date - rows.day) / %s::float)), 0),
+                COUNT(DISTINCT NULLIF(rows.assembler, '')),
+                MAX(rows.day)
+            FROM ({rows_sql}) AS rows
+            GROUP BY rows.lm_code
+            """,
+            [last_day, half_life, *params]
+        )
+        return [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def score_rows(rows, window_days):
+    """
+    Индекс 0-100: взвешенная сумма доли дней окна с недостачей и нормированных к максимуму
+    недостачи с учетом давности и числа сборщиков. Заполняет score и rank (1 - самый хронический)
+    """
+    if not rows:
+        return rows
+
+    components = {
+        'days_active': np.array([row['days_active'] for row in rows], dtype=np.float64) / window_days,
+        'weighted_missing': np.array([row['weighted_missing'] for row in rows], dtype=np.float64),
+        'assemblers_count': np.array([row['assemblers_count'] for row in rows], dtype=np.float64),
+    }
+    for name in ('weighted_missing', 'assemblers_count'):
+        peak = components[name].max()
+        if peak > 0:
+            components[name] = components[name] / peak
+
+    score = 100 * sum(weight * components[name] for name, weight in WEIGHTS.items())
+
+    # По убыванию индекса, при равенстве - по недостаче с учетом давности, затем по LM коду
+    lm_codes = np.array([row['lm_code'] for row in rows], dtype=object)
+    order = np.lexsort((lm_codes, -components['weighted_missing'], -score))
+    ranks = np.empty(len(rows), dtype=np.int64)
+    ranks[order] = np.arange(1, len(rows) + 1)
+
+    for row, value, rank in zip(rows, score.tolist(), ranks.tolist()):
+        row['score'] = value
+        row['rank'] = rank
+    return rows
+
+
+def refresh_chronic_shortages():
+    """Пересчитывает индекс хронической недостачи за окно CHRONIC_SHORTAGE_WINDOW_DAYS дней по вчерашний день"""
+    window_days = settings.CHRONIC_SHORTAGE_WINDOW_DAYS
+    last_day = timezone.localdate() - timedelta(days=1)
+    first_day = last_day - timedelta(days=window_days - 1)
+
+    started = time.monotonic()
+    rows = score_rows(
+        shortage_rows(first_day, last_day, settings.CHRONIC_SHORTAGE_HALF_LIFE_DAYS),
+        window_days,
+    )
+    computed_at = timezone.now()
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [CHRONIC_LOCK_KEY])
+        ChronicShortage.objects.all().delete()
+        ChronicShortage.objects.bulk_create(
+            (
+                ChronicShortage(**{
+                    **row,
+                    'title': row['title'] or '',
+                    'department_id': row['department_id'] or '',
+                    'computed_at': computed_at,
+                })
+                for row in rows
+            ),
+            batch_size=1000,
+        )
+
+    logger.info(
+        f"Индекс хронической недостачи пересчитан за {first_day} - {last_day}: "
+        f"{len(rows)} LM кодов за {time.monotonic() - started:.2f} с"
+    )
+    return len(rows)
@@ -0,0 +1,328 @@
+import time
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, F, Func, Max, Min, Value
+from django.db.models.functions import Coalesce, NullIf
+from loguru import logger
+
+from .models import DistinctSketch, PartiallyPickedAssembly, PartiallyPickedProduct
+from .rollups import _date_ranges
+
+# 2^12 регистров: стандартная ошибка оценки 1.04 / sqrt(4096) ~ 1.6%
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+
+# Строка скетчей дня по всем отделам
+ALL_DEPARTMENTS = '*'
+
+SKETCH_LOCK_KEY = 'particles_distinct_sketches'
+EXCLUDED_ZONE = 'WH'
+
+
+def _bit_length(values):
+    """Число значащих бит каждого элемента массива uint64 (двоичный поиск сдвигами)"""
+    values = values.copy()
+    lengths = np.zeros(values.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = values >= np.uint64(1 << shift)
+        values[mask] >>= np.uint64(shift)
+        lengths[mask] += shift
+    lengths += values > 0
+    return lengths
+
+
+def _positions(hashes):
+    """64-битные хеши -> (номер регистра, ранг = позиция первой единицы в оставшихся битах)"""
+    hashes = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+    index = (hashes >> np.uint64(64 - PRECISION)).astype(np.intp)
+    rest = hashes & np.uint64((1 << (64 - PRECISION)) - 1)
+    rank = (64 - PRECISION + 1 - _bit_length(rest)).astype(np.uint8)
+    return index, rank
+
+
+class HyperLogLog:
+    """
+    Скетч HyperLogLog для оценки числа различных значений по 64-битным хешам.
+    Скетчи объединяются поэлементным максимумом регистров, поэтому дневные скетчи
+    складываются в скетч любого периода без обращения к исходным данным
+    """
+
+    def __init__(self, registers=None):
+        if registers is None:
+            registers = np.zeros(REGISTERS, dtype=np.uint8)
+        self.registers = registers
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(np.frombuffer(zlib.decompress(data), dtype=np.uint8))
+
+    def to_bytes(self):
+        # Скетчи дня по отделу почти пустые и хорошо сжимаются
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def union(cls, sketches):
+        registers = [sketch.registers for sketch in sketches]
+        if not registers:
+            return cls()
+        return cls(np.maximum.reduce(registers))
+
+    def add_hashes(self, hashes):
+        index, rank = _positions(hashes)
+        registers = self.registers.copy()
+        np.maximum.at(registers, index, rank)
+        self.registers = registers
+
+    def cardinality(self):
+        registers = self.registers.astype(np.float64)
+        alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+        estimate = alpha * REGISTERS ** 2 / np.sum(np.exp2(-registers))
+
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Малые значения точнее оцениваются по доле пустых регистров
+            estimate = REGISTERS * np.log(REGISTERS / zeros)
+
+        return int(round(estimate))
+
+
+def union_cardinality(blobs):
+    """Оценка числа различных значений по сохраненным скетчам"""
+    return HyperLogLog.union(HyperLogLog.from_bytes(blob) for blob in blobs).cardinality()
+
+
+def _lock_dates(dates):
+    """Блокировки дат до конца транзакции (в одном порядке во всех транзакциях)"""
+    with connection.cursor() as cursor:
+        for day in sorted(set(dates)):
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f'{SKETCH_LOCK_KEY}:{day}'])
+
+
+def _days(first_day, last_day):
+    return [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+
+
+def _hash(expression):
+    return Func(expression, Value(0), function='hashtextextended', output_field=BigIntegerField())
+
+
+def _sketch_rows(**filters):
+    """Хеши LM кода и сборщика для каждого товара (хеш пустого сборщика - 0, он не учитывается)"""
+    return PartiallyPickedProduct.objects.filter(
+        assembly__black_list=False,
+        black_list=False,
+        **filters,
+    ).exclude(
+        assembly__assembly_zone=EXCLUDED_ZONE
+    ).annotate(
+        date=F('assembly__created_date'),
+        department_key=Coalesce(F('department_id'), Value('')),
+        product_hash=_hash(F('lm_code')),
+        assembler_hash=Coalesce(_hash(NullIf(F('assembly__assembler'), Value(''))), Value(0)),
+    ).values_list('date', 'department_key', 'product_hash', 'assembler_hash').order_by()
+
+
+def _build(rows):
+    """
+    Регистры по (дата, отдел) и (дата, все отделы): {ключ: (регистры LM кодов, регистры сборщиков)}.
+    Все регистры считаются одним проходом numpy
+    """
+    cells = {}
+    groups, product_hashes, assembler_hashes = [], [], []
+    for day, department, product_hash, assembler_hash in rows.iterator(chunk_size=5000):
+        for key in ((day, department), (day, ALL_DEPARTMENTS)):
+            groups.append(cells.setdefault(key, len(cells)))
+            product_hashes.append(product_hash)
+            assembler_hashes.append(assembler_hash)
+
+    if not cells:
+        return {}
+
+    groups = np.array(groups, dtype=np.intp)
+    product_hashes = np.array(product_hashes, dtype=np.int64)
+    assembler_hashes = np.array(assembler_hashes, dtype=np.int64)
+
+    products = np.zeros((len(cells), REGISTERS), dtype=np.uint8)
+    index, rank = _positions(product_hashes)
+    np.maximum.at(products, (groups, index), rank)
+
+    assemblers = np.zeros((len(cells), REGISTERS), dtype=np.uint8)
+    known = assembler_hashes != 0
+    index, rank = _positions(assembler_hashes[known])
+    np.maximum.at(assemblers, (groups[known], index), rank)
+
+    return {key: (products[group], assemblers[group]) for key, group in cells.items()}
+
+
+def _refresh_range(first_day, last_day):
+    """Пересоздает скетчи дней периода из исходных данных (под блокировками дат)"""
+    _lock_dates(_days(first_day, last_day))
+    cells = _build(_sketch_rows(assembly__created_date__gte=first_day, assembly__created_date__lte=last_day))
+    DistinctSketch.objects.filter(date__gte=first_day, date__lte=last_day).delete()
+    DistinctSketch.objects.bulk_create(
+        [
+            DistinctSketch(
+                date=day,
+                department_id=department,
+                products=HyperLogLog(products).to_bytes(),
+                assemblers=HyperLogLog(assemblers).to_bytes(),
+            )
+            for (day, department), (products, assemblers) in cells.items()
+        ],
+        batch_size=500,
+    )
+
+
+def refresh_distinct_sketches(dates):
+    """Пересчитывает скетчи за указанные местные даты, каждый период дней - отдельная транзакция"""
+    for first_day, last_day in _date_ranges(set(dates)):
+        with transaction.atomic():
+            _refresh_range(first_day, last_day)
+
+
+def add_assemblies(assembly_ids):
+    """
+    Добавляет товары новых сборок в регистры скетчей их дней без пересчета дня:
+    регистры объединяются максимумом, поэтому повторное добавление ничего не меняет
+    """
+    cells = _build(_sketch_rows(assembly_id__in=assembly_ids))
+    if not cells:
+        return
+
+    dates = {day for day, _ in cells}
+    with transaction.atomic():
+        _lock_dates(dates)
+        existing = {
+            (sketch.date, sketch.department_id): sketch
+            for sketch in DistinctSketch.objects.filter(date__in=dates)
+        }
+
+        changed, created = [], []
+        for (day, department), (products, assemblers) in cells.items():
+            sketch = existing.get((day, department))
+            if sketch is None:
+                created.append(DistinctSketch(
+                    date=day,
+                    department_id=department,
+                    products=HyperLogLog(products).to_bytes(),
+                    assemblers=HyperLogLog(assemblers).to_bytes(),
+                ))
+                continue
+            sketch.products = HyperLogLog.union([
+                HyperLogLog.from_bytes(sketch.products), HyperLogLog(products)
+            ]).to_bytes()
+            sketch.assemblers = HyperLogLog.union([
+                HyperLogLog.from_bytes(sketch.assemblers), HyperLogLog(assemblers)
+            ]).to_bytes()
+            changed.append(sketch)
+
+        DistinctSketch.objects.bulk_update(changed, ['products', 'assemblers'], batch_size=500)
+        DistinctSketch.objects.bulk_create(created, batch_size=500)
+
+
+def mark_stale(dates):
+    """
+    Помечает дни для пересчета фоновой задачей (refresh_stale_distinct_sketches) флагом
+    на строке дня по всем отделам. Под блокировками дат: пометка не потеряется, если день в это время пересчитывается
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return
+    empty = HyperLogLog().to_bytes()
+    with transaction.atomic():
+        _lock_dates(dates)
+        DistinctSketch.objects.bulk_create(
+            [
+                DistinctSketch(date=day, department_id=ALL_DEPARTMENTS, products=empty, assemblers=empty, stale=True)
+                for day in dates
+            ],
+            update_conflicts=True,
+            unique_fields=['date', 'department_id'],
+            update_fields=['stale'],
+        )
+
+
+def mark_stale_for_assemblies(assembly_ids):
+    """Помечает дни, в которые созданы указанные сборки"""
+    dates = PartiallyPickedAssembly.objects.filter(
+        pk__in=assembly_ids
+    ).values_list('created_date', flat=True).distinct().order_by()
+    mark_stale(list(dates))
+
+
+def refresh_stale_distinct_sketches():
+    """Пересчитывает помеченные дни, возвращает их число"""
+    dates = list(DistinctSketch.objects.filter(stale=True).values_list('date', flat=True).distinct().order_by('date'))
+    if not dates:
+        return 0
+
+    started = time.monotonic()
+    refresh_distinct_sketches(dates)
+    logger.debug(f"Скетчи уникальных значений пересчитаны за {len(dates)} дн: {time.monotonic() - started:.2f} с")
+    return len(dates)
+
+
+def rebuild_distinct_sketches(days_per_batch=31):
+    """
+    Пересоздает скетчи из исходных данных порциями по days_per_batch дней.
+    Дни без данных внутри сохраненного диапазона очищаются
+    """
+    bounds = [
+        PartiallyPickedAssembly.objects.aggregate(first=Min('created_date'), last=Max('created_date')),
+        DistinctSketch.objects.aggregate(first=Min('date'), last=Max('date')),
+    ]
+    firsts = [bound['first'] for bound in bounds if bound['first'] is not None]
+    if not firsts:
+        return 0
+    day = min(firsts)
+    last = max(bound['last'] for bound in bounds if bound['last'] is not None)
+
+    batches = 0
+    while day <= last:
+        last_day = min(day + timedelta(days=days_per_batch - 1), last)
+        with transaction.atomic():
+            _refresh_range(day, last_day)
+        logger.info(f"Скетчи уникальных значений пересчитаны за {day} - {last_day}")
+        day = last_day + timedelta(days=1)
+        batches += 1
+
+    return batches
+
+
+def department_cardinalities(sketches):
+    """
+    Оценки уникальных товаров и сборщиков по отделам за период.
+    sketches - queryset DistinctSketch, уже отфильтрованный по датам
+    """
+    blobs = defaultdict(lambda: ([], []))
+    rows = sketches.exclude(
+        department_id__in=(ALL_DEPARTMENTS, '')
+    ).values_list('department_id', 'products', 'assemblers')
+    for department, products, assemblers in rows:
+        blobs[department][0].append(products)
+        blobs[department][1].append(assemblers)
+
+    return {
+        department: {
+            'unique_products': union_cardinality(products),
+            'unique_assemblers': union_cardinality(assemblers),
+        }
+        for department, (products, assemblers) in blobs.items()
+    }
+
+
+def on_assemblies_changed(sender, assembly_ids, created_ids=(), **kwargs):
+    # Товары новых сборок только добавляются в регистры. Исключения (черный список, повторный прием)
+    # HyperLogLog не поддерживает, поэтому такие дни помечаются и пересчитываются фоновой задачей.
+    # Скетчи можно пересобрать командой rebuild_rollups, поэтому ошибка не ломает прием данных
+    try:
+        created_ids = set(created_ids) & set(assembly_ids)
+        if created_ids:
+            add_assemblies(created_ids)
+        mark_stale_for_assemblies(set(assembly_ids) - created_ids)
+    except Exception as e:
+        logger.exception(f"Ошибка обновления скетчей уникальных значений: {e}")
@@ -0,0 +1,161 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from loguru import logger
+
+from .exports import (
+    EXPORT_WRITERS,
+    export_key,
+    filter_export_assemblies,
+    iter_export_rows,
+    normalize_export_params,
+)
+from .models import ExportJob
+
+ACTIVE_STATUSES = [ExportJob.STATUS_PENDING, ExportJob.STATUS_RUNNING]
+
+
+def _reusable_jobs(key):
+    """Задачи с тем же ключом: в очереди, в работе или с еще не устаревшим файлом"""
+    return ExportJob.objects.filter(key=key).filter(
+        Q(status__in=ACTIVE_STATUSES)
+        | Q(status=ExportJob.STATUS_DONE, expires_at__gt=timezone.now())
+    ).order_by('-created_at')
+
+
+def enqueue_export(params, export_format):
+    """
+    Ставит экспорт в очередь или возвращает уже существующую задачу с теми же фильтрами.
+    Возвращает (задача, создана ли новая)
+    """
+    key = export_key(params, export_format)
+
+    for _ in range(2):
+        job = _reusable_jobs(key).first()
+        if job:
+            ExportJob.objects.filter(pk=job.pk).update(requests_count=F('requests_count') + 1)
+            return job, False
+
+        try:
+            with transaction.atomic():
+                job = ExportJob.objects.create(
+                    key=key,
+                    export_format=export_format,
+                    params=normalize_export_params(params),
+                )
+            return job, True
+        except IntegrityError:
+            # Параллельный запрос успел поставить такую же задачу - используем ее
+            continue
+
+    return _reusable_jobs(key).first(), False
+
+
+def _claim_next_job():
+    """Забирает старейшую задачу из очереди, не мешая другим обработчикам"""
+    with transaction.atomic():
+        job = ExportJob.objects.select_for_update(skip_locked=True).filter(
+            status=ExportJob.STATUS_PENDING
+        ).order_by('created_at').first()
+
+        if job is None:
+            return None
+
+        job.status = ExportJob.STATUS_RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+        return job
+
+
+def _count_rows(rows, counter):
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+def run_export_job(job):
+    """Строит файл экспорта во временный файл и атомарно переносит его в кеш"""
+    os.makedirs(settings.EXPORT_CACHE_DIR, exist_ok=True)
+    file_path = os.path.join(settings.EXPORT_CACHE_DIR, f'{job.key}.{job.export_format}')
+    tmp_path = f'{file_path}.{job.pk}.tmp'
+
+    counter = [0]
+    try:
+        rows = _count_rows(iter_export_rows(filter_export_assemblies(job.params)), counter)
+        with open(tmp_path, 'wb') as export_file:
+            EXPORT_WRITERS[job.export_format](rows, export_file)
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        logger.exception(f"Ошибка экспорта {job.pk}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        job.status = ExportJob.STATUS_FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job
+
+    now = timezone.now()
+    job.status = ExportJob.STATUS_DONE
+    job.file_path = file_path
+    job.file_size = os.path.getsize(file_path)
+    job.rows_count = counter[0]
+    job.finished_at = now
+    job.expires_at = now + timedelta(seconds=settings.EXPORT_CACHE_TTL)
+    job.save(update_fields=['status', 'file_path', 'file_size', 'rows_count', 'finished_at', 'expires_at'])
+
+    logger.info(
+        f"Экспорт {job.pk} ({job.export_format}) готов: {job.rows_count} строк, "
+        f"{job.file_size} байт за {(now - job.started_at).total_seconds():.1f} с"
+    )
+    return job
+
+
+def process_export_jobs(max_jobs=10):
+    """Обрабатывает задачи из очереди (запускается планировщиком)"""
+    processed = 0
+    while processed < max_jobs:
+        job = _claim_next_job()
+        if job is None:
+            break
+        run_export_job(job)
+        processed += 1
+    return processed
+
+
+def evict_expired_exports():
+    """
+    Удаляет устаревшие файлы и задачи.
+    Зависшие задачи (обработчик упал во время экспорта) помечаются ошибкой
+    """
+    now = timezone.now()
+
+    ExportJob.objects.filter(
+        status=ExportJob.STATUS_RUNNING,
+        started_at__lt=now - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    ).update(status=ExportJob.STATUS_FAILED, error='Превышено время выполнения', finished_at=now)
+
+    expired = ExportJob.objects.filter(
+        Q(status=ExportJob.STATUS_DONE, expires_at__lte=now)
+        | Q(status=ExportJob.STATUS_FAILED, created_at__lte=now - timedelta(seconds=settings.EXPORT_CACHE_TTL))
+    )
+
+    # Файл с тем же ключом мог быть перезаписан более новой задачей - его не трогаем
+    active_files = set(
+        ExportJob.objects.filter(
+            Q(status__in=ACTIVE_STATUSES) | Q(status=ExportJob.STATUS_DONE, expires_at__gt=now)
+        ).exclude(file_path='').values_list('file_path', flat=True)
+    )
+
+    removed = 0
+    for job in expired:
+        if job.file_path and job.file_path not in active_files and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+            removed += 1
+        job.delete()
+
+    return removed
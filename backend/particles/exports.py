@@ -0,0 +1,255 @@
+import csv
+import hashlib
+import json
+import pickle
+import tempfile
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Count, F, Window
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+from .models import PartiallyPickedAssembly
+
+EXPORT_CHUNK_SIZE = 2000
+PARQUET_BATCH_SIZE = 50000
+MAX_COLUMN_WIDTH = 50
+
+# Формат выгрузки -> Content-Type
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+EXPORT_HEADERS = [
+    '№',
+    'Номер заказа',
+    'ID задачи',
+    'Зона сборки',
+    'Сборщик',
+    'Дата создания',
+    'Время создания',
+    'LM код',
+    'Отдел',
+    'Название товара',
+    'Не хватает',
+    'Статус',
+    'Количество товаров',
+]
+
+
+EXPORT_FILTERS = ('assembler', 'order_number', 'date_from', 'date_to')
+
+
+def normalize_export_params(params):
+    """Оставляет только непустые фильтры экспорта, чтобы одинаковые запросы давали один ключ"""
+    normalized = {}
+    for name in EXPORT_FILTERS:
+        value = (params.get(name) or '').strip()
+        if value:
+            normalized[name] = value
+    return normalized
+
+
+def export_key(params, export_format):
+    """Ключ задачи экспорта: хеш нормализованных фильтров и формата"""
+    payload = json.dumps(
+        {'format': export_format, 'filters': normalize_export_params(params)},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def filter_export_assemblies(params):
+    """Сборки для экспорта с учетом фильтров из GET-параметров"""
+    assembler = params.get('assembler', '')
+    order_number = params.get('order_number', '')
+    date_from = params.get('date_from', '')
+    date_to = params.get('date_to', '')
+
+    queryset = PartiallyPickedAssembly.objects.all()
+
+    if assembler:
+        queryset = queryset.filter(assembler=assembler)
+
+    if order_number:
+        queryset = queryset.filter(order_number__icontains=order_number)
+
+    if date_from:
+        queryset = queryset.filter(created_date__gte=date_from)
+
+    if date_to:
+        queryset = queryset.filter(created_date__lte=date_to)
+
+    return queryset
+
+
+def is_sync_export(assemblies):
+    """
+    Экспорт достаточно мал, чтобы отдать его сразу, без очереди.
+    Считается не больше EXPORT_SYNC_MAX_ASSEMBLIES + 1 сборок, поэтому проверка дешевая и на всей таблице
+    """
+    limit = settings.EXPORT_SYNC_MAX_ASSEMBLIES
+    return assemblies.order_by()[:limit + 1].count() <= limit
+
+
+def iter_export_rows(assemblies, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Строки экспорта одним запросом сборки LEFT JOIN товары.
+    Количество товаров в сборке считается оконной функцией, строки читаются
+    серверным курсором порциями, поэтому память не зависит от объема выгрузки
+    """
+    rows = assemblies.annotate(
+        products_total=Window(Count('products__id'), partition_by=[F('id')]),
+    ).order_by('-timestamp', 'id', 'products__id').values_list(
+        'order_number',
+        'task_id',
+        'assembly_zone',
+        'assembler',
+        'created_at',
+        'products__id',
+        'products__lm_code',
+        'products__department_id',
+        'products__title',
+        'products__missing_quantity',
+        'status_str',
+        'products_total',
+    )
+
+    for number, row in enumerate(rows.iterator(chunk_size=chunk_size), start=1):
+        (order_number, task_id, zone, assembler, created_at, product_id,
+         lm_code, department_id, title, missing_quantity, status_str, products_total) = row
+
+        if product_id is None:
+            lm_code = department_id = '-'
+            title = 'Нет товаров'
+            missing_quantity = 0
+        else:
+            lm_code = lm_code or '-'
+            department_id = department_id or '-'
+            title = title or 'Без названия'
+            missing_quantity = missing_quantity or 0
+
+        yield (
+            number,
+            order_number,
+            task_id,
+            zone or '-',
+            assembler or 'Не указан',
+            created_at.strftime('%d.%m.%Y'),
+            created_at.strftime('%H:%M'),
+            lm_code,
+            department_id,
+            title,
+            missing_quantity,
+            status_str,
+            products_total,
+        )
+
+
+def write_xlsx(rows, fileobj, sheet_name='Сборки', chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Пишет строки в XLSX в режиме write_only (строки сразу уходят во временный XML, а не в память).
+    В write_only ширину колонок нужно задать до первой строки, поэтому строки сначала
+    порциями сбрасываются во временный файл, пока считается максимальная ширина по всем строкам
+    """
+    widths = [len(header) for header in EXPORT_HEADERS]
+
+    rows = iter(rows)
+    with tempfile.TemporaryFile() as spool:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for idx, column in enumerate(zip(*chunk)):
+                widths[idx] = max(widths[idx], max(map(len, map(str, column))))
+            pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(sheet_name)
+        for idx, width in enumerate(widths, start=1):
+            worksheet.column_dimensions[get_column_letter(idx)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+        worksheet.append(EXPORT_HEADERS)
+        spool.seek(0)
+        while True:
+            try:
+                chunk = pickle.load(spool)
+            except EOFError:
+                break
+            for row in chunk:
+                worksheet.append(row)
+
+        workbook.save(fileobj)
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает записанную строку вместо буферизации"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """
+    Генератор CSV для StreamingHttpResponse.
+    BOM в начале нужен, чтобы Excel корректно открыл кириллицу
+    """
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow(EXPORT_HEADERS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_parquet(rows, fileobj, batch_size=PARQUET_BATCH_SIZE):
+    """
+    Пишет строки в Parquet порциями: каждая порция собирается в колонки
+    и записывается отдельной row group. Сборщик, зона и отдел хранятся словарем
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([
+        ('№', pa.int64()),
+        ('Номер заказа', pa.string()),
+        ('ID задачи', pa.string()),
+        ('Зона сборки', dictionary),
+        ('Сборщик', dictionary),
+        ('Дата создания', pa.string()),
+        ('Время создания', pa.string()),
+        ('LM код', pa.string()),
+        ('Отдел', dictionary),
+        ('Название товара', pa.string()),
+        ('Не хватает', pa.int64()),
+        ('Статус', pa.string()),
+        ('Количество товаров', pa.int64()),
+    ])
+
+    rows = iter(rows)
+    with pq.ParquetWriter(fileobj, schema, compression='snappy') as writer:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            columns = [
+                pa.array(values, type=field.type) if not pa.types.is_dictionary(field.type)
+                else pa.array(values, type=pa.string()).dictionary_encode()
+                for values, field in zip(zip(*batch), schema)
+            ]
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+
+
+def write_csv(rows, fileobj):
+    for chunk in iter_csv(rows):
+        fileobj.write(chunk.encode('utf-8'))
+
+
+EXPORT_WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv,
+    'parquet': write_parquet,
+}
@@ -0,0 +1,163 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from loguru import logger
+
+from .models import ShortageForecast
+from .statistics import DashboardFilters, DashboardStatistics
+
+HOURS = 24
+# Скользящее среднее за неделю (по тем же часам)
+ROLLING_DAYS = 7
+# Прогнозы старше этого срока удаляются при пересчете
+FORECAST_RETENTION = timedelta(days=30)
+
+METRICS = ('products', 'missing')
+
+FORECAST_LOCK_KEY = 'particles_shortage_forecast'
+
+
+def rolling_mean(values, window):
+    """
+    Скользящее среднее по последней оси для всех рядов сразу (через накопленные суммы).
+    Первые window - 1 значений - среднее по доступной части окна
+    """
+    cumulative = np.cumsum(values, axis=-1, dtype=np.float64)
+    shifted = np.zeros_like(cumulative)
+    shifted[..., window:] = cumulative[..., :-window]
+    counts = np.minimum(np.arange(1, values.shape[-1] + 1), window)
+    return (cumulative - shifted) / counts
+
+
+def exponential_smoothing(values, alpha):
+    """
+    Простое экспоненциальное сглаживание по последней оси: level[t] = alpha * x[t] + (1 - alpha) * level[t - 1].
+    Цикл идет по дням, каждый шаг обновляет все ряды одной векторной операцией
+    """
+    values = np.asarray(values, dtype=np.float64)
+    levels = np.empty_like(values)
+    level = values[..., 0]
+    levels[..., 0] = level
+    for day in range(1, values.shape[-1]):
+        level = alpha * values[..., day] + (1 - alpha) * level
+        levels[..., day] = level
+    return levels
+
+
+def forecast_next(values, alpha=None):
+    """
+    Прогноз на следующий день для рядов values[метрика, ряд, день]:
+    (прогноз по экспоненциальному сглаживанию, скользящее среднее за ROLLING_DAYS дней)
+    """
+    if alpha is None:
+        alpha = settings.FORECAST_SMOOTHING
+    return exponential_smoothing(values, alpha)[..., -1], rolling_mean(values, ROLLING_DAYS)[..., -1]
+
+
+def load_series(first_day, last_day):
+    """
+    Ряды (отдел, час) по дням из агрегатов товаров одним запросом:
+    (отделы, массив [метрика, отдел * 24 + час, день]) с нулями в днях без недостачи
+    """
+    rows = DashboardStatistics(DashboardFilters(date_from=first_day, date_to=last_day)).product_rollups().exclude(
+        department_id=''
+    ).values('department_id', 'date', 'hour').annotate(
+        products=Sum('products_count'),
+        missing=Sum('missing_quantity'),
+    ).order_by().values_list('department_id', 'date', 'hour', *METRICS)
+
+    days = (last_day - first_day).days + 1
+    if not rows:
+        return [], np.zeros((len(METRICS), 0, days))
+
+    departments, dates, hours, *metrics = zip(*rows)
+    labels, department_index = np.unique(np.array(departments, dtype=object), return_inverse=True)
+    series = department_index * HOURS + np.array(hours, dtype=np.intp)
+    day_index = np.array([(day - first_day).days for day in dates], dtype=np.intp)
+
+    values = np.zeros((len(METRICS), len(labels) * HOURS, days))
+    for position, metric in enumerate(metrics):
+        values[position, series, day_index] = metric
+    return labels.tolist(), values
+
+
+def history_range(target):
+    """Дни истории для прогноза на target: FORECAST_HISTORY_DAYS дней по предыдущий день"""
+    last_day = target - timedelta(days=1)
+    return last_day - timedelta(days=settings.FORECAST_HISTORY_DAYS - 1), last_day
+
+
+def refresh_forecasts():
+    """
+    Прогноз недостачи на сегодня по каждому (отдел, час) по истории FORECAST_HISTORY_DAYS дней до вчера.
+    Запускается ночью, когда вчерашний день уже закрыт
+    """
+    started = time.monotonic()
+    target = timezone.localdate()
+    departments, values = load_series(*history_range(target))
+    forecast, mean = forecast_next(values)
+
+    computed_at = timezone.now()
+    series = np.arange(len(departments) * HOURS)
+    forecasts = [
+        ShortageForecast(
+            date=target,
+            department_id=departments[index // HOURS],
+            hour=index % HOURS,
+            products=products,
+            missing=missing,
+            products_mean=products_mean,
+            missing_mean=missing_mean,
+            computed_at=computed_at,
+        )
+        for index, products, missing, products_mean, missing_mean in zip(
+            series.tolist(), *forecast.tolist(), *mean.tolist()
+        )
+    ]
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [FORECAST_LOCK_KEY])
+        ShortageForecast.objects.filter(date=target).delete()
+        ShortageForecast.objects.filter(date__lt=target - FORECAST_RETENTION).delete()
+        ShortageForecast.objects.bulk_create(forecasts, batch_size=1000)
+
+    logger.info(
+        f"Прогноз недостачи на {target} по {len(forecasts)} рядам за {time.monotonic() - started:.2f} с"
+    )
+    return len(forecasts)
+
+
+def forecast_table(day, department_id=None):
+    """
+    Сохраненный прогноз дня для дашборда:
+    {'date', 'hours', 'rows': [{'department_id', 'missing': [24 значения], 'products': [...], 'total_missing'}]}
+    """
+    queryset = ShortageForecast.objects.filter(date=day)
+    if department_id:
+        queryset = queryset.filter(department_id=department_id)
+
+    rows = {}
+    for department, hour, products, missing in queryset.values_list(
+        'department_id', 'hour', 'products', 'missing'
+    ).order_by('department_id', 'hour'):
+        row = rows.setdefault(department, {
+            'department_id': department, 'products': [0.0] * HOURS, 'missing': [0.0] * HOURS,
+        })
+        row['products'][hour] = products
+        row['missing'][hour] = missing
+
+    for row in rows.values():
+        row['total_missing'] = sum(row['missing'])
+        row['total_products'] = sum(row['products'])
+
+    return {
+        'date': day,
+        'hours': list(range(HOURS)),
+        'rows': sorted(rows.values(), key=lambda row: row['total_missing'], reverse=True),
+    }
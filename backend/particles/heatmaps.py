@@ -0,0 +1,79 @@
+import numpy as np
+from django.db.models import Sum
+from django.db.models.functions import ExtractIsoWeekDay
+
+from .statistics import DashboardStatistics
+
+HOURS = 24
+WEEKDAYS = 7
+
+# Тепловые карты: имя -> (строки, столбцы)
+HEATMAPS = {
+    'zone_hour': ('zone', 'hour'),
+    'department_hour': ('department', 'hour'),
+    'department_weekday': ('department', 'weekday'),
+}
+
+# Значения в ячейках: имя -> поле агрегата товаров
+VALUES = {
+    'products': 'products_count',
+    'missing': 'missing_quantity',
+    'critical': 'critical_count',
+}
+
+
+class Heatmaps:
+    """
+    Плотные матрицы недостачи: зона x час, отдел x час, отдел x день недели.
+    Все карты строятся из одного сгруппированного запроса к агрегатам товаров
+    по (зона, отдел, день недели, час), который раскладывается в матрицы NumPy
+    """
+
+    def __init__(self, filters):
+        self.filters = filters
+
+    def cells(self):
+        """Ячейки (зона, отдел, день недели 1-7, час) за период с учетом фильтров дашборда"""
+        return DashboardStatistics(self.filters).product_rollups().annotate(
+            weekday=ExtractIsoWeekDay('date'),
+        ).values('assembly_zone', 'department_id', 'weekday', 'hour').annotate(
+            **{name: Sum(field) for name, field in VALUES.items()}
+        ).order_by().values_list('assembly_zone', 'department_id', 'weekday', 'hour', *VALUES)
+
+    def build(self):
+        """
+        {'zone_hour': {'rows': [...], 'columns': [...], 'products': [[...]], 'missing': ..., 'critical': ...}, ...}.
+        Часы - столбцы 0-23, дни недели - 1 (понедельник) - 7, строки - зоны или отделы по возрастанию
+        """
+        rows = list(self.cells())
+        columns = list(zip(*rows)) if rows else [()] * (4 + len(VALUES))
+
+        zones, zone_index = np.unique(np.array(columns[0], dtype=object), return_inverse=True)
+        departments, department_index = np.unique(np.array(columns[1], dtype=object), return_inverse=True)
+        axes = {
+            'zone': (zones.tolist(), zone_index),
+            'department': (departments.tolist(), department_index),
+            'weekday': (list(range(1, WEEKDAYS + 1)), np.array(columns[2], dtype=np.intp) - 1),
+            'hour': (list(range(HOURS)), np.array(columns[3], dtype=np.intp)),
+        }
+        values = {
+            name: np.array(column, dtype=np.int64)
+            for name, column in zip(VALUES, columns[4:])
+        }
+
+        result = {}
+        for name, (row_axis, column_axis) in HEATMAPS.items():
+            row_labels, row_index = axes[row_axis]
+            column_labels, column_index = axes[column_axis]
+            shape = (len(row_labels), len(column_labels))
+            # Номер ячейки матрицы для каждой строки запроса: суммирование одним bincount
+            flat = np.ravel_multi_index((row_index, column_index), shape) if rows else np.zeros(0, dtype=np.intp)
+
+            heatmap = {'rows': row_labels, 'columns': column_labels}
+            for value, weights in values.items():
+                heatmap[value] = np.bincount(
+                    flat, weights=weights, minlength=shape[0] * shape[1]
+                ).astype(np.int64).reshape(shape).tolist()
+            result[name] = heatmap
+
+        return result
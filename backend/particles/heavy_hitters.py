@@ -0,0 +1,388 @@
+import heapq
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from loguru import logger
+
+from .models import PartiallyPickedAssembly, PartiallyPickedProduct, TopProductsSketch
+
+# Число счетчиков в часовом скетче: погрешность часа не больше (вес часа) / SKETCH_CAPACITY
+SKETCH_CAPACITY = 200
+# Скетчи старше этого срока не нужны ни одному окну и удаляются планировщиком
+SKETCH_RETENTION = timedelta(days=8)
+
+# Префикс ключей блокировок часов
+SKETCH_LOCK_KEY = 'particles_top_products'
+EXCLUDED_ZONE = 'WH'
+
+METRIC_MISSING = 'missing'
+METRIC_OCCURRENCES = 'occurrences'
+METRICS = (METRIC_MISSING, METRIC_OCCURRENCES)
+
+WINDOW_HOUR = 'hour'
+WINDOW_TODAY = 'today'
+WINDOW_WEEK = 'week'
+WINDOWS = (WINDOW_HOUR, WINDOW_TODAY, WINDOW_WEEK)
+
+
+class SpaceSaving:
+    """
+    Скетч Space-Saving для взвешенных частот: не больше capacity счетчиков.
+    Для каждого элемента хранится [оценка, погрешность], истинное значение
+    лежит в [оценка - погрешность, оценка]. Элемент без счетчика встречался
+    не больше min_count раз. Скетчи объединяются (merge) без потери этих гарантий
+    """
+
+    def __init__(self, capacity=SKETCH_CAPACITY, counters=None, floor=0):
+        self.capacity = capacity
+        self.counters = counters if counters is not None else {}
+        # Граница для элементов без счетчика, пока скетч не заполнен (у объединенного скетча не ноль)
+        self.floor = floor
+        # Куча (оценка, элемент) для поиска минимума, строится при первом вытеснении.
+        # Оценки только растут, поэтому устаревшие записи просто пропускаются
+        self._heap = None
+
+    @property
+    def min_count(self):
+        """Верхняя граница значения любого элемента, для которого нет счетчика"""
+        if len(self.counters) < self.capacity:
+            return self.floor
+        return min(count for count, _ in self.counters.values())
+
+    def add(self, item, weight=1):
+        if weight <= 0:
+            return
+
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            counter = self.counters[item] = [self.floor + weight, self.floor]
+        else:
+            # Вытесняем минимальный счетчик: новый элемент мог встречаться не больше его значения
+            floor = self._pop_min()
+            counter = self.counters[item] = [floor + weight, floor]
+
+        if self._heap is not None:
+            heapq.heappush(self._heap, (counter[0], item))
+
+    def _pop_min(self):
+        if self._heap is None:
+            self._heap = [(count, item) for item, (count, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+
+        while True:
+            count, item = heapq.heappop(self._heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                del self.counters[item]
+                return count
+
+    @classmethod
+    def merge(cls, sketches, capacity=SKETCH_CAPACITY):
+        """
+        Объединение скетчей: отсутствующий в скетче элемент получает его min_count
+        и в оценку, и в погрешность. Остаются capacity наибольших оценок
+        """
+        # Каждому элементу сначала начисляется сумма min_count всех скетчей,
+        # затем в скетчах, где счетчик есть, min_count заменяется его значением
+        total_floor = 0
+        deltas = {}
+        for sketch in sketches:
+            floor = sketch.min_count
+            total_floor += floor
+            for item, (count, error) in sketch.counters.items():
+                delta = deltas.get(item)
+                if delta is None:
+                    deltas[item] = [count - floor, error - floor]
+                else:
+                    delta[0] += count - floor
+                    delta[1] += error - floor
+
+        counters = {
+            item: [total_floor + count, total_floor + error]
+            for item, (count, error) in deltas.items()
+        }
+
+        merged = cls(capacity, floor=total_floor)
+        if len(counters) > capacity:
+            # Отброшенные элементы не больше наименьшей оставшейся оценки - гарантия min_count сохраняется
+            keep = sorted(counters.items(), key=lambda pair: pair[1][0], reverse=True)[:capacity]
+            counters = dict(keep)
+        merged.counters = counters
+        return merged
+
+    def top(self, k):
+        """
+        k наибольших элементов: [(элемент, оценка, погрешность, гарантирован), ...].
+        Гарантирован - нижняя граница элемента не меньше оценки любого элемента за пределами топа
+        """
+        ranked = sorted(self.counters.items(), key=lambda pair: pair[1][0], reverse=True)
+        outside = ranked[k][1][0] if len(ranked) > k else self.min_count
+        return [
+            (item, count, error, count - error >= outside)
+            for item, (count, error) in ranked[:k]
+        ]
+
+
+def _lock_hours(hours):
+    """Блокировки часов до конца транзакции (в одном порядке во всех транзакциях)"""
+    with connection.cursor() as cursor:
+        for day, hour in sorted(hours):
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f'{SKETCH_LOCK_KEY}:{day}:{hour}'])
+
+
+def _window_products():
+    return PartiallyPickedProduct.objects.filter(
+        black_list=False,
+        assembly__black_list=False,
+    ).exclude(assembly__assembly_zone=EXCLUDED_ZONE)
+
+
+def _retained(hours):
+    oldest = timezone.localdate() - SKETCH_RETENTION
+    return sorted({(day, hour) for day, hour in hours if day >= oldest})
+
+
+def build_hour_sketches(day, hour):
+    """Скетчи часа: все товары часа проходят через Space-Saving одним потоком"""
+    sketches = {metric: SpaceSaving() for metric in METRICS}
+
+    rows = _window_products().filter(
+        assembly__created_date=day,
+        assembly__created_hour=hour,
+    ).values_list('lm_code', 'missing_quantity').order_by()
+
+    for lm_code, missing_quantity in rows.iterator(chunk_size=2000):
+        sketches[METRIC_MISSING].add(lm_code, missing_quantity or 0)
+        sketches[METRIC_OCCURRENCES].add(lm_code)
+
+    return sketches
+
+
+def refresh_sketches(hours):
+    """
+    Пересобирает скетчи указанных часов [(местная дата, час), ...].
+    Час пересобирается целиком, поэтому учитываются и исключения из данных (черный список),
+    которые Space-Saving сам по себе не поддерживает. Каждый час - отдельная транзакция
+    """
+    for day, hour in _retained(hours):
+        with transaction.atomic():
+            _lock_hours([(day, hour)])
+            sketches = build_hour_sketches(day, hour)
+            TopProductsSketch.objects.update_or_create(
+                date=day,
+                hour=hour,
+                defaults={
+                    'missing': sketches[METRIC_MISSING].counters,
+                    'occurrences': sketches[METRIC_OCCURRENCES].counters,
+                    'stale': False,
+                },
+            )
+
+
+def add_assemblies(assembly_ids):
+    """
+    Добавляет товары новых сборок в скетчи их часов: скетч новых товаров объединяется (merge)
+    с сохраненным под блокировкой часа. Вызывается в транзакции приема данных, поэтому
+    пересборка часа видит либо все новые товары вместе с их вкладом в скетч, либо ни одного
+    """
+    rows = _window_products().filter(assembly_id__in=assembly_ids).values_list(
+        'assembly__created_date', 'assembly__created_hour', 'lm_code', 'missing_quantity'
+    ).order_by()
+
+    added = {}
+    for day, hour, lm_code, missing_quantity in rows.iterator(chunk_size=2000):
+        sketches = added.get((day, hour))
+        if sketches is None:
+            sketches = added[(day, hour)] = {metric: SpaceSaving() for metric in METRICS}
+        sketches[METRIC_MISSING].add(lm_code, missing_quantity or 0)
+        sketches[METRIC_OCCURRENCES].add(lm_code)
+
+    hours = _retained(added)
+    if not hours:
+        return
+
+    with transaction.atomic():
+        _lock_hours(hours)
+        existing = {
+            (sketch.date, sketch.hour): sketch
+            for sketch in TopProductsSketch.objects.filter(
+                date__in={day for day, _ in hours}
+            )
+        }
+
+        changed, created = [], []
+        for day, hour in hours:
+            sketch = existing.get((day, hour))
+            if sketch is None:
+                sketch = TopProductsSketch(date=day, hour=hour)
+                created.append(sketch)
+            else:
+                # bulk_update не заполняет auto_now
+                sketch.updated_at = timezone.now()
+                changed.append(sketch)
+            for metric, addition in added[(day, hour)].items():
+                merged = SpaceSaving.merge([SpaceSaving(counters=getattr(sketch, metric)), addition])
+                setattr(sketch, metric, merged.counters)
+
+        TopProductsSketch.objects.bulk_update(changed, [*METRICS, 'updated_at'], batch_size=500)
+        TopProductsSketch.objects.bulk_create(created, batch_size=500)
+
+
+def on_assemblies_created(assembly_ids):
+    """
+    Новые сборки при приеме данных. Ошибка скетча не ломает прием:
+    часы помечаются и будут пересобраны фоновой задачей
+    """
+    if not assembly_ids:
+        return
+    try:
+        with transaction.atomic():
+            add_assemblies(assembly_ids)
+    except Exception as e:
+        logger.exception(f"Ошибка добавления в скетчи топа товаров: {e}")
+        transaction.on_commit(lambda: mark_stale_for_assemblies(assembly_ids))
+
+
+def mark_stale(hours):
+    """
+    Помечает часы для пересборки фоновой задачей (refresh_stale_sketches).
+    Под блокировками часов: пометка не потеряется, если час в это время пересобирается
+    """
+    hours = _retained(hours)
+    if not hours:
+        return
+    with transaction.atomic():
+        _lock_hours(hours)
+        TopProductsSketch.objects.bulk_create(
+            [TopProductsSketch(date=day, hour=hour, stale=True) for day, hour in hours],
+            update_conflicts=True,
+            unique_fields=['date', 'hour'],
+            update_fields=['stale'],
+        )
+
+
+def mark_stale_for_assemblies(assembly_ids):
+    """Помечает часы, в которые созданы указанные сборки"""
+    hours = PartiallyPickedAssembly.objects.filter(
+        pk__in=assembly_ids
+    ).values_list('created_date', 'created_hour').distinct().order_by()
+    mark_stale(list(hours))
+
+
+def refresh_stale_sketches():
+    """Пересобирает помеченные часы, возвращает их число"""
+    hours = list(TopProductsSketch.objects.filter(stale=True).values_list('date', 'hour').order_by('date', 'hour'))
+    if not hours:
+        return 0
+
+    started = time.monotonic()
+    refresh_sketches(hours)
+    logger.debug(f"Скетчи топа товаров пересобраны за {len(hours)} ч: {time.monotonic() - started:.2f} с")
+    return len(hours)
+
+
+def rebuild_sketches():
+    """Пересобирает скетчи всех часов срока хранения"""
+    oldest = timezone.localdate() - SKETCH_RETENTION
+    TopProductsSketch.objects.filter(date__lt=oldest).delete()
+    hours = set(PartiallyPickedAssembly.objects.filter(
+        created_date__gte=oldest
+    ).values_list('created_date', 'created_hour').distinct().order_by())
+    # Уже сохраненные часы без данных тоже пересобираются - в пустые скетчи
+    hours.update(TopProductsSketch.objects.values_list('date', 'hour'))
+    refresh_sketches(hours)
+    return len(hours)
+
+
+def evict_old_sketches():
+    deleted, _ = TopProductsSketch.objects.filter(
+        date__lt=timezone.localdate() - SKETCH_RETENTION
+    ).delete()
+    return deleted
+
+
+def window_start(window):
+    """
+    Начало окна по местному времени с точностью до часа (граница часовых скетчей):
+    текущий час, текущие сутки или семь суток до начала текущего часа
+    """
+    start = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+    if window == WINDOW_TODAY:
+        return start.replace(hour=0)
+    if window == WINDOW_WEEK:
+        return start - timedelta(days=7)
+    return start
+
+
+def _product_titles(lm_codes):
+    """Последнее название каждого LM кода"""
+    return dict(
+        PartiallyPickedProduct.objects.filter(lm_code__in=lm_codes).order_by(
+            'lm_code', '-id'
+        ).distinct('lm_code').values_list('lm_code', 'title')
+    )
+
+
+def approximate_top(window, metric, k):
+    start = window_start(window)
+    day, hour = start.date(), start.hour
+    sketches = [
+        SpaceSaving(counters=counters)
+        for counters in TopProductsSketch.objects.filter(
+            Q(date__gt=day) | Q(date=day, hour__gte=hour)
+        ).values_list(metric, flat=True)
+    ]
+    merged = SpaceSaving.merge(sketches)
+    return [
+        {'lm_code': item, 'value': count, 'error': error, 'guaranteed': guaranteed}
+        for item, count, error, guaranteed in merged.top(k)
+    ]
+
+
+def exact_top(window, metric, k):
+    value = Sum('missing_quantity') if metric == METRIC_MISSING else Count('id')
+    start = window_start(window)
+    day, hour = start.date(), start.hour
+    rows = _window_products().filter(
+        Q(assembly__created_date__gt=day) | Q(assembly__created_date=day, assembly__created_hour__gte=hour)
+    ).values('lm_code').annotate(value=value).order_by('-value', 'lm_code')[:k]
+    return [
+        {'lm_code': row['lm_code'], 'value': row['value'] or 0, 'error': 0, 'guaranteed': True}
+        for row in rows
+    ]
+
+
+def top_products(window=WINDOW_TODAY, metric=METRIC_MISSING, k=10, exact=False):
+    """
+    Топ LM кодов по недостаче или числу попаданий за скользящее окно.
+    По умолчанию из часовых скетчей (value - оценка сверху, error - ее погрешность),
+    exact=True - точный расчет по исходным данным
+    """
+    items = exact_top(window, metric, k) if exact else approximate_top(window, metric, k)
+    titles = _product_titles([item['lm_code'] for item in items])
+    for item in items:
+        item['title'] = titles.get(item['lm_code'])
+
+    return {
+        'window': window,
+        'metric': metric,
+        'exact': exact,
+        'since': window_start(window),
+        'items': items,
+    }
+
+
+def on_assemblies_changed(sender, assembly_ids, created_ids=(), **kwargs):
+    # Новые сборки уже добавлены в скетчи при приеме (on_assemblies_created). Исключения из данных
+    # (черный список, повторный прием) Space-Saving не поддерживает, поэтому такие часы
+    # только помечаются, а пересобирает их фоновая задача.
+    # Как и агрегаты, скетчи можно пересобрать командой, поэтому ошибка не ломает прием данных
+    try:
+        mark_stale_for_assemblies(set(assembly_ids) - set(created_ids))
+    except Exception as e:
+        logger.exception(f"Ошибка пометки скетчей топа товаров: {e}")
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django_apscheduler import util
+from django_apscheduler.models import DjangoJobExecution
+
+from .chronic import refresh_chronic_shortages
+from .distinct_sketches import refresh_stale_distinct_sketches
+from .export_jobs import evict_expired_exports, process_export_jobs
+from .forecasting import refresh_forecasts
+from .heavy_hitters import evict_old_sketches, refresh_stale_sketches
+from .matviews import refresh_materialized_views
+
+
+@util.close_old_connections
+def export_jobs_job():
+    """Сборка файлов экспорта из очереди"""
+    process_export_jobs()
+
+
+@util.close_old_connections
+def evict_exports_job():
+    """Очистка устаревших файлов экспорта"""
+    evict_expired_exports()
+
+
+@util.close_old_connections
+def refresh_matviews_job():
+    """Обновление материализованных представлений статистики"""
+    refresh_materialized_views()
+
+
+@util.close_old_connections
+def top_products_sketches_job():
+    """Пересборка часовых скетчей топа товаров, данные которых изменились"""
+    refresh_stale_sketches()
+
+
+@util.close_old_connections
+def distinct_sketches_job():
+    """Пересчет дневных скетчей уникальных значений, данные которых изменились"""
+    refresh_stale_distinct_sketches()
+
+
+@util.close_old_connections
+def evict_sketches_job():
+    """Удаление часовых скетчей топа товаров старше срока хранения"""
+    evict_old_sketches()
+
+
+@util.close_old_connections
+def chronic_shortages_job():
+    """Ночной пересчет индекса хронической недостачи"""
+    refresh_chronic_shortages()
+
+
+@util.close_old_connections
+def forecasts_job():
+    """Ночной прогноз недостачи на наступивший день"""
+    refresh_forecasts()
+
+
+@util.close_old_connections
+def delete_old_job_executions(max_age=604_800):
+    """Удаление истории запусков задач планировщика старше max_age секунд"""
+    DjangoJobExecution.objects.delete_old_job_executions(max_age)
+
+
+# id задачи -> (функция, параметры триггера)
+SCHEDULED_JOBS = {
+    'export_jobs': (export_jobs_job, {'trigger': 'interval', 'seconds': settings.EXPORT_WORKER_INTERVAL}),
+    'evict_exports': (evict_exports_job, {'trigger': 'interval', 'minutes': 10}),
+    'refresh_matviews': (
+        refresh_matviews_job,
+        {'trigger': 'interval', 'minutes': settings.STATISTICS_MATVIEW_REFRESH_MINUTES},
+    ),
+    'top_products_sketches': (
+        top_products_sketches_job,
+        {'trigger': 'interval', 'seconds': settings.SKETCH_REFRESH_INTERVAL},
+    ),
+    'distinct_sketches': (
+        distinct_sketches_job,
+        {'trigger': 'interval', 'seconds': settings.SKETCH_REFRESH_INTERVAL},
+    ),
+    'evict_top_products_sketches': (evict_sketches_job, {'trigger': 'cron', 'hour': 3, 'minute': 0}),
+    'chronic_shortages': (chronic_shortages_job, {'trigger': 'cron', 'hour': 2, 'minute': 30}),
+    'shortage_forecasts': (forecasts_job, {'trigger': 'cron', 'hour': 0, 'minute': 20}),
+    'delete_old_job_executions': (
+        delete_old_job_executions,
+        {'trigger': 'cron', 'day_of_week': 'mon', 'hour': 0, 'minute': 0},
+    ),
+}
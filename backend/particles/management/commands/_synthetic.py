@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from particles.rollups import refresh_rollups
+from particles.utils import local_day_bounds
+
+PRODUCTS_PER_ASSEMBLY = 4
+LM_CODES = 20_000
+DEPARTMENTS = 15
+ASSEMBLERS = 50
+
+# Сборки (по номеру i в task_id) и их товары одним запросом; недостача 1-7, больше 5 - критическая
+INSERT_SQL = f"""
+WITH assemblies AS (
+    INSERT INTO particles_partiallypickedassembly (
+        order_number, task_id, status_str, assembly_zone, assembler, timestamp, source_system,
+        products_count, total_missing_quantity, black_list, created_at, updated_at
+    )
+    SELECT
+        'benchmark-' || i, i::text, 'PARTIALLY_PICKED', 'Z' || i %% 5, 'Сборщик ' || i %% {ASSEMBLERS},
+        created_at, 'benchmark', 0, 0, false, created_at, now()
+    FROM (
+        SELECT i, %(start)s::timestamptz + make_interval(days => i %% %(days)s, hours => 8 + i %% 12, mins => i %% 60)
+            AS created_at
+        FROM generate_series(0, %(assemblies)s - 1) AS i
+    ) AS generated
+    RETURNING id, task_id::int AS i, created_at
+), products AS (
+    SELECT a.id, a.created_at, a.i::bigint * {PRODUCTS_PER_ASSEMBLY} + k AS n, 1 + (a.i + k) %% 7 AS missing
+    FROM assemblies a CROSS JOIN generate_series(0, {PRODUCTS_PER_ASSEMBLY - 1}) AS k
+)
+INSERT INTO particles_partiallypickedproduct (
+    assembly_id, lm_code, department_id, title, quantity, collected_quantity, missing_quantity,
+    is_critical, black_list, created_at, updated_at
+)
+SELECT
+    id, 'LM' || n * 7919 %% {LM_CODES}, (1 + n %% {DEPARTMENTS})::text, 'Товар ' || n * 7919 %% {LM_CODES},
+    missing + 1, 1, missing, missing > 5, false, created_at, now()
+FROM products
+WHERE n < %(rows)s
+"""
+
+TOTALS_SQL = """
+UPDATE particles_partiallypickedassembly a
+SET products_count = totals.products, total_missing_quantity = totals.missing
+FROM (
+    SELECT p.assembly_id, COUNT(*) AS products, SUM(p.missing_quantity) AS missing
+    FROM particles_partiallypickedproduct p
+    JOIN particles_partiallypickedassembly a ON a.id = p.assembly_id
+    WHERE a.source_system = 'benchmark'
+    GROUP BY p.assembly_id
+) AS totals
+WHERE a.id = totals.assembly_id
+"""
+
+
+@contextmanager
+def synthetic_data(rows, days=30):
+    """
+    Синтетические сборки по PRODUCTS_PER_ASSEMBLY товаров, всего rows строк сборка x товар,
+    за последние days дней вместе с агрегатами. Все создается в транзакции, которая откатывается
+    по выходу: замер видит синтетические строки вместе с данными БД, в БД ничего не остается.
+    Отдает (первый день, последний день)
+    """
+    last_day = timezone.localdate()
+    first_day = last_day - timedelta(days=days - 1)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(INSERT_SQL, {
+                'start': local_day_bounds(first_day)[0],
+                'days': days,
+                'assemblies': -(-rows // PRODUCTS_PER_ASSEMBLY),
+                'rows': rows,
+            })
+            cursor.execute(TOTALS_SQL)
+            cursor.execute("ANALYZE particles_partiallypickedassembly, particles_partiallypickedproduct")
+        refresh_rollups([(first_day + timedelta(days=day), hour) for day in range(days) for hour in range(24)])
+
+        try:
+            yield first_day, last_day
+        finally:
+            transaction.set_rollback(True)
@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from particles.statistics import DashboardFilters, DashboardStatistics
+
+
+class QueryTimer:
+    """Обертка выполнения запросов: считает количество и время запросов к БД"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class Command(BaseCommand):
+    help = 'Замер количества и времени запросов к БД при построении дашборда статистики по разделам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from')
+        parser.add_argument('--date-to')
+        parser.add_argument('--assembler')
+        parser.add_argument('--department-id')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        filters = DashboardFilters(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            assembler=options['assembler'],
+            department_id=options['department_id'],
+        )
+        repeat = options['repeat']
+
+        self.stdout.write(f"{'section':<20}{'queries':>10}{'db, ms':>12}{'total, ms':>12}")
+
+        totals = QueryTimer()
+        total_seconds = 0.0
+        for section in DashboardStatistics.SECTIONS:
+            timer = QueryTimer()
+            started = time.perf_counter()
+            with connection.execute_wrapper(timer):
+                for _ in range(repeat):
+                    # Новый объект на каждый повтор, чтобы не учитывать внутренний кеш раздела
+                    DashboardStatistics(filters).compute(section)
+            elapsed = time.perf_counter() - started
+
+            totals.queries += timer.queries
+            totals.seconds += timer.seconds
+            total_seconds += elapsed
+            self.stdout.write(
+                f"{section:<20}{timer.queries / repeat:>10.0f}"
+                f"{timer.seconds / repeat * 1000:>12.1f}{elapsed / repeat * 1000:>12.1f}"
+            )
+
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            for _ in range(repeat):
+                DashboardStatistics(filters).compute_all()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{'sum of sections':<20}{totals.queries / repeat:>10.0f}"
+            f"{totals.seconds / repeat * 1000:>12.1f}{total_seconds / repeat * 1000:>12.1f}"
+        )
+        self.stdout.write(
+            f"{'dashboard':<20}{timer.queries / repeat:>10.0f}"
+            f"{timer.seconds / repeat * 1000:>12.1f}{elapsed / repeat * 1000:>12.1f}"
+        )
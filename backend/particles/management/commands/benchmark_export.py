@@ -0,0 +1,65 @@
+import tempfile
+import time
+from contextlib import nullcontext
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from particles.exports import EXPORT_WRITERS, filter_export_assemblies, iter_export_rows
+
+from ._synthetic import synthetic_data
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер времени и размера экспорта по форматам: запрос к БД и запись файла, как в задаче экспорта. '
+        'Недостающие до --rows строки добавляются синтетическими сборками, которые откатываются после замера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000],
+                            help='Число строк выгрузки')
+        parser.add_argument('--formats', nargs='+', choices=list(EXPORT_WRITERS), default=list(EXPORT_WRITERS))
+        parser.add_argument('--assembler', default='')
+        parser.add_argument('--date-from', default='')
+        parser.add_argument('--date-to', default='')
+        parser.add_argument('--existing', action='store_true',
+                            help='Только данные БД, без синтетических строк')
+
+    def rows(self, params, count):
+        return islice(iter_export_rows(filter_export_assemblies(params)), count)
+
+    def handle(self, *args, **options):
+        params = {
+            'assembler': options['assembler'],
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+        }
+        counts = sorted(options['rows'])
+
+        # Синтетических строк столько, чтобы хватило на самый большой замер даже без данных в БД
+        data = nullcontext() if options['existing'] else synthetic_data(counts[-1])
+        with data:
+            self.stdout.write(f"{'format':<10}{'rows':>12}{'seconds':>12}{'size, MB':>12}")
+
+            for count in counts:
+                # Только чтение строк из БД - база для сравнения форматов
+                started = time.perf_counter()
+                fetched = sum(1 for _ in self.rows(params, count))
+                elapsed = time.perf_counter() - started
+                if fetched < count:
+                    raise CommandError(
+                        f"Выгрузка дает {fetched} строк из {count}: уберите фильтры или --existing"
+                    )
+                self.stdout.write(f"{'query':<10}{fetched:>12}{elapsed:>12.2f}{'-':>12}")
+
+                for export_format in options['formats']:
+                    with tempfile.TemporaryFile() as export_file:
+                        started = time.perf_counter()
+                        EXPORT_WRITERS[export_format](self.rows(params, count), export_file)
+                        elapsed = time.perf_counter() - started
+                        size = export_file.tell()
+
+                    self.stdout.write(
+                        f"{export_format:<10}{fetched:>12}{elapsed:>12.2f}{size / 1024 / 1024:>12.2f}"
+                    )
@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from particles.forecasting import (
+    HOURS,
+    ROLLING_DAYS,
+    exponential_smoothing,
+    forecast_next,
+    history_range,
+    load_series,
+    rolling_mean,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Время прогноза недостачи для синтетических рядов (отдел, час) и расчета по данным БД без записи, '
+        'ошибка прогноза на последний день истории'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--series', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=56)
+        parser.add_argument('--alpha', type=float, default=0.3)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        series, days, alpha = options['series'], options['days'], options['alpha']
+        rng = np.random.default_rng(0)
+
+        # Суточный профиль часа и недельная сезонность с пуассоновским шумом
+        base = rng.gamma(2.0, 10.0, size=(series, 1))
+        weekly = 1 + 0.3 * np.sin(2 * np.pi * np.arange(days) / 7)
+        values = rng.poisson(base * weekly).astype(np.float64)[np.newaxis]
+
+        seconds = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            forecast_next(values, alpha)
+            seconds.append(time.perf_counter() - started)
+        self.stdout.write(
+            f'Синтетические ряды: {series} x {days} дн., прогноз за {min(seconds) * 1000:.1f} мс (лучший из {len(seconds)})'
+        )
+
+        # Ошибка прогноза последнего дня по предыдущей истории
+        history, actual = values[..., :-1], values[..., -1]
+        errors = {
+            'вчерашнее значение': history[..., -1],
+            f'скользящее среднее {ROLLING_DAYS} дн.': rolling_mean(history, ROLLING_DAYS)[..., -1],
+            f'сглаживание alpha={alpha}': exponential_smoothing(history, alpha)[..., -1],
+        }
+        for name, forecast in errors.items():
+            self.stdout.write(f'  MAE, {name}: {np.abs(forecast - actual).mean():.2f}')
+
+        # Те же запрос и расчет, что в ночной задаче, но прогнозы не сохраняются
+        started = time.perf_counter()
+        departments, history = load_series(*history_range(timezone.localdate()))
+        loaded = time.perf_counter()
+        forecast_next(history, alpha)
+        finished = time.perf_counter()
+        self.stdout.write(
+            f'По БД: {len(departments) * HOURS} рядов, загрузка {(loaded - started) * 1000:.1f} мс, '
+            f'прогноз {(finished - loaded) * 1000:.1f} мс'
+        )
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from particles.distinct_sketches import rebuild_distinct_sketches
+from particles.rollups import rebuild_rollups
+from particles.stats_cache import bump_data_version
+
+
+class Command(BaseCommand):
+    help = 'Пересоздание агрегатов статистики (AssemblyRollup, ProductRollup) и скетчей уникальных значений из исходных данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days-per-batch', type=int, default=31)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batches = rebuild_rollups(days_per_batch=options['days_per_batch'])
+        rebuild_distinct_sketches(days_per_batch=options['days_per_batch'])
+        bump_data_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Агрегаты пересозданы: {batches} порций за {time.perf_counter() - started:.1f} с'
+        ))
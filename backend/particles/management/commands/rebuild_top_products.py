@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from particles.heavy_hitters import rebuild_sketches
+
+
+class Command(BaseCommand):
+    help = 'Пересоздание часовых скетчей топа товаров (TopProductsSketch) за срок хранения'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        hours = rebuild_sketches()
+        self.stdout.write(self.style.SUCCESS(
+            f'Скетчи пересозданы: {hours} ч за {time.perf_counter() - started:.1f} с'
+        ))
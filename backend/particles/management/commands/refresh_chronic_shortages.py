@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from particles.chronic import refresh_chronic_shortages
+
+
+class Command(BaseCommand):
+    help = 'Пересчет индекса хронической недостачи (ChronicShortage) вне ночной задачи'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = refresh_chronic_shortages()
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс пересчитан: {count} LM кодов за {time.perf_counter() - started:.1f} с'
+        ))
@@ -0,0 +1,34 @@
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django_apscheduler.jobstores import DjangoJobStore
+from loguru import logger
+
+from particles.jobs import SCHEDULED_JOBS
+
+
+class Command(BaseCommand):
+    help = 'Запуск планировщика фоновых задач (экспорт и обслуживание)'
+
+    def handle(self, *args, **options):
+        scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
+        scheduler.add_jobstore(DjangoJobStore(), 'default')
+
+        for job_id, (func, trigger) in SCHEDULED_JOBS.items():
+            scheduler.add_job(
+                func,
+                id=job_id,
+                max_instances=1,
+                coalesce=True,
+                replace_existing=True,
+                **trigger
+            )
+            logger.info(f"Добавлена задача планировщика '{job_id}'")
+
+        try:
+            logger.info("Запуск планировщика...")
+            scheduler.start()
+        except KeyboardInterrupt:
+            logger.info("Остановка планировщика...")
+            scheduler.shutdown()
+            logger.info("Планировщик остановлен")
@@ -0,0 +1,65 @@
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from loguru import logger
+
+from .stats_cache import bump_data_version
+from .utils import local_day_bounds
+
+# Материализованные представления статистики (создаются миграциями)
+MATERIALIZED_VIEWS = (
+    'particles_product_daily_mv',
+)
+
+# Начало последнего обновления представлений и время последнего изменения прошлых данных
+# (черный список). Каждый ключ пишет только одна сторона, поэтому гонки между ними нет
+REFRESHED_AT_KEY = 'particles:matviews:refreshed_at'
+INVALIDATED_AT_KEY = 'particles:matviews:invalidated_at'
+
+
+def refresh_materialized_views():
+    """
+    Обновление представлений без блокировки чтения (CONCURRENTLY, нужен уникальный индекс).
+    Возвращает {представление: секунды}
+    """
+    # Снимок данных берется не раньше этого момента
+    refreshed_at = timezone.now()
+    durations = {}
+    for view in MATERIALIZED_VIEWS:
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {connection.ops.quote_name(view)}")
+        durations[view] = time.perf_counter() - started
+        logger.info(f"Представление {view} обновлено за {durations[view]:.2f} с")
+
+    cache.set(REFRESHED_AT_KEY, refreshed_at, timeout=None)
+    # Разделы, посчитанные по старому содержимому представлений, больше не читаются
+    bump_data_version()
+    return durations
+
+
+def invalidate_materialized_views():
+    """
+    Помечает представления устаревшими до следующего обновления: до него статистика
+    читается из исходных данных. Вызывается после фиксации изменений черного списка
+    """
+    cache.set(INVALIDATED_AT_KEY, timezone.now(), timeout=None)
+
+
+def matview_usable(filters):
+    """
+    Можно ли читать период из представлений: в них нет сборщика,
+    а текущие сутки еще меняются, поэтому только закрытые периоды без фильтра по сборщику.
+    Кроме того, представления должны быть обновлены после конца периода
+    и после последнего изменения черного списка
+    """
+    if filters.assembler or filters.date_to is None or filters.date_to >= timezone.localdate():
+        return False
+
+    refreshed_at = cache.get(REFRESHED_AT_KEY)
+    if refreshed_at is None or refreshed_at < local_day_bounds(date_to=filters.date_to)[1]:
+        return False
+    invalidated_at = cache.get(INVALIDATED_AT_KEY)
+    return invalidated_at is None or invalidated_at < refreshed_at
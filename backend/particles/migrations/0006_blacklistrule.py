@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-19 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0005_partiallypickedproduct_black_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlacklistRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('lm_code', 'LM код'), ('department_id', 'Отдел'), ('assembly_zone', 'Зона сборки'), ('source', 'Источник'), ('title', 'Название содержит')], max_length=20, verbose_name='Поле')),
+                ('value', models.CharField(max_length=255, verbose_name='Значение')),
+                ('action', models.CharField(choices=[('blacklist', 'Сохранять как игнорируемый'), ('skip', 'Не сохранять')], default='blacklist', max_length=20, verbose_name='Действие')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активно')),
+                ('comment', models.CharField(blank=True, max_length=255, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания записи')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Время обновления записи')),
+            ],
+            options={
+                'verbose_name': 'Правило черного списка',
+                'verbose_name_plural': 'Правила черного списка',
+                'ordering': ['field', 'value'],
+                'constraints': [models.UniqueConstraint(fields=('field', 'value'), name='unique_blacklist_rule')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.9 on 2026-10-19 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0006_blacklistrule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=64, verbose_name='Ключ фильтров')),
+                ('export_format', models.CharField(max_length=10, verbose_name='Формат')),
+                ('params', models.JSONField(default=dict, verbose_name='Фильтры')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('file_path', models.CharField(blank=True, max_length=500, verbose_name='Файл')),
+                ('file_size', models.BigIntegerField(default=0, verbose_name='Размер файла')),
+                ('rows_count', models.IntegerField(default=0, verbose_name='Строк')),
+                ('requests_count', models.IntegerField(default=1, verbose_name='Количество запросов')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания записи')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Время начала')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Время окончания')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='Файл хранится до')),
+            ],
+            options={
+                'verbose_name': 'Задача экспорта',
+                'verbose_name_plural': 'Задачи экспорта',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='particles_e_status_e77054_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('key',), name='unique_active_export_job')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.9 on 2026-10-19 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0007_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssemblyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('hour', models.SmallIntegerField(verbose_name='Час')),
+                ('assembler', models.CharField(blank=True, default='', max_length=255, verbose_name='Сборщик')),
+                ('assembly_zone', models.CharField(blank=True, default='', max_length=50, verbose_name='Зона сборки')),
+                ('assemblies_count', models.IntegerField(default=0, verbose_name='Сборок')),
+                ('assemblies_with_products', models.IntegerField(default=0, verbose_name='Сборок с товарами')),
+                ('products_count', models.IntegerField(default=0, verbose_name='Товаров')),
+                ('missing_quantity', models.IntegerField(default=0, verbose_name='Недостача')),
+                ('first_created_at', models.DateTimeField(verbose_name='Первая сборка')),
+                ('last_created_at', models.DateTimeField(verbose_name='Последняя сборка')),
+            ],
+            options={
+                'verbose_name': 'Агрегат сборок',
+                'verbose_name_plural': 'Агрегаты сборок',
+                'constraints': [models.UniqueConstraint(fields=('date', 'hour', 'assembler', 'assembly_zone'), name='unique_assembly_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('hour', models.SmallIntegerField(verbose_name='Час')),
+                ('assembler', models.CharField(blank=True, default='', max_length=255, verbose_name='Сборщик')),
+                ('assembly_zone', models.CharField(blank=True, default='', max_length=50, verbose_name='Зона сборки')),
+                ('department_id', models.CharField(blank=True, default='', max_length=10, verbose_name='ID отдела')),
+                ('assemblies_count', models.IntegerField(default=0, verbose_name='Сборок')),
+                ('products_count', models.IntegerField(default=0, verbose_name='Товаров')),
+                ('critical_count', models.IntegerField(default=0, verbose_name='Критических товаров')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Требуемое количество')),
+                ('collected_quantity', models.IntegerField(default=0, verbose_name='Собранное количество')),
+                ('missing_quantity', models.IntegerField(default=0, verbose_name='Недостача')),
+                ('critical_missing_quantity', models.IntegerField(default=0, verbose_name='Недостача критических')),
+                ('first_created_at', models.DateTimeField(verbose_name='Первая сборка')),
+                ('last_created_at', models.DateTimeField(verbose_name='Последняя сборка')),
+            ],
+            options={
+                'verbose_name': 'Агрегат товаров',
+                'verbose_name_plural': 'Агрегаты товаров',
+                'indexes': [models.Index(fields=['department_id', 'date'], name='particles_p_departm_6ea835_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'hour', 'assembler', 'assembly_zone', 'department_id'), name='unique_product_rollup')],
+            },
+        ),
+    ]
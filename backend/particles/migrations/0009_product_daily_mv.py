@@ -0,0 +1,70 @@
+# Generated by Django 5.2.9 on 2026-10-19 13:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+PRODUCT_DAILY_MV_SQL = f"""
+CREATE MATERIALIZED VIEW particles_product_daily_mv AS
+SELECT
+    (a.created_at AT TIME ZONE '{settings.TIME_ZONE}')::date AS date,
+    p.lm_code,
+    COALESCE(p.title, '') AS title,
+    COALESCE(p.department_id, '') AS department_id,
+    COUNT(*) AS occurrences,
+    COALESCE(SUM(p.missing_quantity), 0) AS missing_quantity,
+    COUNT(DISTINCT p.assembly_id) AS assemblies_count,
+    COUNT(*) FILTER (WHERE p.is_critical) AS critical_count,
+    COALESCE(SUM(p.missing_quantity) FILTER (WHERE p.is_critical), 0) AS critical_missing_quantity,
+    COUNT(DISTINCT p.assembly_id) FILTER (WHERE p.is_critical) AS critical_assemblies,
+    MAX(a.created_at) AS last_seen
+FROM particles_partiallypickedproduct p
+JOIN particles_partiallypickedassembly a ON a.id = p.assembly_id
+WHERE NOT p.black_list
+  AND NOT a.black_list
+  AND a.assembly_zone IS DISTINCT FROM 'WH'
+GROUP BY 1, 2, 3, 4
+WITH DATA;
+
+-- Уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX particles_product_daily_mv_key
+    ON particles_product_daily_mv (date, lm_code, title, department_id);
+CREATE INDEX particles_product_daily_mv_department
+    ON particles_product_daily_mv (department_id, date);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0008_rollups'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            PRODUCT_DAILY_MV_SQL,
+            reverse_sql="DROP MATERIALIZED VIEW IF EXISTS particles_product_daily_mv;",
+        ),
+        migrations.CreateModel(
+            name='ProductDailyStat',
+            fields=[
+                ('pk', models.CompositePrimaryKey('date', 'lm_code', 'title', 'department_id', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('lm_code', models.CharField(max_length=50, verbose_name='LM код товара')),
+                ('title', models.TextField(verbose_name='Название товара')),
+                ('department_id', models.CharField(max_length=10, verbose_name='ID отдела')),
+                ('occurrences', models.IntegerField(verbose_name='Попаданий')),
+                ('missing_quantity', models.IntegerField(verbose_name='Недостача')),
+                ('assemblies_count', models.IntegerField(verbose_name='Сборок')),
+                ('critical_count', models.IntegerField(verbose_name='Критических попаданий')),
+                ('critical_missing_quantity', models.IntegerField(verbose_name='Недостача критических')),
+                ('critical_assemblies', models.IntegerField(verbose_name='Сборок с критическими')),
+                ('last_seen', models.DateTimeField(verbose_name='Последнее попадание')),
+            ],
+            options={
+                'verbose_name': 'Товары по дням',
+                'verbose_name_plural': 'Товары по дням',
+                'db_table': 'particles_product_daily_mv',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-19 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0009_product_daily_mv'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopProductsSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('hour', models.SmallIntegerField(verbose_name='Час')),
+                ('missing', models.JSONField(default=dict, verbose_name='Скетч недостачи')),
+                ('occurrences', models.JSONField(default=dict, verbose_name='Скетч попаданий')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлен')),
+            ],
+            options={
+                'verbose_name': 'Скетч топа товаров',
+                'verbose_name_plural': 'Скетчи топа товаров',
+                'constraints': [models.UniqueConstraint(fields=('date', 'hour'), name='unique_top_products_sketch')],
+            },
+        ),
+    ]
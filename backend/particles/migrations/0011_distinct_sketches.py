@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-19 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0010_top_products_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistinctSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('department_id', models.CharField(blank=True, default='', max_length=10, verbose_name='ID отдела')),
+                ('products', models.BinaryField(verbose_name='Скетч LM кодов')),
+                ('assemblers', models.BinaryField(verbose_name='Скетч сборщиков')),
+            ],
+            options={
+                'verbose_name': 'Скетч уникальных значений',
+                'verbose_name_plural': 'Скетчи уникальных значений',
+                'indexes': [models.Index(fields=['department_id', 'date'], name='particles_d_departm_6ce891_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'department_id'), name='unique_distinct_sketch')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.9 on 2026-10-19 13:21
+
+from importlib import import_module
+
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+# Прежнее определение представления - для отката
+PREVIOUS_PRODUCT_DAILY_MV_SQL = import_module('particles.migrations.0009_product_daily_mv').PRODUCT_DAILY_MV_SQL
+DROP_PRODUCT_DAILY_MV_SQL = "DROP MATERIALIZED VIEW IF EXISTS particles_product_daily_mv;"
+
+# Представление товаров по дням переходит на сохраненную местную дату сборки
+PRODUCT_DAILY_MV_SQL = """
+CREATE MATERIALIZED VIEW particles_product_daily_mv AS
+SELECT
+    a.created_date AS date,
+    p.lm_code,
+    COALESCE(p.title, '') AS title,
+    COALESCE(p.department_id, '') AS department_id,
+    COUNT(*) AS occurrences,
+    COALESCE(SUM(p.missing_quantity), 0) AS missing_quantity,
+    COUNT(DISTINCT p.assembly_id) AS assemblies_count,
+    COUNT(*) FILTER (WHERE p.is_critical) AS critical_count,
+    COALESCE(SUM(p.missing_quantity) FILTER (WHERE p.is_critical), 0) AS critical_missing_quantity,
+    COUNT(DISTINCT p.assembly_id) FILTER (WHERE p.is_critical) AS critical_assemblies,
+    MAX(a.created_at) AS last_seen
+FROM particles_partiallypickedproduct p
+JOIN particles_partiallypickedassembly a ON a.id = p.assembly_id
+WHERE NOT p.black_list
+  AND NOT a.black_list
+  AND a.assembly_zone IS DISTINCT FROM 'WH'
+GROUP BY 1, 2, 3, 4
+WITH DATA;
+
+-- Уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX particles_product_daily_mv_key
+    ON particles_product_daily_mv (date, lm_code, title, department_id);
+CREATE INDEX particles_product_daily_mv_department
+    ON particles_product_daily_mv (department_id, date);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0011_distinct_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partiallypickedassembly',
+            name='created_date',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.comparison.Cast(models.Func(models.Value(settings.TIME_ZONE), models.F('created_at'), function='timezone', output_field=models.DateTimeField()), models.DateField()), output_field=models.DateField(), verbose_name='Дата создания'),
+        ),
+        migrations.AddField(
+            model_name='partiallypickedassembly',
+            name='created_hour',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.comparison.Cast(models.Func(models.Value('hour'), models.Func(models.Value(settings.TIME_ZONE), models.F('created_at'), function='timezone', output_field=models.DateTimeField()), function='date_part'), models.SmallIntegerField()), output_field=models.SmallIntegerField(), verbose_name='Час создания'),
+        ),
+        migrations.AddIndex(
+            model_name='partiallypickedassembly',
+            index=models.Index(fields=['created_date', 'created_hour'], name='particles_p_created_8facd0_idx'),
+        ),
+        migrations.RunSQL(
+            DROP_PRODUCT_DAILY_MV_SQL + PRODUCT_DAILY_MV_SQL,
+            reverse_sql=DROP_PRODUCT_DAILY_MV_SQL + PREVIOUS_PRODUCT_DAILY_MV_SQL,
+        ),
+        # Без статистики по новым столбцам планировщик недооценивает выборки по дате
+        migrations.RunSQL("ANALYZE particles_partiallypickedassembly;", migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.9 on 2026-10-19 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0012_assembly_created_date_hour'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChronicShortage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lm_code', models.CharField(max_length=50, unique=True, verbose_name='LM код товара')),
+                ('title', models.TextField(blank=True, default='', verbose_name='Название товара')),
+                ('department_id', models.CharField(blank=True, default='', max_length=10, verbose_name='ID отдела')),
+                ('days_active', models.IntegerField(verbose_name='Дней с недостачей')),
+                ('occurrences', models.IntegerField(verbose_name='Попаданий')),
+                ('total_missing', models.IntegerField(verbose_name='Недостача')),
+                ('weighted_missing', models.FloatField(verbose_name='Недостача с учетом давности')),
+                ('assemblers_count', models.IntegerField(verbose_name='Сборщиков')),
+                ('last_seen', models.DateField(verbose_name='Последний день')),
+                ('score', models.FloatField(verbose_name='Индекс')),
+                ('rank', models.IntegerField(verbose_name='Место')),
+                ('computed_at', models.DateTimeField(verbose_name='Рассчитан')),
+            ],
+            options={
+                'verbose_name': 'Хроническая недостача',
+                'verbose_name_plural': 'Хронические недостачи',
+                'indexes': [models.Index(fields=['rank'], name='particles_c_rank_e1650d_idx'), models.Index(fields=['department_id', 'rank'], name='particles_c_departm_50fe88_idx')],
+            },
+        ),
+    ]
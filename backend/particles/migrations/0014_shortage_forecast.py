@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-19 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0013_chronic_shortage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortageForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата прогноза')),
+                ('department_id', models.CharField(max_length=10, verbose_name='ID отдела')),
+                ('hour', models.SmallIntegerField(verbose_name='Час')),
+                ('products', models.FloatField(verbose_name='Прогноз товаров')),
+                ('missing', models.FloatField(verbose_name='Прогноз недостачи')),
+                ('products_mean', models.FloatField(verbose_name='Товаров в среднем за неделю')),
+                ('missing_mean', models.FloatField(verbose_name='Недостача в среднем за неделю')),
+                ('computed_at', models.DateTimeField(verbose_name='Рассчитан')),
+            ],
+            options={
+                'verbose_name': 'Прогноз недостачи',
+                'verbose_name_plural': 'Прогнозы недостачи',
+                'constraints': [models.UniqueConstraint(fields=('date', 'department_id', 'hour'), name='unique_shortage_forecast')],
+            },
+        ),
+    ]
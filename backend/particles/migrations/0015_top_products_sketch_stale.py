@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0014_shortage_forecast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topproductssketch',
+            name='stale',
+            field=models.BooleanField(default=False, verbose_name='Требует пересборки'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-19 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('particles', '0015_top_products_sketch_stale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distinctsketch',
+            name='stale',
+            field=models.BooleanField(default=False, verbose_name='Требует пересчета'),
+        ),
+    ]
@@ -1,8 +1,16 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Count, F, Func, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 
+def _local_time(field):
+    """Время поля в часовом поясе проекта (timestamp без зоны), пригодно для генерируемых столбцов"""
+    return Func(Value(settings.TIME_ZONE), F(field), function='timezone', output_field=models.DateTimeField())
+
+
 class PartiallyPickedAssembly(models.Model):
     """
     Модель для хранения данных о частично собранных сборках
@@ -71,6 +79,23 @@ class PartiallyPickedAssembly(models.Model):
         verbose_name="Время создания записи",
         auto_now_add=True
     )
+    # Местные дата и час создания вычисляются БД при записи:
+    # группировки по времени не пересчитывают часовой пояс для каждой строки и используют индекс
+    created_date = models.GeneratedField(
+        verbose_name="Дата создания",
+        expression=Cast(_local_time('created_at'), models.DateField()),
+        output_field=models.DateField(),
+        db_persist=True
+    )
+    created_hour = models.GeneratedField(
+        verbose_name="Час создания",
+        expression=Cast(
+            Func(Value('hour'), _local_time('created_at'), function='date_part'),
+            models.SmallIntegerField()
+        ),
+        output_field=models.SmallIntegerField(),
+        db_persist=True
+    )
 
     updated_at = models.DateTimeField(
         verbose_name="Время обновления записи",
@@ -84,6 +109,7 @@ class PartiallyPickedAssembly(models.Model):
         indexes = [
             models.Index(fields=['order_number', 'timestamp']),
             models.Index(fields=['assembler', 'timestamp']),
+            models.Index(fields=['created_date', 'created_hour']),
         ]
         # Уникальная комбинация order_number и task_id
         constraints = [
@@ -116,6 +142,27 @@ class PartiallyPickedAssembly(models.Model):
         )
         self.save(update_fields=['products_count', 'total_missing_quantity', 'updated_at'])
 
+    @classmethod
+    def recalculate_metrics(cls, assembly_ids):
+        """
+        Пересчитывает метрики для набора сборок одним UPDATE с подзапросами
+        (без загрузки сборок и товаров в Python)
+        """
+        products = PartiallyPickedProduct.objects.filter(
+            assembly=OuterRef('pk'),
+            black_list=False
+        ).order_by().values('assembly')
+
+        return cls.objects.filter(pk__in=assembly_ids).update(
+            products_count=Coalesce(
+                Subquery(products.annotate(count=Count('pk')).values('count')), 0
+            ),
+            total_missing_quantity=Coalesce(
+                Subquery(products.annotate(total=Sum('missing_quantity')).values('total')), 0
+            ),
+            updated_at=timezone.now(),
+        )
+
     def save(self, *args, **kwargs):
         # Вызываем clean для валидации
         self.full_clean()
@@ -267,18 +314,18 @@ class PartiallyPickedProduct(models.Model):
 
     def mark_as_blacklisted(self):
         """Пометить товар как игнорируемый"""
+        from .blacklist import set_black_list
+
+        set_black_list(PartiallyPickedProduct.objects.filter(pk=self.pk), True)
         self.black_list = True
-        self.save()
-        # Обновляем метрики родительской сборки
-        self.assembly.update_metrics()
         return self
 
     def remove_from_blacklist(self):
         """Убрать товар из черного списка"""
+        from .blacklist import set_black_list
+
+        set_black_list(PartiallyPickedProduct.objects.filter(pk=self.pk), False)
         self.black_list = False
-        self.save()
-        # Обновляем метрики родительской сборки
-        self.assembly.update_metrics()
         return self
 
     @property
@@ -294,4 +341,406 @@ class PartiallyPickedProduct(models.Model):
                 '/image/upload/w_100,h_100,c_fill,q_auto,f_auto/'
             )
 
-        return self.image_url
\ No newline at end of file
+        return self.image_url
+
+class BlacklistRule(models.Model):
+    """
+    Правило черного списка, применяется при приеме данных:
+    подходящие товары сохраняются уже игнорируемыми или не сохраняются вовсе
+    """
+    FIELD_LM_CODE = 'lm_code'
+    FIELD_DEPARTMENT = 'department_id'
+    FIELD_ZONE = 'assembly_zone'
+    FIELD_SOURCE = 'source'
+    FIELD_TITLE = 'title'
+
+    FIELD_CHOICES = [
+        (FIELD_LM_CODE, 'LM код'),
+        (FIELD_DEPARTMENT, 'Отдел'),
+        (FIELD_ZONE, 'Зона сборки'),
+        (FIELD_SOURCE, 'Источник'),
+        (FIELD_TITLE, 'Название содержит'),
+    ]
+
+    ACTION_BLACKLIST = 'blacklist'
+    ACTION_SKIP = 'skip'
+
+    ACTION_CHOICES = [
+        (ACTION_BLACKLIST, 'Сохранять как игнорируемый'),
+        (ACTION_SKIP, 'Не сохранять'),
+    ]
+
+    field = models.CharField(
+        verbose_name="Поле",
+        max_length=20,
+        choices=FIELD_CHOICES
+    )
+
+    value = models.CharField(
+        verbose_name="Значение",
+        max_length=255
+    )
+
+    action = models.CharField(
+        verbose_name="Действие",
+        max_length=20,
+        choices=ACTION_CHOICES,
+        default=ACTION_BLACKLIST
+    )
+
+    is_active = models.BooleanField(
+        verbose_name="Активно",
+        default=True
+    )
+
+    comment = models.CharField(
+        verbose_name="Комментарий",
+        max_length=255,
+        blank=True
+    )
+
+    created_at = models.DateTimeField(
+        verbose_name="Время создания записи",
+        auto_now_add=True
+    )
+
+    updated_at = models.DateTimeField(
+        verbose_name="Время обновления записи",
+        auto_now=True
+    )
+
+    class Meta:
+        verbose_name = "Правило черного списка"
+        verbose_name_plural = "Правила черного списка"
+        ordering = ['field', 'value']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['field', 'value'],
+                name='unique_blacklist_rule'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.get_field_display()}: {self.value} ({self.get_action_display()})"
+
+    def save(self, *args, **kwargs):
+        self.value = self.value.strip()
+        super().save(*args, **kwargs)
+
+
+class ExportJob(models.Model):
+    """
+    Фоновая задача экспорта сборок.
+    Одинаковые запросы (ключ - хеш нормализованных фильтров и формата)
+    используют одну задачу и один готовый файл, пока он не устарел
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    key = models.CharField(
+        verbose_name="Ключ фильтров",
+        max_length=64,
+        db_index=True
+    )
+
+    export_format = models.CharField(
+        verbose_name="Формат",
+        max_length=10
+    )
+
+    params = models.JSONField(
+        verbose_name="Фильтры",
+        default=dict
+    )
+
+    status = models.CharField(
+        verbose_name="Статус",
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+
+    file_path = models.CharField(
+        verbose_name="Файл",
+        max_length=500,
+        blank=True
+    )
+
+    file_size = models.BigIntegerField(
+        verbose_name="Размер файла",
+        default=0
+    )
+
+    rows_count = models.IntegerField(
+        verbose_name="Строк",
+        default=0
+    )
+
+    requests_count = models.IntegerField(
+        verbose_name="Количество запросов",
+        default=1
+    )
+
+    error = models.TextField(
+        verbose_name="Ошибка",
+        blank=True
+    )
+
+    created_at = models.DateTimeField(
+        verbose_name="Время создания записи",
+        auto_now_add=True
+    )
+
+    started_at = models.DateTimeField(
+        verbose_name="Время начала",
+        null=True,
+        blank=True
+    )
+
+    finished_at = models.DateTimeField(
+        verbose_name="Время окончания",
+        null=True,
+        blank=True
+    )
+
+    expires_at = models.DateTimeField(
+        verbose_name="Файл хранится до",
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = "Задача экспорта"
+        verbose_name_plural = "Задачи экспорта"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        # Одновременно в очереди/работе может быть только одна задача с таким ключом
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_export_job'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.export_format} {self.key[:8]} ({self.get_status_display()})"
+
+
+class AssemblyRollup(models.Model):
+    """
+    Предагрегированные сборки по (местная дата, час, сборщик, зона).
+    Игнорируемые сборки не учитываются. Пересчитывается по часам затронутых сборок при приеме данных
+    и изменении черного списка, полностью - командой rebuild_rollups
+    """
+    date = models.DateField(verbose_name="Дата")
+    hour = models.SmallIntegerField(verbose_name="Час")
+    assembler = models.CharField(verbose_name="Сборщик", max_length=255, blank=True, default='')
+    assembly_zone = models.CharField(verbose_name="Зона сборки", max_length=50, blank=True, default='')
+
+    assemblies_count = models.IntegerField(verbose_name="Сборок", default=0)
+    assemblies_with_products = models.IntegerField(verbose_name="Сборок с товарами", default=0)
+    products_count = models.IntegerField(verbose_name="Товаров", default=0)
+    missing_quantity = models.IntegerField(verbose_name="Недостача", default=0)
+    first_created_at = models.DateTimeField(verbose_name="Первая сборка")
+    last_created_at = models.DateTimeField(verbose_name="Последняя сборка")
+
+    class Meta:
+        verbose_name = "Агрегат сборок"
+        verbose_name_plural = "Агрегаты сборок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'hour', 'assembler', 'assembly_zone'],
+                name='unique_assembly_rollup'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.hour}:00 {self.assembler} ({self.assemblies_count})"
+
+
+class ProductRollup(models.Model):
+    """
+    Предагрегированные товары по (местная дата, час, сборщик, зона, отдел).
+    Сборка попадает ровно в одну ячейку (дата, час, сборщик, зона), поэтому сумма
+    assemblies_count по ячейкам отдела равна числу различных сборок отдела
+    """
+    date = models.DateField(verbose_name="Дата")
+    hour = models.SmallIntegerField(verbose_name="Час")
+    assembler = models.CharField(verbose_name="Сборщик", max_length=255, blank=True, default='')
+    assembly_zone = models.CharField(verbose_name="Зона сборки", max_length=50, blank=True, default='')
+    department_id = models.CharField(verbose_name="ID отдела", max_length=10, blank=True, default='')
+
+    assemblies_count = models.IntegerField(verbose_name="Сборок", default=0)
+    products_count = models.IntegerField(verbose_name="Товаров", default=0)
+    critical_count = models.IntegerField(verbose_name="Критических товаров", default=0)
+    quantity = models.IntegerField(verbose_name="Требуемое количество", default=0)
+    collected_quantity = models.IntegerField(verbose_name="Собранное количество", default=0)
+    missing_quantity = models.IntegerField(verbose_name="Недостача", default=0)
+    critical_missing_quantity = models.IntegerField(verbose_name="Недостача критических", default=0)
+    first_created_at = models.DateTimeField(verbose_name="Первая сборка")
+    last_created_at = models.DateTimeField(verbose_name="Последняя сборка")
+
+    class Meta:
+        verbose_name = "Агрегат товаров"
+        verbose_name_plural = "Агрегаты товаров"
+        indexes = [
+            models.Index(fields=['department_id', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'hour', 'assembler', 'assembly_zone', 'department_id'],
+                name='unique_product_rollup'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.hour}:00 {self.assembler} отдел {self.department_id} ({self.products_count})"
+
+
+class ProductDailyStat(models.Model):
+    """
+    Товары по (местная дата, LM код, название, отдел) без игнорируемых и без зоны WH.
+    Материализованное представление particles_product_daily_mv: создается миграцией,
+    обновляется планировщиком (particles.matviews), модель только для чтения
+    """
+    pk = models.CompositePrimaryKey('date', 'lm_code', 'title', 'department_id')
+    date = models.DateField(verbose_name="Дата")
+    lm_code = models.CharField(verbose_name="LM код товара", max_length=50)
+    title = models.TextField(verbose_name="Название товара")
+    department_id = models.CharField(verbose_name="ID отдела", max_length=10)
+
+    occurrences = models.IntegerField(verbose_name="Попаданий")
+    missing_quantity = models.IntegerField(verbose_name="Недостача")
+    assemblies_count = models.IntegerField(verbose_name="Сборок")
+    critical_count = models.IntegerField(verbose_name="Критических попаданий")
+    critical_missing_quantity = models.IntegerField(verbose_name="Недостача критических")
+    critical_assemblies = models.IntegerField(verbose_name="Сборок с критическими")
+    last_seen = models.DateTimeField(verbose_name="Последнее попадание")
+
+    class Meta:
+        managed = False
+        db_table = 'particles_product_daily_mv'
+        verbose_name = "Товары по дням"
+        verbose_name_plural = "Товары по дням"
+
+
+class TopProductsSketch(models.Model):
+    """
+    Часовые скетчи Space-Saving для топа LM кодов (particles.heavy_hitters):
+    {lm_code: [оценка, погрешность]} по недостаче и по числу попаданий.
+    Без игнорируемых и без зоны WH, хранятся SKETCH_RETENTION. Новые сборки добавляются
+    в скетч часа при приеме, часы с другими изменениями помечаются stale и пересобираются фоновой задачей
+    """
+    date = models.DateField(verbose_name="Дата")
+    hour = models.SmallIntegerField(verbose_name="Час")
+    missing = models.JSONField(verbose_name="Скетч недостачи", default=dict)
+    occurrences = models.JSONField(verbose_name="Скетч попаданий", default=dict)
+    stale = models.BooleanField(verbose_name="Требует пересборки", default=False)
+    updated_at = models.DateTimeField(verbose_name="Обновлен", auto_now=True)
+
+    class Meta:
+        verbose_name = "Скетч топа товаров"
+        verbose_name_plural = "Скетчи топа товаров"
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'hour'], name='unique_top_products_sketch')
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.hour}:00"
+
+
+class DistinctSketch(models.Model):
+    """
+    Скетчи HyperLogLog (particles.distinct_sketches) уникальных LM кодов и сборщиков
+    по (местная дата, отдел), department_id='*' - день по всем отделам.
+    Без игнорируемых и без зоны WH. Новые сборки добавляются в регистры сразу при приеме,
+    дни с другими изменениями помечаются stale (на строке '*') и пересчитываются фоновой задачей
+    """
+    date = models.DateField(verbose_name="Дата")
+    department_id = models.CharField(verbose_name="ID отдела", max_length=10, blank=True, default='')
+    products = models.BinaryField(verbose_name="Скетч LM кодов")
+    assemblers = models.BinaryField(verbose_name="Скетч сборщиков")
+    stale = models.BooleanField(verbose_name="Требует пересчета", default=False)
+
+    class Meta:
+        verbose_name = "Скетч уникальных значений"
+        verbose_name_plural = "Скетчи уникальных значений"
+        indexes = [
+            models.Index(fields=['department_id', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'department_id'], name='unique_distinct_sketch')
+        ]
+
+    def __str__(self):
+        return f"{self.date} отдел {self.department_id}"
+
+
+class ChronicShortage(models.Model):
+    """
+    Индекс хронической недостачи по LM коду (particles.chronic) за последние CHRONIC_SHORTAGE_WINDOW_DAYS дней.
+    Пересчитывается целиком ночной задачей, rank - место по score среди всех LM кодов
+    """
+    lm_code = models.CharField(verbose_name="LM код товара", max_length=50, unique=True)
+    title = models.TextField(verbose_name="Название товара", blank=True, default='')
+    department_id = models.CharField(verbose_name="ID отдела", max_length=10, blank=True, default='')
+
+    days_active = models.IntegerField(verbose_name="Дней с недостачей")
+    occurrences = models.IntegerField(verbose_name="Попаданий")
+    total_missing = models.IntegerField(verbose_name="Недостача")
+    weighted_missing = models.FloatField(verbose_name="Недостача с учетом давности")
+    assemblers_count = models.IntegerField(verbose_name="Сборщиков")
+    last_seen = models.DateField(verbose_name="Последний день")
+
+    score = models.FloatField(verbose_name="Индекс")
+    rank = models.IntegerField(verbose_name="Место")
+    computed_at = models.DateTimeField(verbose_name="Рассчитан")
+
+    class Meta:
+        verbose_name = "Хроническая недостача"
+        verbose_name_plural = "Хронические недостачи"
+        indexes = [
+            models.Index(fields=['rank']),
+            models.Index(fields=['department_id', 'rank']),
+        ]
+
+    def __str__(self):
+        return f"{self.rank}. {self.lm_code} ({self.score:.1f})"
+
+
+class ShortageForecast(models.Model):
+    """
+    Прогноз недостачи на день по (отдел, час) (particles.forecasting).
+    Пересчитывается ночью по истории агрегатов товаров за FORECAST_HISTORY_DAYS дней
+    """
+    date = models.DateField(verbose_name="Дата прогноза")
+    department_id = models.CharField(verbose_name="ID отдела", max_length=10)
+    hour = models.SmallIntegerField(verbose_name="Час")
+
+    products = models.FloatField(verbose_name="Прогноз товаров")
+    missing = models.FloatField(verbose_name="Прогноз недостачи")
+    products_mean = models.FloatField(verbose_name="Товаров в среднем за неделю")
+    missing_mean = models.FloatField(verbose_name="Недостача в среднем за неделю")
+    computed_at = models.DateTimeField(verbose_name="Рассчитан")
+
+    class Meta:
+        verbose_name = "Прогноз недостачи"
+        verbose_name_plural = "Прогнозы недостачи"
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'department_id', 'hour'], name='unique_shortage_forecast')
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.hour}:00 отдел {self.department_id} ({self.missing:.1f})"
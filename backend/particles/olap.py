@@ -0,0 +1,157 @@
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, ExtractIsoWeekDay, TruncMonth
+
+from .statistics import DashboardStatistics
+
+# Разрезы: имя в запросе -> выражение над товаром периода
+DIMENSIONS = {
+    'zone': Coalesce(F('assembly__assembly_zone'), Value('')),
+    'department': Coalesce(F('department_id'), Value('')),
+    'assembler': Coalesce(F('assembly__assembler'), Value('')),
+    'day': F('assembly__created_date'),
+    'month': TruncMonth('assembly__created_date'),
+    'hour': F('assembly__created_hour'),
+    'weekday': ExtractIsoWeekDay('assembly__created_date'),
+    'critical': F('is_critical'),
+}
+
+# Меры: имя в запросе -> SQL над строками выборки
+MEASURES = {
+    'products': 'COUNT(*)',
+    'assemblies': 'COUNT(DISTINCT rows.assembly)',
+    'assemblers': "COUNT(DISTINCT NULLIF(rows.assembler_key, ''))",
+    'quantity': 'COALESCE(SUM(rows.quantity), 0)::bigint',
+    'collected_quantity': 'COALESCE(SUM(rows.collected_quantity), 0)::bigint',
+    'missing_quantity': 'COALESCE(SUM(rows.missing_quantity), 0)::bigint',
+    'critical': 'COUNT(*) FILTER (WHERE rows.is_critical)',
+    'critical_missing_quantity': 'COALESCE(SUM(rows.missing_quantity) FILTER (WHERE rows.is_critical), 0)::bigint',
+}
+
+MAX_SETS = 8
+MAX_SET_DIMENSIONS = 3
+
+
+class Aggregation:
+    """
+    Произвольные разрезы статистики одним запросом GROUP BY GROUPING SETS
+    по товарам периода (с учетом фильтров дашборда).
+    sets - список наборов разрезов, например [('zone', 'department'), ('assembler', 'hour')];
+    subtotals=True добавляет к каждому набору промежуточные итоги, как ROLLUP: (a, b), (a), ()
+    """
+
+    def __init__(self, filters, sets, measures=None, subtotals=False):
+        self.filters = filters
+        self.measures = list(measures or MEASURES)
+        self.sets = self.expand_sets(sets, subtotals)
+
+        unknown = [measure for measure in self.measures if measure not in MEASURES]
+        if unknown:
+            raise ValueError(f"Неизвестные меры: {', '.join(unknown)}")
+
+        # Все разрезы запроса в порядке первого появления
+        self.dimensions = list(dict.fromkeys(dimension for grouping in self.sets for dimension in grouping))
+
+    @classmethod
+    def from_request(cls, filters, params):
+        """
+        Параметры запроса: sets=zone,department;assembler,hour (наборы через ';'),
+        measures=products,missing_quantity, subtotals=1
+        """
+        sets = [
+            tuple(dimension.strip() for dimension in grouping.split(',') if dimension.strip())
+            for grouping in (params.get('sets') or '').split(';')
+        ]
+        measures = [measure.strip() for measure in (params.get('measures') or '').split(',') if measure.strip()]
+        return cls(filters, sets, measures, subtotals=params.get('subtotals') in ('1', 'true'))
+
+    @staticmethod
+    def expand_sets(sets, subtotals):
+        expanded = []
+        for grouping in sets:
+            if not grouping:
+                continue
+            unknown = [dimension for dimension in grouping if dimension not in DIMENSIONS]
+            if unknown:
+                raise ValueError(f"Неизвестные разрезы: {', '.join(unknown)}")
+            if len(set(grouping)) != len(grouping) or len(grouping) > MAX_SET_DIMENSIONS:
+                raise ValueError(f"В наборе должно быть до {MAX_SET_DIMENSIONS} разных разрезов")
+
+            prefixes = [grouping[:size] for size in range(len(grouping), -1, -1)] if subtotals else [grouping]
+            for prefix in prefixes:
+                # Наборы из одних и тех же разрезов в разном порядке дают одни и те же строки
+                if set(prefix) not in (set(existing) for existing in expanded):
+                    expanded.append(prefix)
+
+        if not expanded:
+            raise ValueError("Не указаны наборы разрезов (sets)")
+        if len(expanded) > MAX_SETS:
+            raise ValueError(f"Не больше {MAX_SETS} наборов разрезов, включая промежуточные итоги")
+        return expanded
+
+    def cache_name(self):
+        """Нормализованное описание запроса для ключа кеша"""
+        sets = ';'.join(','.join(grouping) for grouping in self.sets)
+        return f"olap:{sets}:{','.join(self.measures)}"
+
+    def rows_sql(self):
+        """Строки товаров периода с нужными разрезами: обычный запрос ORM, оборачивается в GROUPING SETS"""
+        products = DashboardStatistics(self.filters).products().annotate(
+            assembler_key=DIMENSIONS['assembler'],
+            **{f'dim_{dimension}': DIMENSIONS[dimension] for dimension in self.dimensions}
+        )
+        return products.values(
+            'assembly', 'assembler_key', 'quantity', 'collected_quantity', 'missing_quantity', 'is_critical',
+            *(f'dim_{dimension}' for dimension in self.dimensions)
+        ).order_by().query.sql_with_params()
+
+    def execute(self):
+        """
+        {'sets': [{'dimensions': [...], 'rows': [{разрез: значение, ..., мера: значение, ...}]}]}.
+        Строки набора упорядочены по его разрезам
+        """
+        rows_sql, params = self.rows_sql()
+        columns = [f'rows.dim_{dimension}' for dimension in self.dimensions]
+
+        grouping_sets = ', '.join(
+            '(' + ', '.join(f'rows.dim_{dimension}' for dimension in grouping) + ')'
+            for grouping in self.sets
+        )
+        measures = ', '.join(f'{MEASURES[measure]} AS {measure}' for measure in self.measures)
+
+        # GROUPING(...) - битовая маска разрезов, свернутых в строке: по ней строка относится к набору
+        sql = f"""
+            SELECT GROUPING({', '.join(columns)}) AS grouping_mask, {', '.join(columns)}, {measures}
+            FROM ({rows_sql}) AS rows
+            GROUP BY GROUPING SETS ({grouping_sets})
+            ORDER BY grouping_mask, {', '.join(f'{column} NULLS FIRST' for column in columns)}
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            fetched = cursor.fetchall()
+
+        masks = {self.grouping_mask(grouping): grouping for grouping in self.sets}
+        result = {grouping: [] for grouping in self.sets}
+        size = len(self.dimensions)
+        for row in fetched:
+            grouping = masks[row[0]]
+            values = dict(zip(self.dimensions, row[1:size + 1]))
+            item = {dimension: values[dimension] for dimension in grouping}
+            item.update(zip(self.measures, row[size + 1:]))
+            result[grouping].append(item)
+
+        return {
+            'sets': [
+                {'dimensions': list(grouping), 'rows': rows}
+                for grouping, rows in result.items()
+            ]
+        }
+
+    def grouping_mask(self, grouping):
+        """Маска GROUPING(): старший бит - первый разрез, бит установлен, если разрез свернут"""
+        size = len(self.dimensions)
+        return sum(
+            1 << (size - 1 - position)
+            for position, dimension in enumerate(self.dimensions)
+            if dimension not in grouping
+        )
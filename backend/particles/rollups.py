@@ -0,0 +1,208 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from loguru import logger
+
+from .models import AssemblyRollup, PartiallyPickedAssembly, PartiallyPickedProduct, ProductRollup
+
+# Пересчеты отдельных часов идут параллельно под разделяемой блокировкой и блокировкой своего часа,
+# пересчет целых дней и полная пересборка - под исключительной
+ROLLUP_LOCK_KEY = 'particles_rollups'
+
+# Больше затронутых часов (массовое изменение черного списка) - пересчитываются целые дни
+MAX_REFRESH_SLOTS = 48
+
+
+def _date_ranges(dates):
+    """Группирует даты в непрерывные отрезки [(первая, последняя), ...]"""
+    ranges = []
+    for day in sorted(dates):
+        if ranges and day == ranges[-1][1] + timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return ranges
+
+
+def _lock_rollups():
+    """Блокировка до конца транзакции, чтобы параллельные пересчеты не задваивали строки"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [ROLLUP_LOCK_KEY])
+
+
+def _lock_slots(slots):
+    """Блокировки пересчитываемых часов (в одном порядке во всех транзакциях, без взаимных блокировок)"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock_shared(hashtext(%s))", [ROLLUP_LOCK_KEY])
+        for day, hour in sorted(slots):
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f'{ROLLUP_LOCK_KEY}:{day}:{hour}'])
+
+
+def _range_condition(first_day, last_day):
+    """Условие на дни first_day..last_day: функция (поле даты, поле часа) -> Q"""
+    return lambda date, hour: Q(**{f'{date}__gte': first_day, f'{date}__lte': last_day})
+
+
+def _slots_condition(slots):
+    """Условие на часы [(дата, час), ...]: функция (поле даты, поле часа) -> Q"""
+    def condition(date, hour):
+        result = Q()
+        for day, slot_hour in slots:
+            result |= Q(**{date: day, hour: slot_hour})
+        return result
+    return condition
+
+
+def _assembly_rows(condition):
+    return PartiallyPickedAssembly.objects.filter(
+        condition('created_date', 'created_hour'),
+        black_list=False,
+    ).annotate(
+        date=F('created_date'),
+        hour=F('created_hour'),
+        assembler_key=Coalesce(F('assembler'), Value('')),
+        zone_key=Coalesce(F('assembly_zone'), Value('')),
+    ).values(
+        'date', 'hour', 'assembler_key', 'zone_key'
+    ).annotate(
+        assemblies_count=Count('id'),
+        assemblies_with_products=Count('id', filter=Q(products_count__gt=0)),
+        products_sum=Sum('products_count'),
+        missing_sum=Sum('total_missing_quantity'),
+        first_created_at=Min('created_at'),
+        last_created_at=Max('created_at'),
+    ).order_by()
+
+
+def _product_rows(condition):
+    return PartiallyPickedProduct.objects.filter(
+        condition('assembly__created_date', 'assembly__created_hour'),
+        assembly__black_list=False,
+        black_list=False,
+    ).annotate(
+        date=F('assembly__created_date'),
+        hour=F('assembly__created_hour'),
+        assembler_key=Coalesce(F('assembly__assembler'), Value('')),
+        zone_key=Coalesce(F('assembly__assembly_zone'), Value('')),
+        department_key=Coalesce(F('department_id'), Value('')),
+    ).values(
+        'date', 'hour', 'assembler_key', 'zone_key', 'department_key'
+    ).annotate(
+        assemblies_sum=Count('assembly', distinct=True),
+        products_sum=Count('id'),
+        critical_sum=Count('id', filter=Q(is_critical=True)),
+        quantity_sum=Sum('quantity'),
+        collected_sum=Sum('collected_quantity'),
+        missing_sum=Sum('missing_quantity'),
+        critical_missing_sum=Coalesce(Sum('missing_quantity', filter=Q(is_critical=True)), 0),
+        first_created_at=Min('assembly__created_at'),
+        last_created_at=Max('assembly__created_at'),
+    ).order_by()
+
+
+def _refresh(condition):
+    """Заменяет агрегаты, попадающие под условие, пересчитанными из исходных данных"""
+    AssemblyRollup.objects.filter(condition('date', 'hour')).delete()
+    ProductRollup.objects.filter(condition('date', 'hour')).delete()
+
+    AssemblyRollup.objects.bulk_create([
+        AssemblyRollup(
+            date=row['date'],
+            hour=row['hour'],
+            assembler=row['assembler_key'],
+            assembly_zone=row['zone_key'],
+            assemblies_count=row['assemblies_count'],
+            assemblies_with_products=row['assemblies_with_products'],
+            products_count=row['products_sum'] or 0,
+            missing_quantity=row['missing_sum'] or 0,
+            first_created_at=row['first_created_at'],
+            last_created_at=row['last_created_at'],
+        )
+        for row in _assembly_rows(condition)
+    ], batch_size=2000)
+
+    ProductRollup.objects.bulk_create([
+        ProductRollup(
+            date=row['date'],
+            hour=row['hour'],
+            assembler=row['assembler_key'],
+            assembly_zone=row['zone_key'],
+            department_id=row['department_key'],
+            assemblies_count=row['assemblies_sum'],
+            products_count=row['products_sum'],
+            critical_count=row['critical_sum'],
+            quantity=row['quantity_sum'] or 0,
+            collected_quantity=row['collected_sum'] or 0,
+            missing_quantity=row['missing_sum'] or 0,
+            critical_missing_quantity=row['critical_missing_sum'],
+            first_created_at=row['first_created_at'],
+            last_created_at=row['last_created_at'],
+        )
+        for row in _product_rows(condition)
+    ], batch_size=2000)
+
+
+def refresh_rollups(slots):
+    """
+    Пересчитывает агрегаты за указанные местные часы [(дата, час), ...].
+    Дата и час сборки не меняются при обновлении, поэтому пересчет ее часа учитывает
+    и смену сборщика или зоны. При большом числе часов пересчитываются целые дни
+    """
+    slots = set(slots)
+    if not slots:
+        return
+
+    with transaction.atomic():
+        if len(slots) <= MAX_REFRESH_SLOTS:
+            _lock_slots(slots)
+            _refresh(_slots_condition(slots))
+            return
+
+        _lock_rollups()
+        for first_day, last_day in _date_ranges({day for day, _ in slots}):
+            _refresh(_range_condition(first_day, last_day))
+
+
+def refresh_rollups_for_assemblies(assembly_ids):
+    """Пересчитывает агрегаты за часы, в которые созданы указанные сборки"""
+    slots = PartiallyPickedAssembly.objects.filter(
+        pk__in=assembly_ids
+    ).values_list('created_date', 'created_hour').distinct().order_by()
+    refresh_rollups(list(slots))
+
+
+def rebuild_rollups(days_per_batch=31):
+    """Полностью пересоздает агрегаты из исходных данных порциями по days_per_batch дней"""
+    bounds = PartiallyPickedAssembly.objects.aggregate(
+        first=Min('created_date'),
+        last=Max('created_date'),
+    )
+
+    with transaction.atomic():
+        _lock_rollups()
+        AssemblyRollup.objects.all().delete()
+        ProductRollup.objects.all().delete()
+
+        if bounds['first'] is None:
+            return 0
+
+        day = bounds['first']
+        batches = 0
+        while day <= bounds['last']:
+            last_day = min(day + timedelta(days=days_per_batch - 1), bounds['last'])
+            _refresh(_range_condition(day, last_day))
+            logger.info(f"Агрегаты пересчитаны за {day} - {last_day}")
+            day = last_day + timedelta(days=1)
+            batches += 1
+
+    return batches
+
+
+def on_assemblies_changed(sender, assembly_ids, **kwargs):
+    # Ошибка агрегатов не должна ломать прием данных: их можно пересобрать командой rebuild_rollups
+    try:
+        refresh_rollups_for_assemblies(assembly_ids)
+    except Exception as e:
+        logger.exception(f"Ошибка пересчета агрегатов: {e}")
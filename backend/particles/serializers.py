@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from django.db import transaction, IntegrityError
-from .models import PartiallyPickedAssembly, PartiallyPickedProduct
+from .blacklist import get_blacklist_matcher
+from .heavy_hitters import on_assemblies_created
+from .models import BlacklistRule, PartiallyPickedAssembly, PartiallyPickedProduct
+from .signals import send_assemblies_changed
 
 
 class PartiallyPickedProductSerializer(serializers.ModelSerializer):
@@ -86,7 +89,7 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
             )
             return assembly, True  # True = новая сборка
 
-    def create_or_update_product(self, assembly, product_data):
+    def create_or_update_product(self, assembly, product_data, black_list=False):
         """Создает или пропускает товар если он уже существует"""
         try:
             # Пробуем найти существующий товар
@@ -101,6 +104,8 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
             product.department_id = product_data.get('departmentId', product.department_id)
             product.image_url = product_data.get('image', product.image_url)
             product.source = product_data.get('source', product.source)
+            # Снимать игнорирование при повторном приеме нельзя, только выставлять по правилам
+            product.black_list = product.black_list or black_list
             product.save()
             return product, False  # False = не новый товар
 
@@ -115,7 +120,8 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
                 quantity=product_data.get('quantity', 0),
                 collected_quantity=product_data.get('collected_quantity', 0),
                 missing_quantity=product_data.get('missing_quantity', 0),
-                source=product_data.get('source')
+                source=product_data.get('source'),
+                black_list=black_list
             )
             return product, True  # True = новый товар
 
@@ -130,6 +136,12 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
         updated_assemblies = 0
         updated_products = 0
         skipped_products = 0
+        blacklisted_by_rules = 0
+        skipped_by_rules = 0
+
+        matcher = get_blacklist_matcher()
+        touched_assemblies = set()
+        new_assemblies = set()
 
         with transaction.atomic():
             for assembly_data in assemblies:
@@ -139,17 +151,35 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
                         assembly_data, timestamp, system_info
                     )
 
+                    touched_assemblies.add(assembly.pk)
+
                     if is_new_assembly:
                         created_assemblies += 1
+                        new_assemblies.add(assembly.pk)
                     else:
                         updated_assemblies += 1
 
                     # Обрабатываем товары
                     products_data = assembly_data.get('products', [])
                     for product_data in products_data:
+                        action = None
+                        if matcher:
+                            action = matcher.match(
+                                lm_code=product_data.get('lmCode'),
+                                department_id=product_data.get('departmentId'),
+                                assembly_zone=assembly.assembly_zone,
+                                source=product_data.get('source'),
+                                title=product_data.get('title'),
+                            )
+
+                        if action == BlacklistRule.ACTION_SKIP:
+                            skipped_by_rules += 1
+                            continue
+
                         try:
                             product, is_new_product = self.create_or_update_product(
-                                assembly, product_data
+                                assembly, product_data,
+                                black_list=action == BlacklistRule.ACTION_BLACKLIST
                             )
 
                             if is_new_product:
@@ -157,6 +187,9 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
                             else:
                                 updated_products += 1
 
+                            if action == BlacklistRule.ACTION_BLACKLIST:
+                                blacklisted_by_rules += 1
+
                         except IntegrityError:
                             # Если все же возникла ошибка уникальности - пропускаем
                             skipped_products += 1
@@ -170,6 +203,10 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
                     print(f"Ошибка при обработке сборки {assembly_data.get('order')}: {e}")
                     continue
 
+            # Топ товаров дополняется в транзакции приема: фоновая пересборка часа не учтет сборку дважды
+            on_assemblies_created(new_assemblies)
+            send_assemblies_changed(touched_assemblies, created_ids=new_assemblies)
+
         return {
             'success': True,
             'stats': {
@@ -181,7 +218,36 @@ class PartiallyPickedAssemblyCreateSerializer(serializers.Serializer):
                 'products': {
                     'created': created_products,
                     'updated': updated_products,
-                    'skipped': skipped_products
+                    'skipped': skipped_products,
+                    'blacklisted_by_rules': blacklisted_by_rules,
+                    'skipped_by_rules': skipped_by_rules
                 }
             }
-        }
\ No newline at end of file
+        }
+
+class BulkBlacklistSerializer(serializers.Serializer):
+    """Параметры массового добавления/удаления товаров из черного списка"""
+
+    ACTION_BLACKLIST = 'blacklist'
+    ACTION_UNBLACKLIST = 'unblacklist'
+
+    action = serializers.ChoiceField(choices=[ACTION_BLACKLIST, ACTION_UNBLACKLIST])
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    lm_codes = serializers.ListField(child=serializers.CharField(max_length=50), required=False)
+    department_id = serializers.CharField(max_length=10, required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        # Без явного отбора запрос затронул бы все товары
+        if not (attrs.get('ids') or attrs.get('lm_codes') or attrs.get('department_id')):
+            raise serializers.ValidationError(
+                "Нужно указать хотя бы один из параметров: ids, lm_codes, department_id"
+            )
+
+        date_from = attrs.get('date_from')
+        date_to = attrs.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError("date_from не может быть позже date_to")
+
+        return attrs
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.dispatch import Signal
+
+# Изменились данные сборок (прием данных, черный список).
+# Аргументы: assembly_ids - множество id затронутых сборок,
+# created_ids - те из них, что созданы в этой транзакции (их данные только добавились)
+assemblies_changed = Signal()
+
+
+def send_assemblies_changed(assembly_ids, sender=None, created_ids=()):
+    """Отправляет сигнал после фиксации текущей транзакции"""
+    assembly_ids = set(assembly_ids)
+    if not assembly_ids:
+        return
+    created_ids = set(created_ids) & assembly_ids
+    transaction.on_commit(
+        lambda: assemblies_changed.send(sender=sender, assembly_ids=assembly_ids, created_ids=created_ids)
+    )
@@ -0,0 +1,1009 @@
+import heapq
+from collections import defaultdict
+from datetime import date, timedelta
+from functools import cached_property
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import connection
+from django.db.models import Avg, Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+from .distinct_sketches import ALL_DEPARTMENTS, department_cardinalities, union_cardinality
+from .matviews import matview_usable
+from .models import (
+    AssemblyRollup,
+    DistinctSketch,
+    PartiallyPickedAssembly,
+    PartiallyPickedProduct,
+    ProductDailyStat,
+    ProductRollup,
+)
+from .stats_cache import get_or_compute, section_key
+from .utils import local_day_bounds
+
+# Сборки склада в статистике не учитываются
+EXCLUDED_ZONE = 'WH'
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _parse_hours(value):
+    try:
+        hours = int(value)
+    except (TypeError, ValueError):
+        return None
+    return hours if hours > 0 else None
+
+
+def _unique_assemblers(field):
+    """Число различных сборщиков; пустой сборщик не считается - так же, как в агрегатах и представлениях"""
+    return Count(field, distinct=True, filter=~Q(**{field: ''}))
+
+
+def _ratio(numerator, denominator, scale=1):
+    return numerator / denominator * scale if denominator else 0
+
+
+def _comparison(current, previous, keys):
+    """Значение предыдущего периода и изменение для каждого показателя"""
+    result = {}
+    for key in keys:
+        value, before = current.get(key), previous.get(key)
+        if value is None or before is None:
+            result[key] = {'previous': before, 'delta': None, 'delta_percent': None}
+            continue
+        delta = value - before
+        result[key] = {
+            'previous': before,
+            'delta': delta,
+            'delta_percent': delta / before * 100 if before else None,
+        }
+    return result
+
+
+def _within(aggregate, condition):
+    """Копия агрегата с дополнительным условием FILTER"""
+    aggregate = aggregate.copy()
+    aggregate.filter = condition if aggregate.filter is None else aggregate.filter & condition
+    return aggregate
+
+
+# Префикс агрегатов предыдущего периода в строках запроса
+PREVIOUS = 'previous_'
+
+# Показатели общей статистики, сравниваемые с предыдущим периодом.
+# Уникальные товары и сборщики не сравниваются: их оценки по периодам не складываются в один проход
+COMPARED_TOTALS = (
+    'total_assemblies', 'total_products', 'assemblies_with_products', 'assemblies_without_products',
+    'total_missing_quantity', 'total_required_quantity', 'total_collected_quantity', 'collection_rate',
+    'critical_products', 'critical_percentage', 'critical_missing_quantity',
+    'non_critical_products', 'non_critical_missing_quantity',
+)
+COMPARED_DEPARTMENT = (
+    'product_count', 'total_missing', 'total_required', 'total_collected', 'unique_assemblies',
+    'avg_missing', 'collection_rate', 'avg_per_assembly',
+)
+# Итоги агрегатов товаров: одни и те же суммы группируются по отделам, сборщикам и часам в одном проходе
+PRODUCT_ROLLUP_AGGREGATES = {
+    'products': Sum('products_count'),
+    'critical': Sum('critical_count'),
+    'quantity': Sum('quantity'),
+    'collected': Sum('collected_quantity'),
+    'missing': Sum('missing_quantity'),
+    'critical_missing': Sum('critical_missing_quantity'),
+    'assemblies': Sum('assemblies_count'),
+}
+# Имена ключей - строки: результат кешируется и должен сериализоваться (в том числе панелями отладки)
+PRODUCT_ROLLUP_SETS = {
+    'total': (),
+    'department': ('department_id',),
+    'assembler': ('assembler',),
+    'hour': ('date', 'hour'),
+}
+
+# Названия итогов в разделе отделов
+DEPARTMENT_FIELDS = {
+    'product_count': 'products',
+    'total_missing': 'missing',
+    'total_required': 'quantity',
+    'total_collected': 'collected',
+    'unique_assemblies': 'assemblies',
+    'critical_count': 'critical',
+    'critical_missing': 'critical_missing',
+}
+
+ASSEMBLER_AGGREGATES = {
+    'assembly_count': Sum('assemblies_count'),
+    'total_products': Sum('products_count'),
+    'total_missing': Sum('missing_quantity'),
+    'first_activity': Min('first_created_at'),
+    'last_activity': Max('last_created_at'),
+}
+
+COMPARED_ASSEMBLER = (
+    'assembly_count', 'total_products', 'total_missing', 'avg_products_per_assembly', 'avg_time_between',
+)
+
+
+class DashboardFilters:
+    """Нормализованные фильтры дашборда статистики"""
+
+    def __init__(self, date_from=None, date_to=None, assembler=None, department_id=None, repeat_hours=None,
+                 exact=False, compare=False):
+        self.date_from = _parse_date(date_from)
+        self.date_to = _parse_date(date_to)
+        self.assembler = (assembler or '').strip() or None
+        self.department_id = (department_id or '').strip() or None
+        self.repeat_hours = _parse_hours(repeat_hours)
+        if self.repeat_hours is None:
+            self.repeat_hours = settings.REPEATED_PRODUCTS_WINDOW_HOURS or None
+        # Точный подсчет уникальных значений вместо оценки по скетчам
+        self.exact = bool(exact)
+        # Сравнение с предыдущим периодом той же длины
+        self.compare = bool(compare)
+
+    @classmethod
+    def from_request(cls, params):
+        return cls(
+            date_from=params.get('date_from'),
+            date_to=params.get('date_to'),
+            assembler=params.get('assembler'),
+            department_id=params.get('department_id'),
+            repeat_hours=params.get('repeat_hours'),
+            exact=params.get('exact') in ('1', 'true', 'on'),
+            compare=params.get('compare') in ('1', 'true', 'on'),
+        )
+
+    def as_dict(self):
+        return {
+            'date_from': self.date_from.isoformat() if self.date_from else None,
+            'date_to': self.date_to.isoformat() if self.date_to else None,
+            'assembler': self.assembler,
+            'department_id': self.department_id,
+            'repeat_hours': self.repeat_hours,
+            'exact': self.exact,
+            'compare': self.compare,
+        }
+
+    @cached_property
+    def previous_period(self):
+        """
+        (начало, конец) предыдущего периода той же длины, что и выбранный.
+        Без начала периода сравнивать не с чем; открытый конец - по сегодняшний день
+        """
+        if not self.compare or self.date_from is None:
+            return None
+        date_to = self.date_to or timezone.localdate()
+        if date_to < self.date_from:
+            return None
+        length = (date_to - self.date_from).days + 1
+        return self.date_from - timedelta(days=length), self.date_from - timedelta(days=1)
+
+
+class DashboardStatistics:
+    """
+    Разделы дашборда статистики.
+    Разрезы по времени, сборщикам и отделам читаются из агрегатов (AssemblyRollup, ProductRollup),
+    поэтому их стоимость зависит от длины периода, а не от объема истории.
+    Разрезы по LM кодам для закрытых периодов без фильтра по сборщику читаются
+    из материализованного представления (ProductDailyStat), иначе считаются по исходным данным.
+    Число уникальных товаров и сборщиков за длинные периоды оценивается по дневным скетчам (DistinctSketch).
+    При сравнении периодов агрегаты читаются за оба периода сразу и разделяются условиями FILTER по дате
+    """
+    SECTIONS = (
+        'total_stats',
+        'assembler_stats',
+        'product_stats',
+        'department_stats',
+        'time_stats',
+        'critical_stats',
+    )
+    # Общие агрегаты и разделы, которые их используют
+    SHARED_AGGREGATES = {
+        'product_rollup_sets': ('total_stats', 'department_stats', 'critical_stats'),
+        'lm_code_rows': ('product_stats', 'critical_stats'),
+    }
+
+    def __init__(self, filters, version=None):
+        self.filters = filters
+        # Версия данных статистики: если задана, общие агрегаты кешируются и используются
+        # разделами, которые считаются в разных запросах
+        self.version = version
+
+    def _shared(self, name, compute):
+        if self.version is None:
+            return compute()
+        return get_or_compute(section_key(self.filters, name, self.version), compute, name=name)
+
+    # Источники данных
+
+    def _filter_rollups(self, queryset, with_previous=False):
+        queryset = queryset.exclude(assembly_zone=EXCLUDED_ZONE)
+
+        if with_previous and self.filters.previous_period:
+            queryset = queryset.filter(date__gte=self.filters.previous_period[0])
+        elif self.filters.date_from:
+            queryset = queryset.filter(date__gte=self.filters.date_from)
+
+        if self.filters.date_to:
+            queryset = queryset.filter(date__lte=self.filters.date_to)
+
+        if self.filters.assembler:
+            queryset = queryset.filter(assembler__icontains=self.filters.assembler)
+
+        return queryset
+
+    def product_rollups(self, with_previous=False):
+        queryset = self._filter_rollups(ProductRollup.objects.all(), with_previous)
+        if self.filters.department_id:
+            queryset = queryset.filter(department_id=self.filters.department_id)
+        return queryset
+
+    def assembly_rollups(self, with_previous=False):
+        """
+        Агрегаты уровня сборки. При фильтре по отделу считаются по ячейкам товаров отдела:
+        в них те же поля assemblies_count, products_count, missing_quantity, first/last_created_at.
+        with_previous=True - вместе с предыдущим периодом, если включено сравнение
+        """
+        if self.filters.department_id:
+            return self.product_rollups(with_previous)
+        return self._filter_rollups(AssemblyRollup.objects.all(), with_previous)
+
+    # Сравнение периодов
+
+    def _periods(self, **aggregates):
+        """
+        Агрегаты для выборки за оба периода: каждый считается дважды с условием по дате -
+        за текущий период и, с префиксом PREVIOUS, за предыдущий
+        """
+        if not self.filters.previous_period:
+            return aggregates
+        current = Q(date__gte=self.filters.date_from)
+        # Агрегаты предыдущего периода идут первыми: имена агрегатов текущего периода
+        # совпадают с полями (quantity) и иначе заслонили бы их
+        result = {PREVIOUS + name: _within(aggregate, ~current) for name, aggregate in aggregates.items()}
+        result.update((name, _within(aggregate, current)) for name, aggregate in aggregates.items())
+        return result
+
+    def _split_periods(self, row, aggregates):
+        """
+        Строка запроса с _periods -> (текущий период, предыдущий период или None).
+        Пустые суммы становятся нулями, Min/Max остаются None
+        """
+        def value(name, result):
+            if result is None and not isinstance(aggregates[name], (Min, Max)):
+                return 0
+            return result
+
+        current = {
+            key: value(key, result) if key in aggregates else result
+            for key, result in row.items() if not key.startswith(PREVIOUS)
+        }
+        if not self.filters.previous_period:
+            return current, None
+        previous = {name: value(name, row[PREVIOUS + name]) for name in aggregates}
+        return current, previous
+
+    def _aggregate_periods(self, queryset, **aggregates):
+        """Итоги текущего и предыдущего периода одним запросом"""
+        return self._split_periods(queryset.aggregate(**self._periods(**aggregates)), aggregates)
+
+    def _collect_periods(self, rows, fields, aggregates):
+        """
+        Строки группировки с _periods -> (строки текущего периода, {значения fields: итоги предыдущего периода}).
+        Группы, которые есть только в предыдущем периоде, в строки не попадают,
+        а для групп, которых в нем не было, итоги предыдущего периода нулевые
+        """
+        empty = {name: None if isinstance(aggregate, (Min, Max)) else 0 for name, aggregate in aggregates.items()}
+        current_rows, previous = [], defaultdict(lambda: dict(empty))
+        for row in rows:
+            current, before = self._split_periods(row, aggregates)
+            key = tuple(row[field] for field in fields)
+            if before is not None:
+                previous[key] = before
+                if all(row[name] is None for name in aggregates):
+                    continue
+            current_rows.append(current)
+        return current_rows, previous
+
+    def _grouping_sets(self, queryset, sets, aggregates):
+        """
+        Несколько группировок выборки агрегатов одним проходом (GROUP BY GROUPING SETS):
+        sets - {имя: набор полей}, результат - {имя: [строки]}. Агрегаты - Sum/Min/Max по полям, при сравнении каждый
+        считается за оба периода, как в _periods
+        """
+        fields = list(dict.fromkeys(field for grouping in sets.values() for field in grouping))
+        columns = {name: aggregate.source_expressions[0].name for name, aggregate in aggregates.items()}
+        rows_sql, rows_params = queryset.values(
+            *dict.fromkeys(['date', *fields, *columns.values()])
+        ).order_by().query.sql_with_params()
+
+        quote = connection.ops.quote_name
+        selects, params = [], []
+        for name, aggregate in aggregates.items():
+            expression = f'{aggregate.function}(rows.{quote(columns[name])})'
+            if self.filters.previous_period:
+                # Как в _periods: агрегаты предыдущего периода идут первыми
+                selects.append(f'{expression} FILTER (WHERE rows.date < %s) AS {quote(PREVIOUS + name)}')
+                selects.append(f'{expression} FILTER (WHERE rows.date >= %s) AS {quote(name)}')
+                params += [self.filters.date_from, self.filters.date_from]
+            else:
+                selects.append(f'{expression} AS {quote(name)}')
+
+        field_columns = [f'rows.{quote(field)}' for field in fields]
+        grouping_sets = ', '.join('(' + ', '.join(f'rows.{quote(field)}' for field in grouping) + ')' for grouping in sets.values())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT GROUPING({', '.join(field_columns)}), {', '.join(field_columns)}, {', '.join(selects)}
+                FROM ({rows_sql}) AS rows
+                GROUP BY GROUPING SETS ({grouping_sets})
+                """,
+                params + list(rows_params)
+            )
+            names = [column.name for column in cursor.description[1 + len(fields):]]
+            fetched = cursor.fetchall()
+
+        # GROUPING(...) - битовая маска свернутых полей (старший бит - первое поле)
+        masks = {}
+        for name, grouping in sets.items():
+            mask = sum(1 << (len(fields) - 1 - position) for position, field in enumerate(fields) if field not in grouping)
+            masks[mask] = name
+        result = {name: [] for name in sets}
+        for row in fetched:
+            name = masks[row[0]]
+            values = dict(zip(fields, row[1:1 + len(fields)]))
+            item = {field: values[field] for field in sets[name]}
+            item.update(zip(names, row[1 + len(fields):]))
+            result[name].append(item)
+        return result
+
+    @cached_property
+    def use_matview(self):
+        return matview_usable(self.filters)
+
+    @cached_property
+    def use_sketches(self):
+        """
+        Уникальные значения оцениваются по скетчам, если не запрошен точный подсчет,
+        нет фильтра по сборщику (его нет в скетчах) и период не короче STATISTICS_SKETCH_MIN_DAYS.
+        Открытая граница периода берется по данным: первая или последняя дата сборок
+        """
+        if self.filters.exact or self.filters.assembler:
+            return False
+
+        date_from, date_to = self.filters.date_from, self.filters.date_to
+        if date_from is None or date_to is None:
+            bounds = PartiallyPickedAssembly.objects.aggregate(first=Min('created_date'), last=Max('created_date'))
+            date_from = date_from or bounds['first']
+            date_to = date_to or bounds['last']
+            if date_from is None or date_to is None:
+                return False
+
+        return (date_to - date_from).days + 1 >= settings.STATISTICS_SKETCH_MIN_DAYS
+
+    def distinct_sketches(self):
+        """Дневные скетчи уникальных значений за период"""
+        queryset = DistinctSketch.objects.all()
+
+        if self.filters.date_from:
+            queryset = queryset.filter(date__gte=self.filters.date_from)
+
+        if self.filters.date_to:
+            queryset = queryset.filter(date__lte=self.filters.date_to)
+
+        return queryset
+
+    def product_daily_stats(self):
+        """Товары по дням из материализованного представления"""
+        queryset = ProductDailyStat.objects.all()
+
+        if self.filters.date_from:
+            queryset = queryset.filter(date__gte=self.filters.date_from)
+
+        if self.filters.date_to:
+            queryset = queryset.filter(date__lte=self.filters.date_to)
+
+        if self.filters.department_id:
+            queryset = queryset.filter(department_id=self.filters.department_id)
+
+        return queryset
+
+    def assemblies(self):
+        """Исходные сборки за период"""
+        assemblies = PartiallyPickedAssembly.objects.filter(
+            black_list=False
+        ).exclude(assembly_zone=EXCLUDED_ZONE)
+
+        if self.filters.date_from:
+            assemblies = assemblies.filter(created_date__gte=self.filters.date_from)
+        if self.filters.date_to:
+            assemblies = assemblies.filter(created_date__lte=self.filters.date_to)
+
+        if self.filters.assembler:
+            assemblies = assemblies.filter(assembler__icontains=self.filters.assembler)
+
+        if self.filters.department_id:
+            assemblies = assemblies.filter(
+                products__department_id=self.filters.department_id,
+                products__black_list=False
+            ).distinct()
+
+        return assemblies
+
+    def products(self):
+        """Исходные товары за период"""
+        products = PartiallyPickedProduct.objects.filter(
+            black_list=False,
+            assembly__black_list=False
+        ).exclude(assembly__assembly_zone=EXCLUDED_ZONE)
+
+        if self.filters.date_from:
+            products = products.filter(assembly__created_date__gte=self.filters.date_from)
+        if self.filters.date_to:
+            products = products.filter(assembly__created_date__lte=self.filters.date_to)
+
+        if self.filters.assembler:
+            products = products.filter(assembly__assembler__icontains=self.filters.assembler)
+
+        if self.filters.department_id:
+            products = products.filter(department_id=self.filters.department_id)
+
+        return products
+
+    # Общие агрегаты: считаются одним проходом и используются несколькими разделами
+
+    @cached_property
+    def product_rollup_sets(self):
+        """
+        Итоги агрегатов товаров одним проходом: всего, по отделам, по сборщикам и по (дата, час).
+        Из них строятся итоги, разделы отделов и критических товаров
+        """
+        return self._shared('product_rollup_sets', lambda: self._grouping_sets(
+            self.product_rollups(with_previous=True), PRODUCT_ROLLUP_SETS, PRODUCT_ROLLUP_AGGREGATES
+        ))
+
+    @cached_property
+    def product_period_totals(self):
+        """Итоги по товарам с разбивкой на критические и обычные: (текущий период, предыдущий или None)"""
+        current, previous = self._split_periods(self.product_rollup_sets['total'][0], PRODUCT_ROLLUP_AGGREGATES)
+        for totals in (current, previous):
+            if totals is not None:
+                totals['non_critical'] = totals['products'] - totals['critical']
+                totals['non_critical_missing'] = totals['missing'] - totals['critical_missing']
+        return current, previous
+
+    @property
+    def product_totals(self):
+        return self.product_period_totals[0]
+
+    @cached_property
+    def assembly_period_totals(self):
+        """Итоги по сборкам: (текущий период, предыдущий или None)"""
+        if self.filters.department_id:
+            # Все сборки отдела содержат его товары
+            return tuple(
+                totals and {'assemblies': totals['assemblies'], 'with_products': totals['assemblies']}
+                for totals in self.product_period_totals
+            )
+
+        return self._aggregate_periods(
+            self.assembly_rollups(with_previous=True),
+            assemblies=Sum('assemblies_count'),
+            with_products=Sum('assemblies_with_products'),
+        )
+
+    @property
+    def assembly_totals(self):
+        return self.assembly_period_totals[0]
+
+    @cached_property
+    def department_period_rows(self):
+        """Итоги по отделам, включая критические товары: (строки, {(отдел,): итоги предыдущего периода})"""
+        rows, previous = self._collect_periods(
+            self.product_rollup_sets['department'], ('department_id',), PRODUCT_ROLLUP_AGGREGATES
+        )
+
+        def department(item):
+            return {name: item[field] for name, field in DEPARTMENT_FIELDS.items()}
+
+        rows = sorted(
+            ({'department_id': item['department_id'], **department(item)} for item in rows),
+            key=lambda item: (-item['total_missing'], item['department_id'])
+        )
+        empty = department(dict.fromkeys(PRODUCT_ROLLUP_AGGREGATES, 0))
+        return rows, defaultdict(lambda: dict(empty), {key: department(item) for key, item in previous.items()})
+
+    @property
+    def department_rows(self):
+        return self.department_period_rows[0]
+
+    @cached_property
+    def hour_cells(self):
+        """
+        Сборки по (дата, час): из них складываются и дневная, и часовая статистика.
+        При сравнении - вместе с ячейками предыдущего периода
+        """
+        return list(self.assembly_rollups(with_previous=True).values('date', 'hour').annotate(
+            count=Sum('assemblies_count'),
+            products=Sum('products_count'),
+            missing=Sum('missing_quantity'),
+        ).order_by('date', 'hour'))
+
+    @cached_property
+    def distinct_totals(self):
+        """Уникальные LM коды и сборщики за период: оценка по скетчам или точный подсчет"""
+        if self.use_sketches:
+            rows = self.distinct_sketches().filter(
+                department_id=self.filters.department_id or ALL_DEPARTMENTS
+            ).values_list('products', 'assemblers')
+            products = [row[0] for row in rows]
+            assemblers = [row[1] for row in rows]
+            return {
+                'unique_products': union_cardinality(products),
+                'unique_assemblers': union_cardinality(assemblers),
+            }
+
+        return self.products().aggregate(
+            unique_products=Count('lm_code', distinct=True),
+            unique_assemblers=_unique_assemblers('assembly__assembler'),
+        )
+
+    @cached_property
+    def lm_code_rows(self):
+        """
+        Товары по LM коду за период с отдельными итогами по критическим.
+        Один проход по исходным данным (или по представлению) для частоты появления и критических товаров
+        """
+        if self.use_matview:
+            rows = list(self.product_daily_stats().values('lm_code', 'title').annotate(
+                total_occurrences=Sum('occurrences'),
+                days_active=Count('date', distinct=True),
+                last_seen=Max('last_seen'),
+                critical_count=Sum('critical_count'),
+                critical_missing=Sum('critical_missing_quantity'),
+                critical_assemblies=Sum('critical_assemblies'),
+            ).order_by())
+            for row in rows:
+                # В представлении отсутствующее название хранится пустой строкой
+                row['title'] = row['title'] or None
+                if not row['critical_count']:
+                    row['critical_missing'] = None
+            return rows
+
+        return list(self.products().values('lm_code', 'title').annotate(
+            total_occurrences=Count('id'),
+            days_active=Count('assembly__created_date', distinct=True),
+            last_seen=Max('assembly__created_at'),
+            critical_count=Count('id', filter=Q(is_critical=True)),
+            critical_missing=Sum('missing_quantity', filter=Q(is_critical=True)),
+            critical_assemblies=Count('assembly', distinct=True, filter=Q(is_critical=True)),
+        ).order_by())
+
+    # Разделы
+
+    def compute(self, section):
+        return getattr(self, f'get_{section}')()
+
+    def compute_all(self):
+        return {section: self.compute(section) for section in self.SECTIONS}
+
+    def prepare(self, sections):
+        """
+        Считает общие агрегаты, нужные нескольким из sections.
+        Вызывается перед расчетом разделов в потоках: cached_property не защищает от одновременного расчета,
+        и каждый поток посчитал бы агрегат заново
+        """
+        for name, users in self.SHARED_AGGREGATES.items():
+            if len(set(users) & set(sections)) > 1:
+                getattr(self, name)
+
+    def get_total_stats(self):
+        """Общая статистика за период, при сравнении - с изменением относительно предыдущего"""
+        products, previous_products = self.product_period_totals
+        assemblies, previous_assemblies = self.assembly_period_totals
+
+        stats = self._total_stats(products, assemblies)
+        stats['unique_products'] = self.distinct_totals['unique_products']
+        stats['unique_assemblers'] = self.distinct_totals['unique_assemblers']
+
+        if previous_products is not None:
+            stats['comparison'] = _comparison(
+                stats, self._total_stats(previous_products, previous_assemblies), COMPARED_TOTALS
+            )
+        return stats
+
+    @staticmethod
+    def _total_stats(products, assemblies):
+        return {
+            'total_assemblies': assemblies['assemblies'],
+            'total_products': products['products'],
+            'assemblies_with_products': assemblies['with_products'],
+            'assemblies_without_products': assemblies['assemblies'] - assemblies['with_products'],
+            'total_missing_quantity': products['missing'],
+            'total_required_quantity': products['quantity'],
+            'total_collected_quantity': products['collected'],
+            'collection_rate': _ratio(products['collected'], products['quantity'], 100),
+            'critical_products': products['critical'],
+            'critical_percentage': _ratio(products['critical'], products['products'], 100),
+            'critical_missing_quantity': products['critical_missing'],
+            'non_critical_products': products['non_critical'],
+            'non_critical_missing_quantity': products['non_critical_missing'],
+        }
+
+    def get_assembler_stats(self):
+        """Статистика по сборщикам: итоги и часы по сборщикам одним проходом по агрегатам"""
+        sets = self._grouping_sets(
+            self.assembly_rollups(with_previous=True), {'assembler': ('assembler',), 'hour': ('assembler', 'hour')}, ASSEMBLER_AGGREGATES
+        )
+
+        stats, previous = self._collect_periods(sets['assembler'], ('assembler',), ASSEMBLER_AGGREGATES)
+        stats.sort(key=lambda item: (-item['assembly_count'], item['assembler']))
+
+        # Час пиковой активности каждого сборщика за текущий период (при равенстве - более ранний)
+        peak_hours = {}
+        for cell in sets['hour']:
+            count = cell['assembly_count'] or 0
+            best = peak_hours.get(cell['assembler'])
+            if count and (best is None or (count, -cell['hour']) > (best[1], -best[0])):
+                peak_hours[cell['assembler']] = (cell['hour'], count)
+
+        for item in stats:
+            self._assembler_rates(item)
+            if self.filters.previous_period:
+                before = self._assembler_rates(previous[(item['assembler'],)])
+                item['comparison'] = _comparison(item, before, COMPARED_ASSEMBLER)
+
+            peak_hour = peak_hours.get(item['assembler'])
+            if peak_hour:
+                item['peak_hour'] = f"{peak_hour[0]}:00"
+                item['peak_hour_count'] = peak_hour[1]
+            else:
+                item['peak_hour'] = None
+                item['peak_hour_count'] = 0
+
+        return stats
+
+    @staticmethod
+    def _assembler_rates(item):
+        item['avg_products_per_assembly'] = _ratio(item['total_products'], item['assembly_count'])
+
+        # Среднее время между сборками в минутах.
+        # Сумма интервалов между соседними сборками равна (последняя - первая),
+        # поэтому среднее не требует перебора сборок
+        first_activity = item.pop('first_activity')
+        if item['assembly_count'] > 1:
+            item['avg_time_between'] = (
+                (item['last_activity'] - first_activity).total_seconds() / 60 / (item['assembly_count'] - 1)
+            )
+        else:
+            item['avg_time_between'] = None
+        return item
+
+    def get_product_stats(self):
+        """Статистика по товарам"""
+        products = self.products()
+
+        # Топ товаров по количеству недостачи
+        top_by_missing = products.values('lm_code', 'title', 'department_id').annotate(
+            total_missing=Sum('missing_quantity'),
+            occurrences=Count('id'),
+            avg_missing=Avg('missing_quantity'),
+            max_missing=Max('missing_quantity'),
+            assemblies_count=Count('assembly', distinct=True),
+            assemblers_count=_unique_assemblers('assembly__assembler'),
+        ).order_by('-total_missing')[:20]
+
+        # Товары с повторными попаданиями в течение суток
+        repeated_products = self.repeated_products()
+
+        # Частота появления товаров
+        frequency_stats = [
+            {
+                'lm_code': row['lm_code'],
+                'title': row['title'],
+                'total_occurrences': row['total_occurrences'],
+                'days_active': row['days_active'],
+                'avg_per_day': row['total_occurrences'] // row['days_active'],
+                'last_seen': row['last_seen'],
+            }
+            for row in heapq.nlargest(15, self.lm_code_rows, key=itemgetter('total_occurrences'))
+        ]
+
+        return {
+            'top_by_missing': list(top_by_missing),
+            'repeated_today': repeated_products,
+            'frequency_stats': frequency_stats,
+        }
+
+    def repeat_window(self):
+        """
+        Окно поиска повторов: последние repeat_hours часов,
+        а если они не заданы - текущие местные сутки
+        """
+        if self.filters.repeat_hours:
+            now = timezone.now()
+            return now - timedelta(hours=self.filters.repeat_hours), now
+        today = timezone.localdate()
+        return local_day_bounds(today, today)
+
+    def repeated_products(self):
+        """Товары, попавшие в окно повторов больше одного раза, вместе с подробностями - одним запросом"""
+        start, end = self.repeat_window()
+        # Массивы подробностей собираются в одном порядке, поэтому их элементы соответствуют друг другу
+        ordering = ('assembly__created_at', 'id')
+
+        rows = self.products().filter(
+            assembly__created_at__gte=start,
+            assembly__created_at__lt=end
+        ).values('lm_code', 'title', 'department_id').annotate(
+            today_count=Count('id'),
+            order_numbers=ArrayAgg('assembly__order_number', order_by=ordering),
+            missing_quantities=ArrayAgg('missing_quantity', order_by=ordering),
+            created_at=ArrayAgg('assembly__created_at', order_by=ordering),
+            assemblers=ArrayAgg('assembly__assembler', order_by=ordering),
+        ).filter(today_count__gt=1).order_by('-today_count', 'lm_code')
+
+        return [
+            {
+                'lm_code': row['lm_code'],
+                'title': row['title'],
+                'department_id': row['department_id'],
+                'today_count': row['today_count'],
+                'details': [
+                    {
+                        'assembly__order_number': order_number,
+                        'missing_quantity': missing_quantity,
+                        'assembly__created_at': created_at,
+                        'assembly__assembler': assembler,
+                    }
+                    for order_number, missing_quantity, created_at, assembler in zip(
+                        row['order_numbers'], row['missing_quantities'], row['created_at'], row['assemblers']
+                    )
+                ],
+            }
+            for row in rows
+        ]
+
+    def get_department_stats(self):
+        """Статистика по отделам"""
+        stats = [
+            {key: item[key] for key in (
+                'department_id', 'product_count', 'total_missing',
+                'total_required', 'total_collected', 'unique_assemblies',
+            )}
+            for item in self.department_rows if item['department_id']
+        ]
+
+        # Число различных товаров и сборщиков по ячейкам не суммируется - считаем по исходным данным
+        # или, для закрытого периода, по представлению товаров и агрегатам со сборщиками.
+        # За длинный период - оценка по дневным скетчам отделов
+        if self.use_sketches:
+            sketches = self.distinct_sketches()
+            if self.filters.department_id:
+                sketches = sketches.filter(department_id=self.filters.department_id)
+            distinct_counts = department_cardinalities(sketches)
+        elif self.use_matview:
+            distinct_counts = {
+                item['department_id']: {'unique_products': item['unique_products']}
+                for item in self.product_daily_stats().exclude(department_id='').values(
+                    'department_id'
+                ).annotate(
+                    unique_products=Count('lm_code', distinct=True),
+                ).order_by()
+            }
+            for item in self.product_rollups().exclude(department_id='').values('department_id').annotate(
+                unique_assemblers=_unique_assemblers('assembler'),
+            ).order_by():
+                distinct_counts.setdefault(item['department_id'], {})['unique_assemblers'] = item['unique_assemblers']
+        else:
+            distinct_counts = {
+                item['department_id']: item
+                for item in self.products().exclude(
+                    department_id__isnull=True
+                ).exclude(
+                    department_id=''
+                ).values('department_id').annotate(
+                    unique_products=Count('lm_code', distinct=True),
+                    unique_assemblers=_unique_assemblers('assembly__assembler'),
+                ).order_by()
+            }
+
+        # Рассчитываем проценты
+        previous = self.department_period_rows[1]
+        for item in stats:
+            counts = distinct_counts.get(item['department_id'], {})
+            item['unique_products'] = counts.get('unique_products', 0)
+            item['unique_assemblers'] = counts.get('unique_assemblers', 0)
+            self._department_rates(item)
+            if self.filters.previous_period:
+                before = self._department_rates(dict(previous[(item['department_id'],)]))
+                item['comparison'] = _comparison(item, before, COMPARED_DEPARTMENT)
+
+        return stats
+
+    @staticmethod
+    def _department_rates(item):
+        item['avg_missing'] = _ratio(item['total_missing'], item['product_count'])
+        item['collection_rate'] = _ratio(item['total_collected'], item['total_required'], 100)
+        item['avg_per_assembly'] = _ratio(item['product_count'], item['unique_assemblies'])
+        return item
+
+    def get_time_stats(self):
+        """
+        Статистика по времени. При сравнении дни сопоставляются с днями предыдущего периода
+        с тем же смещением от начала, часы - с теми же часами
+        """
+        period = self.filters.previous_period
+        if period is None:
+            return self._time_stats(self.hour_cells)
+
+        current = [cell for cell in self.hour_cells if cell['date'] >= self.filters.date_from]
+        stats = self._time_stats(current)
+        previous = self._time_stats([cell for cell in self.hour_cells if cell['date'] < self.filters.date_from])
+
+        shift = self.filters.date_from - period[0]
+        previous_days = {item['date'] + shift: item for item in previous['daily']}
+        for item in stats['daily']:
+            before = previous_days.get(item['date'], {'count': 0, 'total_products': 0, 'total_missing': 0})
+            item['comparison'] = _comparison(item, before, ('count', 'total_products', 'total_missing'))
+
+        previous_hours = {item['hour']: item for item in previous['hourly']}
+        for item in stats['hourly']:
+            before = previous_hours.get(item['hour'], {'count': 0, 'avg_products': 0, 'avg_missing': 0})
+            item['comparison'] = _comparison(item, before, ('count', 'avg_products', 'avg_missing'))
+
+        return stats
+
+    @staticmethod
+    def _time_stats(cells):
+        daily = {}
+        hourly = {}
+        for cell in cells:
+            # По дням
+            day = daily.setdefault(cell['date'], {
+                'date': cell['date'], 'count': 0, 'total_products': 0, 'total_missing': 0,
+            })
+            day['count'] += cell['count']
+            day['total_products'] += cell['products']
+            day['total_missing'] += cell['missing']
+
+            # По часам (среднее за период)
+            hour = hourly.setdefault(cell['hour'], {
+                'hour': cell['hour'], 'count': 0, 'products': 0, 'missing': 0,
+            })
+            hour['count'] += cell['count']
+            hour['products'] += cell['products']
+            hour['missing'] += cell['missing']
+
+        daily_stats = [daily[key] for key in sorted(daily)]
+        hourly_stats = [hourly[key] for key in sorted(hourly)]
+
+        for item in hourly_stats:
+            item['avg_products'] = _ratio(item.pop('products'), item['count'])
+            item['avg_missing'] = _ratio(item.pop('missing'), item['count'])
+
+        return {
+            'daily': daily_stats,
+            'hourly': hourly_stats,
+            'trend': [{'date': item['date'], 'count': item['count']} for item in daily_stats],
+        }
+
+    def get_critical_stats(self):
+        """Статистика по критическим товарам: разрезы берутся из общих итогов агрегатов товаров"""
+        compare = self.filters.previous_period is not None
+
+        # По отделам
+        departments, previous_departments = self.department_period_rows
+        by_department = sorted(
+            (
+                {
+                    'department_id': item['department_id'],
+                    'count': item['critical_count'],
+                    'total_missing': item['critical_missing'],
+                    'avg_missing': _ratio(item['critical_missing'], item['critical_count']),
+                }
+                for item in departments if item['critical_count']
+            ),
+            key=itemgetter('count'),
+            reverse=True
+        )
+        if compare:
+            for item in by_department:
+                before = previous_departments[(item['department_id'],)]
+                before = {
+                    'count': before['critical_count'],
+                    'total_missing': before['critical_missing'],
+                    'avg_missing': _ratio(before['critical_missing'], before['critical_count']),
+                }
+                item['comparison'] = _comparison(item, before, ('count', 'total_missing', 'avg_missing'))
+
+        # По сборщикам
+        assemblers, previous_assemblers = self._collect_periods(
+            self.product_rollup_sets['assembler'], ('assembler',), PRODUCT_ROLLUP_AGGREGATES
+        )
+        by_assembler = []
+        for item in sorted(assemblers, key=lambda item: (-item['critical'], item['assembler'])):
+            if not item['critical']:
+                continue
+            critical = {
+                'assembly__assembler': item['assembler'],
+                'count': item['critical'],
+                'total_missing': item['critical_missing'],
+            }
+            if compare:
+                before = previous_assemblers[(item['assembler'],)]
+                critical['comparison'] = _comparison(
+                    critical, {'count': before['critical'], 'total_missing': before['critical_missing']},
+                    ('count', 'total_missing')
+                )
+            by_assembler.append(critical)
+
+        # По товарам
+        by_product = [
+            {
+                'lm_code': row['lm_code'],
+                'title': row['title'],
+                'count': row['critical_count'],
+                'total_missing': row['critical_missing'],
+                'assemblies': row['critical_assemblies'],
+            }
+            for row in heapq.nlargest(
+                10,
+                (row for row in self.lm_code_rows if row['critical_count']),
+                key=itemgetter('critical_missing')
+            )
+        ]
+
+        # Временное распределение (у ячеек предыдущего периода итог текущего пустой)
+        by_time = heapq.nsmallest(
+            10,
+            (
+                {'date': cell['date'], 'hour': cell['hour'], 'count': cell['critical']}
+                for cell in self.product_rollup_sets['hour']
+                if cell['critical']
+            ),
+            key=lambda cell: (-cell['count'], cell['date'], cell['hour'])
+        )
+
+        stats = {
+            'by_department': by_department,
+            'by_assembler': by_assembler,
+            'by_product': by_product,
+            'by_time': by_time,
+            'total_critical': self.product_totals['critical'],
+            'total_non_critical': self.product_totals['non_critical'],
+        }
+        if compare:
+            previous = self.product_period_totals[1]
+            stats['comparison'] = _comparison(
+                stats, {'total_critical': previous['critical'], 'total_non_critical': previous['non_critical']},
+                ('total_critical', 'total_non_critical'),
+            )
+        return stats
+
+    # Значения для фильтров
+
+    @staticmethod
+    def unique_assemblers():
+        return AssemblyRollup.objects.exclude(
+            assembler=''
+        ).values('assembler').distinct().order_by('assembler')
+
+    @staticmethod
+    def unique_departments():
+        return ProductRollup.objects.exclude(
+            department_id=''
+        ).values('department_id').distinct().order_by('department_id')
+
@@ -0,0 +1,74 @@
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Ключ в файле экспорта -> раздел дашборда
+EXPORT_SECTIONS = {
+    'total_statistics': 'total_stats',
+    'assembler_statistics': 'assembler_stats',
+    'department_statistics': 'department_stats',
+    'product_statistics': 'product_stats',
+    'time_statistics': 'time_stats',
+    'critical_statistics': 'critical_stats',
+}
+
+# Столбцы исходных строк (товар в сборке)
+RAW_ROW_FIELDS = [
+    ('assembly__order_number', 'order_number'),
+    ('assembly__task_id', 'task_id'),
+    ('assembly__assembly_zone', 'assembly_zone'),
+    ('assembly__assembler', 'assembler'),
+    ('assembly__created_at', 'created_at'),
+    ('lm_code', 'lm_code'),
+    ('title', 'title'),
+    ('department_id', 'department_id'),
+    ('quantity', 'quantity'),
+    ('collected_quantity', 'collected_quantity'),
+    ('missing_quantity', 'missing_quantity'),
+    ('is_critical', 'is_critical'),
+]
+
+
+# Без отступов json использует C-кодировщик, default() вызывается только для дат и Decimal
+_encoder = DjangoJSONEncoder(ensure_ascii=False)
+_dumps = _encoder.encode
+
+
+def iter_statistics_json(period, sections):
+    """
+    JSON-документ экспорта по частям: каждый раздел кодируется и отдается отдельно,
+    поэтому весь документ одной строкой не собирается
+    """
+    yield '{"period": ' + _dumps(period)
+    for export_key, section in EXPORT_SECTIONS.items():
+        yield f', {_dumps(export_key)}: ' + _dumps(sections.get(section))
+    yield '}\n'
+
+
+def iter_raw_rows(statistics, chunk_size=2000):
+    """Исходные строки периода с учетом фильтров, читаются серверным курсором порциями"""
+    names = [name for _, name in RAW_ROW_FIELDS]
+    rows = statistics.products().order_by('assembly__created_at', 'id').values_list(
+        *(field for field, _ in RAW_ROW_FIELDS)
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(names, row))
+
+
+def iter_statistics_ndjson(period, sections, rows=None, batch_size=1000):
+    """
+    NDJSON: строка с периодом, по строке на раздел, затем (если переданы) исходные строки.
+    Строки разделов помечены ключом "section", исходные строки - "row"
+    """
+    yield _dumps({'section': 'period', 'data': period}) + '\n'
+    for export_key, section in EXPORT_SECTIONS.items():
+        yield _dumps({'section': export_key, 'data': sections.get(section)}) + '\n'
+
+    if rows is not None:
+        # Строки отдаются пачками: отдельный кусок ответа на каждую строку заметно медленнее
+        batch = []
+        for row in rows:
+            batch.append(_dumps({'row': row}))
+            if len(batch) >= batch_size:
+                yield '\n'.join(batch) + '\n'
+                batch = []
+        if batch:
+            yield '\n'.join(batch) + '\n'
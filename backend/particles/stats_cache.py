@@ -0,0 +1,195 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from loguru import logger
+
+# Версия данных статистики: входит в ключ каждого раздела, поэтому после ее смены
+# старые записи больше не читаются и просто истекают по TTL
+DATA_VERSION_KEY = 'particles:stats:data_version'
+
+
+def get_data_version():
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        cache.add(DATA_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(DATA_VERSION_KEY)
+    return version
+
+
+def bump_data_version():
+    """Делает недоступными все закешированные разделы статистики"""
+    cache.set(DATA_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def section_key(filters, section, version):
+    """Ключ раздела: нормализованные фильтры, раздел, версия данных и текущие местные сутки"""
+    payload = json.dumps(
+        {
+            'section': section,
+            'filters': filters.as_dict(),
+            'version': version,
+            # "Сегодня" в повторах и пустой период зависят от даты
+            'today': timezone.localdate().isoformat(),
+        },
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return f'particles:stats:{hashlib.sha256(payload.encode("utf-8")).hexdigest()}'
+
+
+def cache_etag(key):
+    """ETag ответа из ключа кеша: меняется вместе с фильтрами и версией данных"""
+    return f'"{key.rsplit(":", 1)[-1][:32]}"'
+
+
+class _KeyLock:
+    """
+    Сессионная advisory-блокировка PostgreSQL по ключу кеша.
+    Пока один обработчик считает раздел, остальные с тем же ключом ждут и затем читают готовый результат
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", [self.key])
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [self.key])
+
+
+def get_or_compute(key, compute, name=''):
+    """Значение из кеша или посчитанное заново под блокировкой ключа"""
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    with _KeyLock(key):
+        # Пока ждали блокировку, значение мог посчитать другой обработчик
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+        started = time.perf_counter()
+        result = compute()
+        cache.set(key, result, timeout=settings.STATISTICS_CACHE_TTL)
+        logger.debug(f"Статистика {name or key} посчитана за {time.perf_counter() - started:.2f} с")
+
+    return result
+
+
+def get_section(statistics, section, version=None):
+    """Раздел статистики из кеша или посчитанный заново"""
+    if version is None:
+        version = get_data_version()
+    key = section_key(statistics.filters, section, version)
+    return get_or_compute(key, lambda: statistics.compute(section), name=section)
+
+
+def _statement_timeout(seconds=None):
+    """statement_timeout текущего соединения (не меньше 1 мс: 0 снимает ограничение); None - значение по умолчанию"""
+    with connection.cursor() as cursor:
+        if seconds is None:
+            cursor.execute("RESET statement_timeout")
+        else:
+            cursor.execute("SET statement_timeout = %s", [max(int(seconds * 1000), 1)])
+
+
+def _timed_section(statistics, section, version, timeout):
+    """
+    Расчет раздела в потоке пула: у потока свое соединение с БД,
+    statement_timeout прерывает запросы раздела, который уже не дождутся
+    """
+    started = time.perf_counter()
+    try:
+        if timeout:
+            _statement_timeout(timeout)
+        return get_section(statistics, section, version), time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def get_sections(statistics, sections=None, parallel=False, timeout=None):
+    """
+    Все (или указанные) разделы с одной версией данных на запрос.
+    parallel=True - недостающие в кеше разделы считаются одновременно в пуле потоков (STATISTICS_WORKERS)
+    после общих агрегатов; разделы, не успевшие за общий срок timeout секунд, возвращаются как None.
+    Время расчета каждого раздела пишется в лог
+    """
+    version = get_data_version()
+    sections = sections or statistics.SECTIONS
+
+    if not parallel:
+        results = {}
+        for section in sections:
+            started = time.perf_counter()
+            results[section] = get_section(statistics, section, version)
+            logger.info(f"Раздел статистики {section}: {time.perf_counter() - started:.3f} с")
+        return results
+
+    if timeout is None:
+        timeout = settings.STATISTICS_SECTION_TIMEOUT
+    deadline = time.monotonic() + timeout
+
+    keys = {section: section_key(statistics.filters, section, version) for section in sections}
+    cached = cache.get_many(keys.values())
+    results = {section: cached[key] for section, key in keys.items() if key in cached}
+    missing = [section for section in sections if section not in results]
+    if not missing:
+        return results
+
+    # Общие агрегаты считаются один раз до запуска потоков, с тем же ограничением по времени
+    try:
+        _statement_timeout(timeout)
+        statistics.prepare(missing)
+    except DatabaseError as e:
+        logger.warning(f"Общие агрегаты статистики не посчитаны: {e}")
+    finally:
+        _statement_timeout()
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        logger.warning(f"Разделы статистики {', '.join(missing)} не посчитаны за {timeout} с")
+        return {section: results.get(section) for section in sections}
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(settings.STATISTICS_WORKERS, len(missing)),
+        thread_name_prefix='statistics'
+    )
+    try:
+        futures = {
+            executor.submit(_timed_section, statistics, section, version, remaining): section
+            for section in missing
+        }
+        # Один срок на все разделы: ожидание не складывается из таймаутов отдельных разделов
+        done, not_done = wait(futures, timeout=remaining)
+        for future in done:
+            section = futures[future]
+            try:
+                results[section], seconds = future.result()
+                logger.info(f"Раздел статистики {section}: {seconds:.3f} с")
+            except DatabaseError as e:
+                # В том числе отмена запроса по statement_timeout
+                results[section] = None
+                logger.warning(f"Раздел статистики {section} не посчитан: {e}")
+        for future in not_done:
+            results[futures[future]] = None
+            logger.warning(f"Раздел статистики {futures[future]} не посчитан за {timeout} с")
+    finally:
+        # Не ждем зависшие разделы: их запросы прервет statement_timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {section: results[section] for section in sections}
+
+
+def on_assemblies_changed(sender, **kwargs):
+    bump_data_version()
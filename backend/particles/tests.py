@@ -1,3 +1,1438 @@
-from django.test import TestCase
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.backends.utils import CursorWrapper
+from django.db.models import Count, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from .blacklist import BlacklistMatcher, get_blacklist_matcher, select_products, set_black_list
+from .charts import ChartData
+from .checks import check_local_time_columns
+from .chronic import refresh_chronic_shortages
+from .distinct_sketches import ALL_DEPARTMENTS, HyperLogLog, refresh_stale_distinct_sketches, union_cardinality
+from .forecasting import exponential_smoothing, forecast_next, rolling_mean
+from .export_jobs import _claim_next_job, enqueue_export, process_export_jobs
+from .exports import (
+    EXPORT_HEADERS,
+    filter_export_assemblies,
+    iter_csv,
+    iter_export_rows,
+    write_parquet,
+    write_xlsx,
+)
+from .heatmaps import Heatmaps
+from .heavy_hitters import SpaceSaving, refresh_stale_sketches, top_products, window_start
+from .matviews import REFRESHED_AT_KEY, refresh_materialized_views
+from .models import (
+    AssemblyRollup,
+    BlacklistRule,
+    ChronicShortage,
+    DistinctSketch,
+    ExportJob,
+    PartiallyPickedAssembly,
+    PartiallyPickedProduct,
+    ProductRollup,
+    TopProductsSketch,
+)
+from .olap import Aggregation
+from .rollups import MAX_REFRESH_SLOTS, rebuild_rollups, refresh_rollups
+from .signals import send_assemblies_changed
+from .statistics import DashboardFilters, DashboardStatistics
+from .statistics_export import EXPORT_SECTIONS, iter_statistics_ndjson
+from .stats_cache import get_data_version, get_or_compute, get_section, get_sections, section_key
+
+_numbers = itertools.count(1)
+
+# Кеш в памяти процесса: тесты не зависят друг от друга и от файлового кеша
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def local_datetime(day, hours=0, minutes=0):
+    """Местное время внутри дня day"""
+    return timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=hours, minutes=minutes)
+
+
+def create_assembly(assembler='Иванов', created_at=None, products=(), zone='Z1'):
+    """
+    Сборка с товарами [(lm_code, отдел, недостача), ...].
+    created_at проставляется отдельным UPDATE: при создании поле заполняется auto_now_add
+    """
+    number = next(_numbers)
+    assembly = PartiallyPickedAssembly.objects.create(
+        order_number=f'order-{number}',
+        task_id=f'task-{number}',
+        assembly_zone=zone,
+        assembler=assembler,
+    )
+    if created_at is not None:
+        PartiallyPickedAssembly.objects.filter(pk=assembly.pk).update(created_at=created_at)
+    for lm_code, department_id, missing in products:
+        PartiallyPickedProduct.objects.create(
+            assembly=assembly,
+            lm_code=lm_code,
+            department_id=department_id,
+            quantity=missing + 1,
+            collected_quantity=1,
+        )
+    return assembly
+
+
+class BulkBlacklistTests(TestCase):
+    """Массовое изменение черного списка"""
+
+    def setUp(self):
+        day = timezone.localdate() - timedelta(days=1)
+        self.old = create_assembly(
+            'Иванов', local_datetime(day - timedelta(days=5)), [('LM1', '1', 2), ('LM2', '2', 3)]
+        )
+        self.new = create_assembly('Петров', local_datetime(day), [('LM1', '1', 4), ('LM3', '1', 1)])
+        PartiallyPickedAssembly.recalculate_metrics([self.old.pk, self.new.pk])
+
+    def metrics(self, assembly):
+        assembly.refresh_from_db()
+        return assembly.products_count, assembly.total_missing_quantity
+
+    def test_update_and_recalculate(self):
+        self.assertEqual(self.metrics(self.new), (2, 5))
+
+        products = select_products(lm_codes=['LM1'], date_from=timezone.localdate() - timedelta(days=1))
+        # UPDATE ... RETURNING и пересчет метрик (плюс SAVEPOINT/RELEASE транзакции)
+        with self.assertNumQueries(4):
+            result = set_black_list(products, True)
+        self.assertEqual(result, {'products': 1, 'assemblies': 1})
+        self.assertEqual(self.metrics(self.new), (1, 1))
+        self.assertEqual(self.metrics(self.old), (2, 5))
+
+        # Повторная пометка ничего не меняет
+        self.assertEqual(set_black_list(select_products(lm_codes=['LM1']), True), {'products': 1, 'assemblies': 1})
+        self.assertEqual(set_black_list(select_products(lm_codes=['LM1']), True), {'products': 0, 'assemblies': 0})
+
+        result = set_black_list(select_products(department_id='1'), False)
+        self.assertEqual(result, {'products': 2, 'assemblies': 2})
+        self.assertEqual(self.metrics(self.old), (2, 5))
+        self.assertEqual(self.metrics(self.new), (2, 5))
+
+    def test_endpoint(self):
+        self.client.force_login(get_user_model().objects.create_user(username='admin', password='admin'))
+        url = '/particles/product/blacklist/bulk/'
+
+        response = self.client.post(
+            url, {'action': 'blacklist'}, content_type='application/json', HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        ids = list(self.old.products.values_list('pk', flat=True))
+        response = self.client.post(
+            url, {'action': 'blacklist', 'ids': ids}, content_type='application/json', HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stats'], {'products': 2, 'assemblies': 1})
+        self.assertEqual(self.metrics(self.old), (0, 0))
+
+
+class BlacklistRulesTests(TestCase):
+    """Правила черного списка при приеме данных"""
+
+    def matcher(self, *rules):
+        return BlacklistMatcher(rules)
+
+    def test_overlapping_title_rules(self):
+        # 'болт' и 'болтик' пересекаются: пропуск должен сработать, даже если первым найден 'болт'
+        matcher = self.matcher(
+            (BlacklistRule.FIELD_TITLE, 'Болт', BlacklistRule.ACTION_BLACKLIST),
+            (BlacklistRule.FIELD_TITLE, 'олтик', BlacklistRule.ACTION_SKIP),
+        )
+        self.assertEqual(matcher.match(title='Набор БОЛТИКОВ'), BlacklistRule.ACTION_SKIP)
+        self.assertEqual(matcher.match(title='Болт М6'), BlacklistRule.ACTION_BLACKLIST)
+        self.assertIsNone(matcher.match(title='Гайка'))
+
+    def test_title_casefold(self):
+        matcher = self.matcher((BlacklistRule.FIELD_TITLE, 'strasse', BlacklistRule.ACTION_BLACKLIST))
+        self.assertEqual(matcher.match(title='Große STRAßE'), BlacklistRule.ACTION_BLACKLIST)
+
+        matcher = self.matcher((BlacklistRule.FIELD_TITLE, 'ß', BlacklistRule.ACTION_SKIP))
+        self.assertEqual(matcher.match(title='GROSS'), BlacklistRule.ACTION_SKIP)
+
+    def test_skip_wins_over_blacklist(self):
+        matcher = self.matcher(
+            (BlacklistRule.FIELD_LM_CODE, 'LM1', BlacklistRule.ACTION_BLACKLIST),
+            (BlacklistRule.FIELD_DEPARTMENT, '5', BlacklistRule.ACTION_SKIP),
+        )
+        self.assertEqual(matcher.match(lm_code='LM1', department_id='5'), BlacklistRule.ACTION_SKIP)
+        self.assertEqual(matcher.match(lm_code='LM1', department_id='6'), BlacklistRule.ACTION_BLACKLIST)
+        self.assertFalse(self.matcher())
+
+    def test_matcher_recompiled_on_rule_change(self):
+        with self.assertNumQueries(2):
+            matcher = get_blacklist_matcher()
+        # Правила не менялись: только запрос версии
+        with self.assertNumQueries(1):
+            self.assertIs(get_blacklist_matcher(), matcher)
+
+        rule = BlacklistRule.objects.create(field=BlacklistRule.FIELD_LM_CODE, value='LM1')
+        self.assertEqual(get_blacklist_matcher().match(lm_code='LM1'), BlacklistRule.ACTION_BLACKLIST)
+
+        rule.is_active = False
+        rule.save()
+        self.assertIsNone(get_blacklist_matcher().match(lm_code='LM1'))
+
+    def test_ingest_applies_rules(self):
+        BlacklistRule.objects.create(field=BlacklistRule.FIELD_LM_CODE, value='LM1')
+        BlacklistRule.objects.create(
+            field=BlacklistRule.FIELD_TITLE, value='образец', action=BlacklistRule.ACTION_SKIP
+        )
+
+        response = self.client.post('/particles/partially_picked_assemblies/', {
+            'timestamp': timezone.now().isoformat(),
+            'assemblies_count': 1,
+            'assemblies': [{
+                'order': '100',
+                'taskId': 'task-100',
+                'assembler': 'Иванов',
+                'products': [
+                    {'lmCode': 'LM1', 'title': 'Болт', 'quantity': 3, 'collected_quantity': 1},
+                    {'lmCode': 'LM2', 'title': 'ОБРАЗЕЦ краски', 'quantity': 2, 'collected_quantity': 0},
+                    {'lmCode': 'LM3', 'title': 'Гайка', 'quantity': 2, 'collected_quantity': 1},
+                ],
+            }],
+        }, content_type='application/json', HTTP_HOST='localhost')
+
+        self.assertEqual(response.status_code, 201)
+        stats = response.json()['stats']['products']
+        self.assertEqual(
+            (stats['created'], stats['blacklisted_by_rules'], stats['skipped_by_rules']), (2, 1, 1)
+        )
+        self.assertEqual(
+            dict(PartiallyPickedProduct.objects.values_list('lm_code', 'black_list')),
+            {'LM1': True, 'LM3': False}
+        )
+
+
+class ExportTests(TestCase):
+    """Выгрузка сборок"""
+
+    def setUp(self):
+        created_at = local_datetime(timezone.localdate() - timedelta(days=1), hours=9)
+        create_assembly('Иванов', created_at, [('LM1', '1', 2), ('LM2', '2', 3)])
+        create_assembly('', created_at - timedelta(days=3))
+
+    def export_rows(self, **params):
+        return list(iter_export_rows(filter_export_assemblies(params), chunk_size=1))
+
+    def test_rows_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = self.export_rows()
+
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+        # Сборка без товаров (отправлена последней) - одна строка, сборщик не указан
+        self.assertEqual(rows[0][4:5] + rows[0][7:], ('Не указан', '-', '-', 'Нет товаров', 0, 'PARTIALLY_PICKED', 0))
+        self.assertEqual(rows[1][4:5] + rows[1][7:], ('Иванов', 'LM1', '1', 'Без названия', 2, 'PARTIALLY_PICKED', 2))
+        self.assertEqual(rows[2][7], 'LM2')
+
+        self.assertEqual(len(self.export_rows(assembler='Иванов')), 2)
+        self.assertEqual(len(self.export_rows(date_to=str(timezone.localdate() - timedelta(days=2)))), 1)
+
+    def test_xlsx(self):
+        rows = self.export_rows()
+        # Длинное название в последней порции тоже учитывается в ширине колонки
+        rows[-1] = rows[-1][:9] + ('Очень длинное название товара',) + rows[-1][10:]
+
+        export_file = io.BytesIO()
+        write_xlsx(rows, export_file, chunk_size=1)
+
+        worksheet = load_workbook(export_file).active
+        values = list(worksheet.values)
+        self.assertEqual(list(values[0]), EXPORT_HEADERS)
+        self.assertEqual(len(values), 4)
+        self.assertEqual([row[7] for row in values[1:]], ['-', 'LM1', 'LM2'])
+        self.assertEqual(worksheet.column_dimensions['J'].width, len('Очень длинное название товара') + 2)
+
+    def test_csv(self):
+        content = ''.join(iter_csv(self.export_rows()))
+
+        self.assertTrue(content.startswith('\ufeff'))
+        values = list(csv.reader(io.StringIO(content[1:])))
+        self.assertEqual(values[0], EXPORT_HEADERS)
+        self.assertEqual([row[7] for row in values[1:]], ['-', 'LM1', 'LM2'])
+        self.assertEqual(values[2][10], '2')
+
+    def test_parquet(self):
+        export_file = io.BytesIO()
+        write_parquet(self.export_rows(), export_file, batch_size=2)
+
+        export_file.seek(0)
+        parquet = pq.ParquetFile(export_file)
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEqual(table.column_names, EXPORT_HEADERS)
+        self.assertEqual(table.column('LM код').to_pylist(), ['-', 'LM1', 'LM2'])
+        self.assertEqual(table.column('Не хватает').to_pylist(), [0, 2, 3])
+        self.assertTrue(pa.types.is_dictionary(table.schema.field('Сборщик').type))
+
+
+class ExportJobTests(TestCase):
+    """Синхронный экспорт и очередь фоновых задач экспорта"""
+
+    def setUp(self):
+        create_assembly('Иванов', products=[('LM1', '1', 2)])
+        self.client.force_login(get_user_model().objects.create_user(username='admin', password='admin'))
+
+    def get(self, url, **params):
+        return self.client.get(url, params, HTTP_HOST='localhost')
+
+    def test_small_export_streams(self):
+        response = self.get('/particles/export/', format='csv', assembler='Иванов')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'direct')
+        self.assertFalse(ExportJob.objects.exists())
+
+        response = self.client.get(response.json()['download_url'], HTTP_HOST='localhost')
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(content.splitlines()), 2)
+
+    @override_settings(EXPORT_SYNC_MAX_ASSEMBLIES=0)
+    def test_large_export_is_queued_once(self):
+        first = self.get('/particles/export/', format='csv', assembler='Иванов')
+        self.assertEqual(first.status_code, 202)
+        self.assertFalse(first.json()['shared'])
+
+        # Тот же запрос с пустыми параметрами и в другом порядке - та же задача
+        second = self.get('/particles/export/', assembler='Иванов', order_number='', format='csv')
+        self.assertEqual(second.json()['job_id'], first.json()['job_id'])
+        self.assertTrue(second.json()['shared'])
+        self.assertEqual(ExportJob.objects.get().requests_count, 2)
+
+        self.assertEqual(self.get('/particles/export/download/', format='csv').status_code, 400)
+
+    def test_one_active_job_per_key(self):
+        job, _ = enqueue_export({'assembler': 'Иванов'}, 'csv')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExportJob.objects.create(key=job.key, export_format='csv', params=job.params)
+
+        # Завершенная задача не мешает поставить новую
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.STATUS_FAILED)
+        self.assertTrue(enqueue_export({'assembler': 'Иванов'}, 'csv')[1])
+
+    def test_run_and_fail(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(EXPORT_CACHE_DIR=directory):
+            job, _ = enqueue_export({'assembler': 'Иванов'}, 'parquet')
+            broken, _ = enqueue_export({'date_from': 'вчера'}, 'csv')
+
+            self.assertEqual(process_export_jobs(), 2)
+
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.rows_count), (ExportJob.STATUS_DONE, 1))
+            self.assertTrue(os.path.exists(job.file_path))
+
+            broken.refresh_from_db()
+            self.assertEqual(broken.status, ExportJob.STATUS_FAILED)
+            self.assertTrue(broken.error)
+            self.assertEqual(os.listdir(directory), [os.path.basename(job.file_path)])
+
+
+class ExportJobClaimTests(TransactionTestCase):
+    """Выбор задачи из очереди несколькими обработчиками"""
+    available_apps = ['particles']
+
+    def test_skip_locked(self):
+        first = ExportJob.objects.create(key='first', export_format='csv', params={})
+        second = ExportJob.objects.create(key='second', export_format='csv', params={})
+
+        claimed = []
+
+        def claim():
+            try:
+                claimed.append(_claim_next_job())
+            finally:
+                connections.close_all()
+
+        with transaction.atomic():
+            # Первую задачу держит другой обработчик: вторая должна достаться без ожидания
+            ExportJob.objects.select_for_update().get(pk=first.pk)
+            worker = threading.Thread(target=claim)
+            worker.start()
+            worker.join(timeout=10)
+
+        self.assertEqual(claimed[0].pk, second.pk)
+        self.assertEqual(claimed[0].status, ExportJob.STATUS_RUNNING)
+        self.assertEqual(_claim_next_job().pk, first.pk)
+        self.assertIsNone(_claim_next_job())
+
+
+class RollupTests(TestCase):
+    """Поддержка агрегатов при приеме данных и изменении черного списка"""
+
+    def ingest(self, *assemblies):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/particles/partially_picked_assemblies/', {
+                'timestamp': timezone.now().isoformat(),
+                'assemblies_count': len(assemblies),
+                'assemblies': [
+                    {
+                        'order': order,
+                        'taskId': f'task-{order}',
+                        'assembler': assembler,
+                        'assembly_zone': 'Z1',
+                        'products': [
+                            {'lmCode': lm_code, 'departmentId': department, 'quantity': missing + 1,
+                             'collected_quantity': 1}
+                            for lm_code, department, missing in products
+                        ],
+                    }
+                    for order, assembler, products in assemblies
+                ],
+            }, content_type='application/json', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 201)
+
+    def assertRollupsMatchRaw(self):
+        rollups = {
+            assembler: (assemblies, products, missing)
+            for assembler, assemblies, products, missing in AssemblyRollup.objects.values('assembler').annotate(
+                assemblies=Sum('assemblies_count'), products=Sum('products_count'), missing=Sum('missing_quantity'),
+            ).values_list('assembler', 'assemblies', 'products', 'missing')
+        }
+        raw = {
+            assembler: (assemblies, products, missing)
+            for assembler, assemblies, products, missing in PartiallyPickedAssembly.objects.filter(
+                black_list=False
+            ).values('assembler').annotate(
+                assemblies=Count('id'), products=Sum('products_count'), missing=Sum('total_missing_quantity'),
+            ).values_list('assembler', 'assemblies', 'products', 'missing')
+        }
+        self.assertEqual(rollups, raw)
+
+        rollups = set(ProductRollup.objects.values('assembler', 'department_id').annotate(
+            products=Sum('products_count'), missing=Sum('missing_quantity'), assemblies=Sum('assemblies_count'),
+        ).values_list('assembler', 'department_id', 'products', 'missing', 'assemblies'))
+        raw = set(PartiallyPickedProduct.objects.filter(
+            black_list=False, assembly__black_list=False
+        ).values('assembly__assembler', 'department_id').annotate(
+            products=Count('id'), missing=Sum('missing_quantity'), assemblies=Count('assembly', distinct=True),
+        ).values_list('assembly__assembler', 'department_id', 'products', 'missing', 'assemblies'))
+        self.assertEqual(rollups, raw)
+
+    def test_ingest_updates_rollups(self):
+        self.ingest(
+            ('1', 'Иванов', [('LM1', '1', 2), ('LM2', '2', 3)]),
+            ('2', 'Петров', [('LM1', '1', 1)]),
+        )
+        self.assertRollupsMatchRaw()
+        self.assertEqual(ProductRollup.objects.aggregate(total=Sum('missing_quantity'))['total'], 6)
+
+        # Повторный прием: сборка перешла к другому сборщику, добавлен товар
+        self.ingest(('2', 'Иванов', [('LM1', '1', 1), ('LM3', '3', 4)]))
+        self.assertRollupsMatchRaw()
+        self.assertFalse(AssemblyRollup.objects.filter(assembler='Петров').exists())
+
+    def test_blacklist_updates_rollups(self):
+        self.ingest(
+            ('1', 'Иванов', [('LM1', '1', 2), ('LM2', '2', 3)]),
+            ('2', 'Петров', [('LM1', '1', 1)]),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM1']), True)
+        self.assertRollupsMatchRaw()
+        self.assertEqual(ProductRollup.objects.aggregate(total=Sum('missing_quantity'))['total'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM1']), False)
+        self.assertRollupsMatchRaw()
+
+    def test_many_hours_refresh_whole_days(self):
+        day = timezone.localdate() - timedelta(days=2)
+        for hour in range(3):
+            create_assembly('Иванов', local_datetime(day, hours=hour), [('LM1', '1', hour + 1)])
+        # Лишний агрегат за этот день (например, от удаленных данных) должен исчезнуть
+        AssemblyRollup.objects.create(
+            date=day, hour=23, assemblies_count=1, first_created_at=timezone.now(), last_created_at=timezone.now()
+        )
+
+        refresh_rollups([(day, hour) for hour in range(MAX_REFRESH_SLOTS + 1)])
+        self.assertRollupsMatchRaw()
+
+
+class DistinctSketchTests(TestCase):
+    """Дневные скетчи уникальных значений при приеме данных и изменении черного списка"""
+
+    ingest = RollupTests.ingest
+
+    def cardinalities(self):
+        sketch = DistinctSketch.objects.get(date=timezone.localdate(), department_id=ALL_DEPARTMENTS)
+        return sketch.stale, union_cardinality([sketch.products]), union_cardinality([sketch.assemblers])
+
+    def test_new_assemblies_added_incrementally(self):
+        with mock.patch('particles.distinct_sketches._refresh_range') as refresh:
+            self.ingest(('1', 'Иванов', [('LM1', '1', 2), ('LM2', '2', 3)]))
+            self.ingest(('2', 'Петров', [('LM1', '1', 1)]), ('3', '', [('LM3', '1', 1)]))
+        refresh.assert_not_called()
+
+        # Пустой сборщик не считается отдельным сборщиком
+        self.assertEqual(self.cardinalities(), (False, 3, 2))
+        self.assertEqual(DistinctSketch.objects.filter(department_id='1').count(), 1)
+        self.assertEqual(refresh_stale_distinct_sketches(), 0)
+
+    def test_changes_mark_days(self):
+        self.ingest(('1', 'Иванов', [('LM1', '1', 2), ('LM2', '2', 3)]), ('2', 'Петров', [('LM1', '1', 1)]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM1']), True)
+        self.assertEqual(self.cardinalities(), (True, 2, 2))
+
+        self.assertEqual(refresh_stale_distinct_sketches(), 1)
+        self.assertEqual(self.cardinalities(), (False, 1, 1))
+
+        # Повторный прием сборки: день пересчитывается, а не дополняется
+        self.ingest(('1', 'Сидоров', [('LM2', '2', 3)]))
+        self.assertTrue(self.cardinalities()[0])
+        refresh_stale_distinct_sketches()
+        self.assertEqual(self.cardinalities(), (False, 1, 1))
+
+
+    @override_settings(STATISTICS_SKETCH_MIN_DAYS=31)
+    def test_open_period_resolved_from_data(self):
+        # Скетчей нет: оценка по ним дала бы нули
+        create_assembly('Иванов', products=[('LM1', '1', 1), ('LM2', '1', 1)])
+        create_assembly('Петров', timezone.now() - timedelta(days=3), [('LM1', '1', 1)])
+
+        statistics = DashboardStatistics(DashboardFilters())
+        self.assertFalse(statistics.use_sketches)
+        self.assertEqual(statistics.distinct_totals, {'unique_products': 2, 'unique_assemblers': 2})
+
+        statistics = DashboardStatistics(DashboardFilters(date_from=timezone.localdate() - timedelta(days=3)))
+        self.assertFalse(statistics.use_sketches)
+
+        create_assembly('Сидоров', timezone.now() - timedelta(days=40), [('LM3', '1', 1)])
+        self.assertTrue(DashboardStatistics(DashboardFilters()).use_sketches)
+        self.assertFalse(DashboardStatistics(DashboardFilters(exact=True)).use_sketches)
+
+
+class LocalTimeColumnsTests(TestCase):
+    """Генерируемые местные дата и час сборки"""
+
+    def test_columns_match_local_time(self):
+        day = timezone.localdate() - timedelta(days=1)
+        # 00:30 и 23:30 по местному времени - другие даты и часы в UTC
+        for hours, minutes in ((0, 30), (23, 30)):
+            assembly = create_assembly(created_at=local_datetime(day, hours, minutes))
+            assembly.refresh_from_db()
+            local = timezone.localtime(assembly.created_at)
+            self.assertEqual((assembly.created_date, assembly.created_hour), (local.date(), local.hour))
+            self.assertEqual((local.date(), local.hour), (day, hours))
+
+    def test_time_zone_check(self):
+        self.assertEqual(check_local_time_columns(databases=['default']), [])
+        with override_settings(TIME_ZONE='Europe/Moscow'):
+            errors = check_local_time_columns(databases=['default'])
+        self.assertEqual([error.id for error in errors], ['particles.E001'] * 2)
+
+
+class ParticlesTableTests(TestCase):
+    """Таблица сборок"""
+
+    def test_filters_by_local_date(self):
+        self.client.force_login(get_user_model().objects.create_user(username='admin', password='admin'))
+        today = create_assembly('Иванов', products=[('LM1', '1', 1)])
+        yesterday = create_assembly('Петров', timezone.now() - timedelta(days=1), [('LM2', '1', 1)])
+        create_assembly('Сидоров', products=[('LM3', '1', 1)], zone='WH')
+
+        response = self.client.get('/particles/', HTTP_HOST='localhost')
+        self.assertEqual([row['assembly'].pk for row in response.context['table_data']], [today.pk, yesterday.pk])
+
+        response = self.client.get('/particles/', {'date_from': timezone.localdate().isoformat()}, HTTP_HOST='localhost')
+        self.assertEqual([row['assembly'].pk for row in response.context['table_data']], [today.pk])
+
+
+class DashboardQueriesTests(TestCase):
+    """Общие агрегаты разделов дашборда"""
+
+    def create_data(self, assemblies):
+        day = timezone.localdate() - timedelta(days=1)
+        for number in range(assemblies):
+            create_assembly(
+                f'Сборщик {number % 7}', local_datetime(day, hours=number % 24),
+                [(f'LM{number % 11}', str(number % 5), number % 9)],
+            )
+        rebuild_rollups()
+
+    def rollup_queries(self, statistics, sections):
+        with CaptureQueriesContext(connection) as queries:
+            for section in sections:
+                statistics.compute(section)
+        return len(queries), sum('particles_productrollup' in query['sql'] for query in queries)
+
+    def test_sections_share_one_rollup_scan(self):
+        sections = ('total_stats', 'department_stats', 'critical_stats')
+
+        self.create_data(10)
+        few, rollup_scans = self.rollup_queries(DashboardStatistics(DashboardFilters(exact=True)), sections)
+        # Итоги, отделы, критические по отделам, сборщикам и часам - один проход по агрегатам товаров
+        self.assertEqual(rollup_scans, 1)
+
+        self.create_data(60)
+        many, _ = self.rollup_queries(DashboardStatistics(DashboardFilters(exact=True)), sections)
+        self.assertEqual(few, many)
+
+        with CaptureQueriesContext(connection) as queries:
+            DashboardStatistics(DashboardFilters(exact=True)).compute_all()
+        self.assertLessEqual(len(queries), 9)
+
+    def test_shared_aggregates_cached_by_version(self):
+        self.create_data(10)
+        version = time.time_ns()
+
+        _, rollup_scans = self.rollup_queries(
+            DashboardStatistics(DashboardFilters(), version), ('total_stats',)
+        )
+        self.assertEqual(rollup_scans, 1)
+
+        # Другой запрос (раздел) с той же версией данных берет итоги из кеша
+        _, rollup_scans = self.rollup_queries(
+            DashboardStatistics(DashboardFilters(), version), ('department_stats', 'critical_stats')
+        )
+        self.assertEqual(rollup_scans, 0)
+
+    def test_shared_aggregates_serializable(self):
+        # Кешируемые агрегаты читают не только разделы, но и панели отладки (JSON)
+        self.create_data(5)
+        sets = DashboardStatistics(DashboardFilters()).product_rollup_sets
+        self.assertEqual(json.loads(json.dumps(sets, cls=DjangoJSONEncoder)).keys(), sets.keys())
+
+    def test_critical_breakdowns_match_raw_data(self):
+        self.create_data(30)
+        stats = DashboardStatistics(DashboardFilters(exact=True)).get_critical_stats()
+        critical = DashboardStatistics(DashboardFilters()).products().filter(is_critical=True)
+
+        self.assertEqual(stats['total_critical'], critical.count())
+        self.assertEqual(
+            {item['assembly__assembler']: (item['count'], item['total_missing']) for item in stats['by_assembler']},
+            {
+                row['assembly__assembler']: (row['count'], row['missing'])
+                for row in critical.values('assembly__assembler').annotate(
+                    count=Count('id'), missing=Sum('missing_quantity')
+                )
+            }
+        )
+        self.assertEqual(
+            sum(item['count'] for item in stats['by_department']), stats['total_critical']
+        )
+        self.assertEqual(stats['by_time'][0]['count'], max(item['count'] for item in stats['by_time']))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StatsCacheTests(TestCase):
+    """Кеш разделов статистики по версии данных"""
+
+    def setUp(self):
+        cache.clear()
+        create_assembly('Иванов', local_datetime(timezone.localdate() - timedelta(days=1), hours=10), [
+            ('LM1', '1', 2), ('LM2', '1', 3),
+        ])
+        rebuild_rollups()
+
+    def total_stats(self):
+        with CaptureQueriesContext(connection) as queries:
+            stats = get_section(DashboardStatistics(DashboardFilters()), 'total_stats')
+        return stats, len(queries)
+
+    def test_cached_until_data_changes(self):
+        stats, queries = self.total_stats()
+        self.assertGreater(queries, 0)
+        self.assertEqual(stats['total_products'], 2)
+
+        # Та же версия данных: раздел из кеша без запросов к БД
+        self.assertEqual(self.total_stats(), (stats, 0))
+
+        version = get_data_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM1']), True)
+        self.assertNotEqual(get_data_version(), version)
+
+        stats, queries = self.total_stats()
+        self.assertGreater(queries, 0)
+        self.assertEqual(stats['total_products'], 1)
+
+    def test_key_depends_on_filters_and_version(self):
+        filters = DashboardFilters(date_from='2026-01-01')
+        key = section_key(filters, 'total_stats', 1)
+        self.assertEqual(key, section_key(DashboardFilters(date_from='2026-01-01'), 'total_stats', 1))
+        self.assertNotEqual(key, section_key(filters, 'total_stats', 2))
+        self.assertNotEqual(key, section_key(filters, 'product_stats', 1))
+        self.assertNotEqual(key, section_key(DashboardFilters(date_from='2026-01-02'), 'total_stats', 1))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeyLockTests(TransactionTestCase):
+    """Один расчет раздела при одновременных запросах"""
+    available_apps = ['particles']
+
+    def test_computed_once(self):
+        cache.clear()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(threading.get_ident())
+            # Пока первый поток считает, второй успевает дойти до блокировки
+            time.sleep(0.3)
+            return {'value': len(calls)}
+
+        def request():
+            try:
+                results.append(get_or_compute('particles:stats:test-lock', compute))
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=request) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=10)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChartDataTests(TestCase):
+    """Данные графиков по интервалам"""
+
+    def setUp(self):
+        cache.clear()
+        # Понедельник 2026-06-01, среда той же недели, понедельник через неделю и 2026-08-03
+        for day, count in ((date(2026, 6, 1), 2), (date(2026, 6, 3), 1), (date(2026, 6, 8), 3), (date(2026, 8, 3), 1)):
+            for _ in range(count):
+                create_assembly('Иванов', local_datetime(day, hours=10), [('LM1', '1', 1)])
+        rebuild_rollups()
+
+    def daily_assemblies(self, bucket, date_from='2026-06-01', date_to='2026-08-09'):
+        return ChartData(DashboardFilters(date_from=date_from, date_to=date_to), bucket).get_daily_assemblies()
+
+    def test_week_buckets(self):
+        chart = self.daily_assemblies('week')
+        self.assertEqual(chart['bucket'], 'week')
+        self.assertEqual(len(chart['labels']), 10)
+        self.assertEqual(chart['labels'][:2], ['01.06', '08.06'])
+        # Пустые недели заполняются нулями
+        self.assertEqual(chart['datasets'][0]['data'], [3, 3, 0, 0, 0, 0, 0, 0, 0, 1])
+
+    def test_month_buckets(self):
+        chart = self.daily_assemblies('month', date_from='2026-05-15')
+        self.assertEqual(chart['labels'], ['05.2026', '06.2026', '07.2026', '08.2026'])
+        self.assertEqual(chart['datasets'][0]['data'], [0, 6, 0, 1])
+
+    def test_auto_bucket(self):
+        self.assertEqual(self.daily_assemblies(None)['bucket'], 'day')
+        self.assertEqual(self.daily_assemblies(None, date_from='2025-06-01')['bucket'], 'week')
+        self.assertEqual(self.daily_assemblies(None, date_from='2020-01-01')['bucket'], 'month')
+
+    def test_api_key_uses_resolved_bucket(self):
+        self.client.force_login(get_user_model().objects.create_user(username='admin', password='admin'))
+        params = {'chart_type': 'daily_assemblies', 'date_from': '2026-06-01', 'date_to': '2026-06-14'}
+
+        etags = set()
+        for bucket in ('', 'day', 'hour', 'неизвестный'):
+            response = self.client.get('/particles/statistics/api/', {**params, 'bucket': bucket}, HTTP_HOST='localhost')
+            self.assertEqual(response.json()['bucket'], 'day')
+            etags.add(response['ETag'])
+        self.assertEqual(len(etags), 1)
+
+        response = self.client.get('/particles/statistics/api/', {**params, 'bucket': 'week'}, HTTP_HOST='localhost')
+        self.assertNotIn(response['ETag'], etags)
+
+    def test_api_etag(self):
+        self.client.force_login(get_user_model().objects.create_user(username='admin', password='admin'))
+        params = {'chart_type': 'daily_assemblies', 'bucket': 'week', 'date_from': '2026-06-01', 'date_to': '2026-06-14'}
+
+        response = self.client.get('/particles/statistics/api/', params, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['datasets'][0]['data'], [3, 3])
+        etag = response['ETag']
+
+        # Данные не менялись: 304 без расчета (запросы только сессии и пользователя)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/particles/statistics/api/', params, HTTP_HOST='localhost', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if 'particles_' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM1'], date_from=date(2026, 6, 8)), True)
+        response = self.client.get('/particles/statistics/api/', params, HTTP_HOST='localhost', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        params['chart_type'] = 'unknown'
+        self.assertEqual(self.client.get('/particles/statistics/api/', params, HTTP_HOST='localhost').status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DashboardSectionsTests(TestCase):
+    """Ленивая загрузка разделов дашборда"""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(get_user_model().objects.create_user(username='admin', password='admin'))
+        day = timezone.localdate() - timedelta(days=1)
+        create_assembly('Иванов', local_datetime(day, hours=10), [('LM1', '1', 2), ('LM2', '2', 1)])
+        create_assembly('Петров', local_datetime(day, hours=11), [('LM1', '1', 1)])
+        rebuild_rollups()
+
+    def get(self, url, params=None, **headers):
+        return self.client.get(url, params or {}, HTTP_HOST='localhost', **headers)
+
+    def test_page_does_not_compute_sections(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('/particles/statistics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'particles_partiallypickedproduct' in query['sql']])
+        for section in DashboardStatistics.SECTIONS:
+            self.assertContains(response, f'/particles/statistics/sections/{section}/')
+
+    def test_sections(self):
+        for section in DashboardStatistics.SECTIONS:
+            with self.subTest(section=section):
+                response = self.get(f'/particles/statistics/sections/{section}/', {'format': 'json'})
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(section, response.json())
+
+                response = self.get(f'/particles/statistics/sections/{section}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+        total = self.get('/particles/statistics/sections/total_stats/', {'format': 'json'}).json()['total_stats']
+        self.assertEqual((total['total_assemblies'], total['total_products']), (2, 3))
+        self.assertEqual(self.get('/particles/statistics/sections/unknown/').status_code, 404)
+
+    def test_section_etag(self):
+        url = '/particles/statistics/sections/department_stats/'
+        response = self.get(url)
+        etag = response['ETag']
+
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # HTML и JSON одного раздела, а также разные фильтры - разные ETag
+        self.assertNotEqual(self.get(url, {'format': 'json'})['ETag'], etag)
+        self.assertNotEqual(self.get(url, {'department_id': '1'})['ETag'], etag)
+
+        json_etag = self.get(url, {'format': 'json'})['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM2']), True)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=json_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['department_id'] for item in response.json()['department_stats']], ['1'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, STATISTICS_WORKERS=4)
+class ParallelSectionsTests(TransactionTestCase):
+    """Параллельный расчет разделов"""
+    available_apps = ['particles']
+
+    def setUp(self):
+        cache.clear()
+        day = timezone.localdate() - timedelta(days=1)
+        for number in range(6):
+            create_assembly(f'Сборщик {number % 2}', local_datetime(day, hours=number), [(f'LM{number % 3}', '1', 1)])
+        rebuild_rollups()
+
+    def statistics_queries(self, parallel):
+        """Запросы к таблицам статистики из всех соединений (потоки пула открывают свои)"""
+        queries = []
+        execute = CursorWrapper.execute
+
+        def record(cursor, sql, params=None):
+            if 'particles_' in sql:
+                queries.append(sql)
+            return execute(cursor, sql, params)
+
+        cache.clear()
+        with mock.patch.object(CursorWrapper, 'execute', record):
+            results = get_sections(DashboardStatistics(DashboardFilters(exact=True)), parallel=parallel)
+        return results, queries
+
+    def test_shared_aggregates_computed_once(self):
+        sequential, sequential_queries = self.statistics_queries(parallel=False)
+        parallel, parallel_queries = self.statistics_queries(parallel=True)
+
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(len(parallel_queries), len(sequential_queries))
+        self.assertEqual(
+            sum('GROUPING SETS' in sql and 'particles_productrollup' in sql for sql in parallel_queries), 1
+        )
+
+        # Все разделы в кеше: ни одного запроса
+        with mock.patch.object(DashboardStatistics, 'prepare') as prepare:
+            self.assertEqual(get_sections(DashboardStatistics(DashboardFilters(exact=True)), parallel=True), parallel)
+        prepare.assert_not_called()
+
+    def test_one_deadline_for_all_sections(self):
+        release = threading.Event()
+
+        def slow(statistics):
+            release.wait(5)
+            return []
+
+        try:
+            with mock.patch.object(DashboardStatistics, 'get_time_stats', slow), \
+                    mock.patch.object(DashboardStatistics, 'get_assembler_stats', slow):
+                started = time.monotonic()
+                results = get_sections(DashboardStatistics(DashboardFilters()), parallel=True, timeout=0.5)
+                elapsed = time.monotonic() - started
+        finally:
+            release.set()
+
+        # Два зависших раздела не удваивают ожидание
+        self.assertLess(elapsed, 1)
+        self.assertIsNone(results['time_stats'])
+        self.assertIsNone(results['assembler_stats'])
+        self.assertIsNotNone(results['total_stats'])
+        self.assertEqual(list(results), list(DashboardStatistics.SECTIONS))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StatisticsExportTests(TestCase):
+    """Потоковый экспорт статистики"""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(get_user_model().objects.create_user(username='admin', password='admin'))
+        self.day = timezone.localdate() - timedelta(days=1)
+        create_assembly('Иванов', local_datetime(self.day, hours=10), [('LM1', '1', 2), ('LM2', '2', 1)])
+        create_assembly('Петров', local_datetime(self.day, hours=11), [('LM1', '1', 1)])
+        create_assembly('Петров', local_datetime(self.day - timedelta(days=3)), [('LM3', '1', 1)])
+        rebuild_rollups()
+
+        self.params = {'date_from': self.day.isoformat(), 'date_to': self.day.isoformat()}
+        # Разделы уже в кеше дашборда: экспорт берет их оттуда, не запуская потоки
+        self.sections = get_sections(DashboardStatistics(DashboardFilters(**self.params)))
+
+    def export(self, **params):
+        response = self.client.get('/particles/statistics/export/', {**self.params, **params}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_json(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/json; charset=utf-8')
+        document = json.loads(content)
+
+        self.assertEqual(document['period']['filters']['date_from'], self.day.isoformat())
+        self.assertEqual(set(document) - {'period'}, set(EXPORT_SECTIONS))
+        self.assertEqual(document['total_statistics']['total_products'], 3)
+        self.assertEqual(
+            document['department_statistics'],
+            json.loads(json.dumps(self.sections['department_stats'], cls=DjangoJSONEncoder))
+        )
+
+    def test_ndjson_with_rows(self):
+        response, content = self.export(rows='1')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = [json.loads(line) for line in content.splitlines()]
+
+        self.assertEqual(
+            [line['section'] for line in lines[:1 + len(EXPORT_SECTIONS)]], ['period', *EXPORT_SECTIONS]
+        )
+        rows = [line['row'] for line in lines[1 + len(EXPORT_SECTIONS):]]
+        # Только строки периода, по времени сборки
+        self.assertEqual([(row['assembler'], row['lm_code']) for row in rows], [
+            ('Иванов', 'LM1'), ('Иванов', 'LM2'), ('Петров', 'LM1'),
+        ])
+        self.assertEqual(rows[0]['missing_quantity'], 2)
+
+    def test_rows_streamed_in_batches(self):
+        rows = ({'row': number} for number in range(2500))
+        chunks = list(iter_statistics_ndjson({}, {}, rows, batch_size=1000))
+        # Период, разделы и три пачки строк
+        self.assertEqual(len(chunks), 1 + len(EXPORT_SECTIONS) + 3)
+        self.assertEqual(sum(chunk.count('\n') for chunk in chunks), 1 + len(EXPORT_SECTIONS) + 2500)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MaterializedViewTests(TestCase):
+    """Статистика из представления товаров совпадает с расчетом по исходным данным"""
+    maxDiff = None
+
+    def setUp(self):
+        cache.clear()
+        self.day = timezone.localdate() - timedelta(days=1)
+        for number in range(8):
+            create_assembly(
+                # Пустой сборщик не учитывается ни в одной из веток
+                ('Иванов', 'Петров', '')[number % 3], local_datetime(self.day - timedelta(days=number % 2), hours=number),
+                [(f'LM{number % 3}', str(number % 2), number % 4), ('LM9', '1', 1)],
+            )
+        rebuild_rollups()
+        refresh_materialized_views()
+
+    def sections(self, use_matview=None):
+        statistics = DashboardStatistics(DashboardFilters(
+            date_from=(self.day - timedelta(days=1)).isoformat(), date_to=self.day.isoformat(), exact=True
+        ))
+        if use_matview is not None:
+            statistics.use_matview = use_matview
+        return statistics.use_matview, {
+            section: statistics.compute(section) for section in ('product_stats', 'department_stats', 'critical_stats')
+        }
+
+    def assertMatchesRaw(self, use_matview):
+        used, sections = self.sections()
+        self.assertEqual(used, use_matview)
+        self.assertEqual(sections, self.sections(use_matview=False)[1])
+
+    def test_matches_raw_data(self):
+        self.assertMatchesRaw(True)
+        _, sections = self.sections()
+        self.assertEqual(
+            {item['department_id']: item['unique_assemblers'] for item in sections['department_stats']},
+            {'0': 2, '1': 2}
+        )
+
+    def test_blacklist_invalidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM9']), True)
+        # До обновления представления - исходные данные, уже без игнорируемого товара
+        self.assertMatchesRaw(False)
+
+        refresh_materialized_views()
+        self.assertMatchesRaw(True)
+
+    def test_period_closed_after_refresh(self):
+        # Представление обновлено до конца периода: часть дня в нем может отсутствовать
+        cache.set(REFRESHED_AT_KEY, local_datetime(self.day, hours=12), timeout=None)
+        self.assertFalse(self.sections()[0])
+
+
+class AssemblerStatsTests(TestCase):
+    """Статистика по сборщикам"""
+
+    def create_assemblies(self, assembler, times):
+        for created_at in times:
+            create_assembly(assembler, created_at)
+
+    def assembler_stats_queries(self):
+        rebuild_rollups()
+        with CaptureQueriesContext(connection) as queries:
+            stats = DashboardStatistics(DashboardFilters()).get_assembler_stats()
+        return stats, len(queries)
+
+    def test_query_count_does_not_depend_on_assemblers(self):
+        start = timezone.now() - timedelta(days=1)
+        times = [start + timedelta(minutes=15 * i) for i in range(3)]
+
+        for number in range(2):
+            self.create_assemblies(f'Сборщик {number}', times)
+        stats, few_queries = self.assembler_stats_queries()
+        self.assertEqual(len(stats), 2)
+
+        for number in range(2, 20):
+            self.create_assemblies(f'Сборщик {number}', times)
+        stats, many_queries = self.assembler_stats_queries()
+        self.assertEqual(len(stats), 20)
+
+        self.assertEqual(few_queries, many_queries)
+        self.assertLessEqual(many_queries, 2)
+
+    def test_avg_time_between_and_peak_hour(self):
+        start = local_datetime(timezone.localdate() - timedelta(days=1), hours=10)
+
+        # Интервалы 10, 20 и 60 минут: среднее 30
+        self.create_assemblies('Иванов', [
+            start,
+            start + timedelta(minutes=10),
+            start + timedelta(minutes=30),
+            start + timedelta(minutes=90),
+        ])
+        self.create_assemblies('Петров', [start])
+
+        stats, _ = self.assembler_stats_queries()
+        stats = {item['assembler']: item for item in stats}
+
+        self.assertAlmostEqual(stats['Иванов']['avg_time_between'], 30)
+        self.assertEqual(stats['Иванов']['peak_hour'], '10:00')
+        self.assertEqual(stats['Иванов']['peak_hour_count'], 3)
+        self.assertIsNone(stats['Петров']['avg_time_between'])
+        self.assertEqual(stats['Петров']['peak_hour_count'], 1)
+
+
+@override_settings(REPEATED_PRODUCTS_WINDOW_HOURS=0)
+class RepeatedProductsTests(TestCase):
+    """Повторные попадания товаров"""
+
+    def create_product(self, lm_code, assembler, created_at=None, missing=1):
+        return create_assembly(assembler, created_at, [(lm_code, '1', missing)])
+
+    def repeated(self, **filters):
+        with CaptureQueriesContext(connection) as queries:
+            rows = DashboardStatistics(DashboardFilters(**filters)).repeated_products()
+        return rows, len(queries)
+
+    def test_details_in_one_query(self):
+        self.create_product('LM1', 'Иванов', missing=1)
+        self.create_product('LM2', 'Иванов')
+        _, few_queries = self.repeated()
+
+        first = self.create_product('LM1', 'Петров', missing=2)
+        for number in range(10):
+            self.create_product(f'LM{number + 10}', 'Сидоров')
+            self.create_product(f'LM{number + 10}', 'Сидоров')
+        # Вчерашнее попадание в окно текущих суток не входит
+        self.create_product('LM2', 'Петров', timezone.now() - timedelta(days=1))
+
+        rows, many_queries = self.repeated()
+        self.assertEqual(few_queries, 1)
+        self.assertEqual(many_queries, 1)
+
+        rows = {row['lm_code']: row for row in rows}
+        self.assertEqual(len(rows), 11)
+        self.assertNotIn('LM2', rows)
+        self.assertEqual(rows['LM1']['today_count'], 2)
+        # Подробности каждой строки относятся к одной сборке и идут по времени
+        self.assertEqual(
+            [(item['assembly__assembler'], item['missing_quantity']) for item in rows['LM1']['details']],
+            [('Иванов', 1), ('Петров', 2)]
+        )
+        self.assertEqual(rows['LM1']['details'][1]['assembly__order_number'], first.order_number)
+
+    def test_repeat_hours_window(self):
+        now = timezone.now()
+        self.create_product('LM1', 'Иванов', now - timedelta(hours=3))
+        self.create_product('LM1', 'Иванов', now - timedelta(minutes=30))
+        self.create_product('LM1', 'Петров', now - timedelta(minutes=10))
+
+        rows, _ = self.repeated(repeat_hours='1')
+        self.assertEqual([(row['lm_code'], row['today_count']) for row in rows], [('LM1', 2)])
+
+        rows, _ = self.repeated(repeat_hours='4')
+        self.assertEqual(rows[0]['today_count'], 3)
+
+
+class SpaceSavingTests(SimpleTestCase):
+    """Скетч топа товаров"""
+
+    def test_exact_while_not_full(self):
+        sketch = SpaceSaving(capacity=10)
+        for item, weight in [('a', 3), ('b', 1), ('a', 2), ('c', 4)]:
+            sketch.add(item, weight)
+
+        self.assertEqual(sketch.top(2), [('a', 5, 0, True), ('c', 4, 0, True)])
+
+    def test_merged_bounds_and_top(self):
+        rnd = random.Random(1)
+        items = [f'LM{number}' for number in range(500)]
+        weights = [1 / (number + 1) for number in range(500)]
+
+        exact = Counter()
+        sketches = []
+        for _ in range(24):
+            sketch = SpaceSaving(capacity=50)
+            for item in rnd.choices(items, weights, k=300):
+                weight = rnd.randint(1, 5)
+                sketch.add(item, weight)
+                exact[item] += weight
+            sketches.append(sketch)
+
+        merged = SpaceSaving.merge(sketches, capacity=50)
+        for item, (count, error) in merged.counters.items():
+            self.assertLessEqual(count - error, exact[item])
+            self.assertGreaterEqual(count, exact[item])
+        for item in set(exact) - set(merged.counters):
+            self.assertLessEqual(exact[item], merged.min_count)
+
+        top = merged.top(3)
+        self.assertEqual([item for item, *_ in top], [item for item, _ in exact.most_common(3)])
+        self.assertTrue(all(guaranteed for *_, guaranteed in top))
+
+
+class TopProductsTests(TestCase):
+    """Часовые скетчи топа товаров"""
+
+    ingest = RollupTests.ingest
+
+    def setUp(self):
+        self.assemblies = [
+            create_assembly('Иванов', products=[('LM1', '1', 5), ('LM2', '1', 1)]),
+            create_assembly('Петров', products=[('LM1', '1', 2), ('LM3', '2', 3)]),
+        ]
+
+    def changed(self, assemblies):
+        with self.captureOnCommitCallbacks(execute=True):
+            send_assemblies_changed([assembly.pk for assembly in assemblies])
+
+    def top(self, exact=False):
+        return [(item['lm_code'], item['value']) for item in top_products('hour', 'missing', 10, exact=exact)['items']]
+
+    def test_ingest_only_marks_hours(self):
+        with mock.patch('particles.heavy_hitters.build_hour_sketches') as build:
+            self.changed(self.assemblies)
+        build.assert_not_called()
+
+        now = timezone.localtime()
+        sketch = TopProductsSketch.objects.get()
+        self.assertEqual((sketch.date, sketch.hour, sketch.stale), (now.date(), now.hour, True))
+
+        self.assertEqual(refresh_stale_sketches(), 1)
+        self.assertEqual(refresh_stale_sketches(), 0)
+        self.assertEqual(self.top(), [('LM1', 7), ('LM3', 3), ('LM2', 1)])
+        self.assertEqual(self.top(), self.top(exact=True))
+
+    def test_blacklist_rebuilds_hour(self):
+        self.changed(self.assemblies)
+        refresh_stale_sketches()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_black_list(select_products(lm_codes=['LM1']), True)
+        self.assertTrue(TopProductsSketch.objects.get().stale)
+
+        refresh_stale_sketches()
+        self.assertEqual(self.top(), [('LM3', 3), ('LM2', 1)])
+        self.assertEqual(self.top(), self.top(exact=True))
+
+    def test_ingest_merges_new_assemblies(self):
+        self.changed(self.assemblies)
+        refresh_stale_sketches()
+
+        with mock.patch('particles.heavy_hitters.build_hour_sketches') as build:
+            self.ingest(('1', 'Сидоров', [('LM2', '1', 4), ('LM4', '3', 1)]))
+        build.assert_not_called()
+
+        self.assertFalse(TopProductsSketch.objects.get().stale)
+        self.assertEqual(self.top(), [('LM1', 7), ('LM2', 5), ('LM3', 3), ('LM4', 1)])
+        self.assertEqual(self.top(), self.top(exact=True))
+
+        # Повторный прием той же сборки - только пометка часа
+        self.ingest(('1', 'Сидоров', [('LM2', '1', 1)]))
+        self.assertTrue(TopProductsSketch.objects.get().stale)
+        refresh_stale_sketches()
+        self.assertEqual(self.top(), self.top(exact=True))
+
+    def test_window_aligned_to_hour(self):
+        hour = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+        self.assertEqual(window_start('hour'), hour)
+        self.assertEqual(window_start('today'), hour.replace(hour=0))
+        self.assertEqual(window_start('week'), hour - timedelta(days=7))
+
+
+class HyperLogLogTests(SimpleTestCase):
+    """Скетч уникальных значений"""
+
+    def hashes(self, start, stop):
+        # Случайные 64-битные хеши значений start..stop-1
+        return np.random.default_rng(start).integers(-2 ** 63, 2 ** 63 - 1, stop - start, dtype=np.int64)
+
+    def test_estimate_error(self):
+        for distinct in (50, 5000, 200_000):
+            sketch = HyperLogLog()
+            sketch.add_hashes(self.hashes(0, distinct))
+            self.assertAlmostEqual(sketch.cardinality(), distinct, delta=distinct * 0.05)
+
+    def test_union_matches_combined_sketch(self):
+        first, second, combined = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        hashes = self.hashes(0, 30_000)
+        first.add_hashes(hashes[:20_000])
+        second.add_hashes(hashes[10_000:])
+        combined.add_hashes(hashes)
+
+        union = HyperLogLog.union([first, second])
+        self.assertTrue(np.array_equal(union.registers, combined.registers))
+        self.assertEqual(HyperLogLog.from_bytes(union.to_bytes()).cardinality(), combined.cardinality())
+
+
+class AggregationTests(TestCase):
+    """Произвольные разрезы статистики"""
+
+    def setUp(self):
+        rows = [
+            # Недостача больше 5 - критический товар
+            ('Z1', 'Иванов', [('1', 2), ('2', 1)]),
+            ('Z1', 'Петров', [('1', 6)]),
+            ('Z2', 'Иванов', [('2', 7), ('3', 1)]),
+        ]
+        for number, (zone, assembler, products) in enumerate(rows):
+            create_assembly(assembler, zone=zone, products=[
+                (f'LM{number}{position}', department, missing)
+                for position, (department, missing) in enumerate(products)
+            ])
+
+    def test_grouping_sets_with_subtotals(self):
+        aggregation = Aggregation(
+            DashboardFilters(),
+            [('zone', 'department'), ('department', 'zone'), ('assembler',)],
+            measures=['products', 'assemblies', 'missing_quantity', 'critical'],
+            subtotals=True,
+        )
+        self.assertEqual(
+            aggregation.sets,
+            [('zone', 'department'), ('zone',), (), ('department',), ('assembler',)]
+        )
+
+        result = {tuple(item['dimensions']): item['rows'] for item in aggregation.execute()['sets']}
+        self.assertEqual(result[('zone',)], [
+            {'zone': 'Z1', 'products': 3, 'assemblies': 2, 'missing_quantity': 9, 'critical': 1},
+            {'zone': 'Z2', 'products': 2, 'assemblies': 1, 'missing_quantity': 8, 'critical': 1},
+        ])
+        self.assertEqual(result[()], [{'products': 5, 'assemblies': 3, 'missing_quantity': 17, 'critical': 2}])
+        self.assertEqual(result[('zone', 'department')][0], {
+            'zone': 'Z1', 'department': '1', 'products': 2, 'assemblies': 2, 'missing_quantity': 8, 'critical': 1,
+        })
+        self.assertEqual(
+            [(row['assembler'], row['products']) for row in result[('assembler',)]],
+            [('Иванов', 4), ('Петров', 1)]
+        )
+
+    def test_unknown_dimension(self):
+        with self.assertRaises(ValueError):
+            Aggregation(DashboardFilters(), [('zone', 'password')])
+
+
+class PeriodComparisonTests(TestCase):
+    """Сравнение с предыдущим периодом"""
+
+    def create_assembly(self, assembler, created_at, missing):
+        create_assembly(assembler, created_at, [(f'LM{missing}', '1', missing)])
+
+    def setUp(self):
+        self.day = timezone.localdate() - timedelta(days=1)
+        current = local_datetime(self.day, hours=10)
+        previous = current - timedelta(days=1)
+
+        for minutes, missing in ((0, 1), (10, 2), (20, 3)):
+            self.create_assembly('Иванов', current + timedelta(minutes=minutes), missing)
+        self.create_assembly('Иванов', previous, 4)
+        self.create_assembly('Петров', previous + timedelta(hours=1), 2)
+        rebuild_rollups()
+
+    def statistics(self, compare):
+        return DashboardStatistics(DashboardFilters(date_from=self.day, date_to=self.day, compare=compare))
+
+    def test_previous_period(self):
+        filters = DashboardFilters(date_from=self.day, date_to=self.day + timedelta(days=1), compare=True)
+        self.assertEqual(filters.previous_period, (self.day - timedelta(days=2), self.day - timedelta(days=1)))
+        self.assertIsNone(DashboardFilters(date_to=self.day, compare=True).previous_period)
+
+    def test_totals_in_same_queries(self):
+        with CaptureQueriesContext(connection) as plain:
+            stats = self.statistics(False).get_total_stats()
+        self.assertNotIn('comparison', stats)
+
+        with CaptureQueriesContext(connection) as compared:
+            stats = self.statistics(True).get_total_stats()
+        self.assertEqual(len(compared), len(plain))
+
+        comparison = stats['comparison']
+        self.assertEqual(stats['total_assemblies'], 3)
+        self.assertEqual(comparison['total_assemblies'], {'previous': 2, 'delta': 1, 'delta_percent': 50})
+        self.assertEqual(comparison['total_missing_quantity'], {'previous': 6, 'delta': 0, 'delta_percent': 0})
+
+    def test_groups_compared_by_key(self):
+        statistics = self.statistics(True)
+
+        assemblers = {item['assembler']: item for item in statistics.get_assembler_stats()}
+        # Петров работал только в предыдущем периоде
+        self.assertEqual(list(assemblers), ['Иванов'])
+        self.assertEqual(assemblers['Иванов']['comparison']['assembly_count']['previous'], 1)
+        self.assertAlmostEqual(assemblers['Иванов']['avg_time_between'], 10)
+        self.assertIsNone(assemblers['Иванов']['comparison']['avg_time_between']['delta'])
+
+        hourly = {item['hour']: item for item in statistics.get_time_stats()['hourly']}
+        self.assertEqual(hourly[10]['comparison']['count'], {'previous': 1, 'delta': 2, 'delta_percent': 200})
+
+
+class HeatmapsTests(TestCase):
+    """Тепловые карты недостачи"""
+
+    def test_dense_matrices(self):
+        day = timezone.localdate() - timedelta(days=1)
+        for number, (zone, department, hour, missing) in enumerate((
+            ('Z1', '1', 9, 2),
+            ('Z1', '2', 9, 3),
+            ('Z2', '1', 18, 4),
+        )):
+            create_assembly('Иванов', local_datetime(day, hours=hour), [(f'LM{number}', department, missing)], zone=zone)
+        rebuild_rollups()
+
+        heatmaps = Heatmaps(DashboardFilters()).build()
+
+        zone_hour = heatmaps['zone_hour']
+        self.assertEqual(zone_hour['rows'], ['Z1', 'Z2'])
+        self.assertEqual(len(zone_hour['columns']), 24)
+        self.assertEqual(zone_hour['missing'][0][9], 5)
+        self.assertEqual(zone_hour['products'][0][9], 2)
+        self.assertEqual(zone_hour['missing'][1][18], 4)
+        self.assertEqual(sum(map(sum, zone_hour['missing'])), 9)
+
+        weekday = heatmaps['department_weekday']
+        self.assertEqual(weekday['rows'], ['1', '2'])
+        self.assertEqual(weekday['missing'][0][day.isoweekday() - 1], 6)
+
+
+class ChronicShortageTests(TestCase):
+    """Индекс хронической недостачи"""
+
+    def create_product(self, lm_code, assembler, days_ago, missing):
+        day = timezone.localdate() - timedelta(days=days_ago)
+        create_assembly(assembler, local_datetime(day, hours=12), [(lm_code, '1', missing)])
+
+    def test_repeated_shortage_ranks_first(self):
+        # LM1 пропадает в разные дни у разных сборщиков, LM2 - один раз, но в большом количестве
+        self.create_product('LM1', 'Иванов', 1, 2)
+        self.create_product('LM1', 'Петров', 3, 2)
+        self.create_product('LM1', 'Сидоров', 5, 2)
+        self.create_product('LM2', 'Иванов', 1, 8)
+
+        self.assertEqual(refresh_chronic_shortages(), 2)
+
+        shortages = {item.lm_code: item for item in ChronicShortage.objects.all()}
+        self.assertEqual(shortages['LM1'].rank, 1)
+        self.assertEqual(shortages['LM1'].days_active, 3)
+        self.assertEqual(shortages['LM1'].assemblers_count, 3)
+        self.assertEqual(shortages['LM1'].total_missing, 6)
+        # Недостача давних дней весит меньше
+        self.assertLess(shortages['LM1'].weighted_missing, 6)
+        self.assertEqual(shortages['LM2'].rank, 2)
+
+
+class ForecastingTests(SimpleTestCase):
+    """Векторные скользящие средние и сглаживание рядов прогноза"""
+
+    def test_matches_per_series_calculation(self):
+        values = np.random.default_rng(1).poisson(5, size=(2, 6, 20)).astype(float)
+
+        means = rolling_mean(values, 7)
+        levels = exponential_smoothing(values, 0.3)
+
+        for metric in range(2):
+            for series in range(6):
+                row = values[metric, series]
+                for day in range(20):
+                    self.assertAlmostEqual(means[metric, series, day], row[max(0, day - 6):day + 1].mean())
+
+                level = row[0]
+                for value in row[1:]:
+                    level = 0.3 * value + 0.7 * level
+                self.assertAlmostEqual(levels[metric, series, -1], level)
+
+        forecast, mean = forecast_next(values, 0.3)
+        self.assertEqual(forecast.shape, (2, 6))
+        np.testing.assert_allclose(mean, values[..., -7:].mean(axis=-1))
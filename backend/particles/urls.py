@@ -11,8 +11,12 @@ urlpatterns = [
     # Новые URL для работы с черным списком товаров
     path('product/blacklist/<int:pk>/', views.product_blacklist, name='product_blacklist'),
     path('product/unblacklist/<int:pk>/', views.product_remove_blacklist, name='product_remove_blacklist'),
+    path('product/blacklist/bulk/', views.BulkBlacklistView.as_view(), name='product_bulk_blacklist'),
 
-    path('export/', views.export_assemblies_to_excel, name='export_assemblies'),
+    path('export/', views.export_assemblies, name='export_assemblies'),
+    path('export/download/', views.export_assemblies_download, name='export_assemblies_download'),
+    path('export/jobs/<int:pk>/', views.export_job_status, name='export_job_status'),
+    path('export/jobs/<int:pk>/download/', views.export_job_download, name='export_job_download'),
 
     # Основной эндпоинт с детальной статистикой (рекомендуется)
     path('partially_picked_assemblies/',
@@ -20,5 +24,11 @@ urlpatterns = [
          name='receive-partially-picked'),
     path('statistics/', views.StatisticsDashboard.as_view(), name='statistics_dashboard'),
     path('statistics/api/', views.StatisticsAPIView.as_view(), name='statistics_api'),
+    path('statistics/sections/<str:section>/', views.StatisticsSectionView.as_view(), name='statistics_section'),
+    path('statistics/aggregate/', views.StatisticsAggregationView.as_view(), name='statistics_aggregate'),
+    path('statistics/heatmaps/', views.StatisticsHeatmapsView.as_view(), name='statistics_heatmaps'),
+    path('statistics/chronic/', views.ChronicShortageView.as_view(), name='statistics_chronic'),
+    path('statistics/forecast/', views.ShortageForecastView.as_view(), name='statistics_forecast'),
+    path('statistics/top-products/', views.TopProductsView.as_view(), name='statistics_top_products'),
     path('statistics/export/', views.StatisticsExportView.as_view(), name='statistics_export'),
 ]
@@ -1,4 +1,7 @@
+from datetime import date, datetime, time, timedelta
+
 from django.db.models import Count
+from django.utils import timezone
 from .models import PartiallyPickedAssembly, PartiallyPickedProduct
 
 
@@ -98,4 +101,20 @@ def cleanup_duplicates():
 
     return {
         'message': 'Дубликаты очищены. Теперь можно применить уникальные constraints.'
-    }
\ No newline at end of file
+    }
+
+def local_day_bounds(date_from=None, date_to=None):
+    """
+    Переводит диапазон дат (включительно) в границы aware-datetime в текущей TZ.
+    Фильтр по created_at__gte/__lt использует индекс, в отличие от created_at__date
+    """
+    start = end = None
+    if date_from:
+        if isinstance(date_from, str):
+            date_from = date.fromisoformat(date_from)
+        start = timezone.make_aware(datetime.combine(date_from, time.min))
+    if date_to:
+        if isinstance(date_to, str):
+            date_to = date.fromisoformat(date_to)
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+    return start, end
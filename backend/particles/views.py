@@ -1,24 +1,58 @@
+import os
+import tempfile
 from pprint import pprint
 
-import pandas as pd
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Sum, Avg, Max, IntegerField
-from django.db.models.functions import TruncDate, ExtractHour, Cast
-from django.http import HttpResponse, JsonResponse
-from django.shortcuts import get_object_or_404, redirect
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import IntegerField
+from django.db.models.functions import Cast
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
-from django.views.generic import TemplateView
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.views.generic import TemplateView, View
 from loguru import logger
 from rest_framework import status
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import PartiallyPickedAssembly, PartiallyPickedProduct
+from .blacklist import select_products, set_black_list
+from .charts import ChartData
+from .chronic import SORT_FIELDS as CHRONIC_SORT_FIELDS
+from .export_jobs import enqueue_export
+from .exports import (
+    EXPORT_FORMATS,
+    EXPORT_WRITERS,
+    filter_export_assemblies,
+    is_sync_export,
+    iter_csv,
+    iter_export_rows,
+)
+from .forecasting import forecast_table
+from .heatmaps import HEATMAPS, Heatmaps
+from .heavy_hitters import METRICS, WINDOWS, top_products
+from .models import ChronicShortage, ExportJob, PartiallyPickedAssembly, PartiallyPickedProduct
+from .olap import Aggregation
 from .serializers import (
+    BulkBlacklistSerializer,
     PartiallyPickedAssemblyCreateSerializer,
 )
+from .statistics import DashboardFilters, DashboardStatistics
+from .statistics_export import iter_raw_rows, iter_statistics_json, iter_statistics_ndjson
+from .stats_cache import (
+    cache_etag,
+    get_data_version,
+    get_or_compute,
+    get_section,
+    get_sections,
+    section_key,
+)
 
 
 class ReceivePartiallyPickedAssembliesView(APIView):
@@ -77,7 +111,9 @@ class ReceivePartiallyPickedAssembliesView(APIView):
                         'created': created_products,
                         'updated': updated_products,
                         'total': total_products,
-                        'skipped': products_stats.get('skipped', 0)
+                        'skipped': products_stats.get('skipped', 0),
+                        'blacklisted_by_rules': products_stats.get('blacklisted_by_rules', 0),
+                        'skipped_by_rules': products_stats.get('skipped_by_rules', 0)
                     }
                 }
             }, status=status.HTTP_201_CREATED)
@@ -104,7 +140,7 @@ class ParticlesTable(LoginRequiredMixin, TemplateView):
         department_id = self.request.GET.get('department_id')
         assembly_zone = self.request.GET.get('assembly_zone')
         # Базовый QuerySet с префетчем
-        assemblies = (PartiallyPickedAssembly.objects.filter(black_list=False, id__in=[58,59]).exclude(assembly_zone="WH")
+        assemblies = (PartiallyPickedAssembly.objects.filter(black_list=False).exclude(assembly_zone="WH")
                       .prefetch_related('products').all())
 
         # Применяем фильтры
@@ -115,10 +151,10 @@ class ParticlesTable(LoginRequiredMixin, TemplateView):
             assemblies = assemblies.filter(order_number=order_number)
 
         if date_from:
-            assemblies = assemblies.filter(created_at__date__gte=date_from)
+            assemblies = assemblies.filter(created_date__gte=date_from)
 
         if date_to:
-            assemblies = assemblies.filter(created_at__date__lte=date_to)
+            assemblies = assemblies.filter(created_date__lte=date_to)
 
         if department_id:
             assemblies = assemblies.filter(products__department_id=department_id).distinct()
@@ -219,569 +255,433 @@ def product_remove_blacklist(request, pk):
 
     return redirect("particles:particles_main")
 
-def export_assemblies_to_excel(request):
-    """Экспорт в Excel с использованием pandas"""
-
-    # Получаем и фильтруем данные аналогично
-    assembler = request.GET.get('assembler', '')
-    order_number = request.GET.get('order_number', '')
-    date_from = request.GET.get('date_from', '')
-    date_to = request.GET.get('date_to', '')
-
-    queryset = PartiallyPickedAssembly.objects.all()
-
-    if assembler:
-        queryset = queryset.filter(assembler=assembler)
-
-    if order_number:
-        queryset = queryset.filter(order_number__icontains=order_number)
-
-    if date_from:
-        queryset = queryset.filter(created_at__date__gte=date_from)
-
-    if date_to:
-        queryset = queryset.filter(created_at__date__lte=date_to)
-
-    # Подготовка данных
-    data = []
-    for assembly in queryset:
-        products = assembly.products.all()
-
-        if products.exists():
-            for product in products:
-                data.append({
-                    '№': len(data) + 1,
-                    'Номер заказа': assembly.order_number,
-                    'ID задачи': assembly.task_id,
-                    'Зона сборки': assembly.assembly_zone or '-',
-                    'Сборщик': assembly.assembler or 'Не указан',
-                    'Дата создания': assembly.created_at.strftime('%d.%m.%Y'),
-                    'Время создания': assembly.created_at.strftime('%H:%M'),
-                    'LM код': product.lm_code or '-',
-                    'Отдел': product.department_id or '-',
-                    'Название товара': product.title or 'Без названия',
-                    'Не хватает': product.missing_quantity or 0,
-                    'Статус': assembly.status_str,
-                    'Количество товаров': products.count()
-                })
-        else:
-            data.append({
-                '№': len(data) + 1,
-                'Номер заказа': assembly.order_number,
-                'ID задачи': assembly.task_id,
-                'Зона сборки': assembly.assembly_zone or '-',
-                'Сборщик': assembly.assembler or 'Не указан',
-                'Дата создания': assembly.created_at.strftime('%d.%m.%Y'),
-                'Время создания': assembly.created_at.strftime('%H:%M'),
-                'LM код': '-',
-                'Отдел': '-',
-                'Название товара': 'Нет товаров',
-                'Не хватает': 0,
-                'Статус': assembly.status_str,
-                'Количество товаров': 0
-            })
-
-    # Создаем DataFrame
-    df = pd.DataFrame(data)
-
-    # Создаем HttpResponse с Excel
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response[
-        'Content-Disposition'] = f'attachment; filename=assemblies_export_{timezone.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
 
-    # Записываем в Excel
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Сборки', index=False)
+class BulkBlacklistView(APIView):
+    """
+    Массовое добавление/удаление товаров из черного списка
+    по списку id, LM кодам или отделу с фильтром по датам
+    """
+    permission_classes = [IsAuthenticated]
 
-        # Настраиваем ширину колонок (опционально)
-        worksheet = writer.sheets['Сборки']
-        for column in df:
-            column_width = max(df[column].astype(str).map(len).max(), len(column))
-            col_idx = df.columns.get_loc(column)
-            worksheet.column_dimensions[chr(65 + col_idx)].width = min(column_width + 2, 50)
+    def post(self, request):
+        serializer = BulkBlacklistSerializer(data=request.data)
 
-    return response
+        if not serializer.is_valid():
+            return Response({
+                'status': 'error',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        products = select_products(
+            ids=data.get('ids'),
+            lm_codes=data.get('lm_codes'),
+            department_id=data.get('department_id'),
+            date_from=data.get('date_from'),
+            date_to=data.get('date_to'),
+        )
+        result = set_black_list(products, data['action'] == BulkBlacklistSerializer.ACTION_BLACKLIST)
+
+        logger.info(
+            f"Массовое изменение черного списка ({data['action']}) пользователем {request.user}: "
+            f"товаров {result['products']}, сборок {result['assemblies']}"
+        )
+
+        return Response({
+            'status': 'success',
+            'action': data['action'],
+            'stats': result,
+        })
+
+
+def _export_job_payload(job):
+    return {
+        'job_id': job.pk,
+        'status': job.status,
+        'format': job.export_format,
+        'rows': job.rows_count,
+        'size': job.file_size,
+        'error': job.error,
+        'status_url': reverse('particles:export_job_status', args=[job.pk]),
+        'download_url': reverse('particles:export_job_download', args=[job.pk]),
+    }
+
+
+@login_required
+def export_assemblies(request):
+    """
+    Экспорт сборок: format=xlsx (по умолчанию), csv или parquet.
+    Небольшой экспорт скачивается сразу по download_url, большой ставится в очередь:
+    одинаковые запросы получают одну и ту же задачу, файл строит планировщик
+    """
+    export_format = request.GET.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({
+            'status': 'error',
+            'error': f'Неизвестный формат экспорта: {export_format}'
+        }, status=400)
+
+    if is_sync_export(filter_export_assemblies(request.GET)):
+        return JsonResponse({
+            'status': 'direct',
+            'format': export_format,
+            'download_url': f"{reverse('particles:export_assemblies_download')}?{request.GET.urlencode()}",
+        })
+
+    job, created = enqueue_export(request.GET, export_format)
+
+    payload = _export_job_payload(job)
+    payload['shared'] = not created
+    return JsonResponse(payload, status=202)
+
+
+@login_required
+def export_assemblies_download(request):
+    """
+    Синхронная выгрузка небольшого экспорта.
+    CSV отдается генератором, XLSX и Parquet пишутся во временный файл
+    """
+    export_format = request.GET.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'Неизвестный формат экспорта: {export_format}')
+
+    assemblies = filter_export_assemblies(request.GET)
+    if not is_sync_export(assemblies):
+        return HttpResponseBadRequest('Слишком большой экспорт, запустите его в фоне')
+
+    rows = iter_export_rows(assemblies)
+    content_type = EXPORT_FORMATS[export_format]
+    filename = f'assemblies_export_{timezone.localtime().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+
+    if export_format == 'csv':
+        response = StreamingHttpResponse(iter_csv(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    # Файл удаляется системой при закрытии ответа
+    export_file = tempfile.TemporaryFile()
+    EXPORT_WRITERS[export_format](rows, export_file)
+    export_file.seek(0)
+
+    return FileResponse(export_file, as_attachment=True, filename=filename, content_type=content_type)
+
+
+@login_required
+def export_job_status(request, pk):
+    """Статус задачи экспорта для опроса со страницы"""
+    job = get_object_or_404(ExportJob, pk=pk)
+    return JsonResponse(_export_job_payload(job))
+
+
+@login_required
+def export_job_download(request, pk):
+    """Скачивание готового файла экспорта"""
+    job = get_object_or_404(ExportJob, pk=pk, status=ExportJob.STATUS_DONE)
+    if not os.path.exists(job.file_path):
+        raise Http404("Файл экспорта устарел, запустите экспорт повторно")
+
+    filename = f'assemblies_export_{timezone.localtime(job.finished_at).strftime("%Y%m%d_%H%M%S")}.{job.export_format}'
+    return FileResponse(
+        open(job.file_path, 'rb'),
+        as_attachment=True,
+        filename=filename,
+        content_type=EXPORT_FORMATS[job.export_format]
+    )
 
 #Статистика
+def _conditional_response(request, key, build_response):
+    """
+    Ответ с ETag из ключа кеша статистики.
+    Если у клиента актуальная версия - 304 без расчета и чтения кеша
+    """
+    etag = cache_etag(key)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build_response()
+
+    response['ETag'] = etag
+    # Браузер хранит ответ, но перед использованием проверяет ETag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 class StatisticsDashboard(LoginRequiredMixin, TemplateView):
-    """Дашборд статистики по частичным сборкам"""
+    """
+    Дашборд статистики по частичным сборкам.
+    Страница отдается сразу с фильтрами, разделы браузер загружает параллельно из StatisticsSectionView
+    """
     template_name = "particles/dashboard.html"
     login_url = "home:login"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Параметры периода
-        date_from = self.request.GET.get('date_from')
-        date_to = self.request.GET.get('date_to')
-        assembler = self.request.GET.get('assembler')
-        department_id = self.request.GET.get('department_id')
+        filters = DashboardFilters.from_request(self.request.GET)
 
-        # Базовые QuerySet'ы
-        # Сборки без зоны "WH" с предварительной загрузкой продуктов
-        assemblies = PartiallyPickedAssembly.objects.exclude(
-            assembly_zone="WH"
-        ).filter(id__in=[58,59]).prefetch_related('products').all()
-
-        # Для продуктов - получаем только те, что принадлежат отфильтрованным сборкам
-        assemblies_ids = assemblies.values_list('id', flat=True)
-        products = PartiallyPickedProduct.objects.filter(assembly_id__in=assemblies_ids)
+        # Фильтры для отображения
+        context['date_from'] = self.request.GET.get('date_from')
+        context['date_to'] = self.request.GET.get('date_to')
+        context['assembler'] = self.request.GET.get('assembler')
+        context['department_id'] = self.request.GET.get('department_id')
+        context['repeat_hours'] = filters.repeat_hours
+        context['exact'] = filters.exact
+        context['compare'] = filters.compare
 
-        # Применяем фильтры
-        if date_from:
-            assemblies = assemblies.filter(created_at__date__gte=date_from)
-            products = products.filter(assembly__created_at__date__gte=date_from)
+        # Уникальные значения для фильтров
+        context['unique_assemblers'] = DashboardStatistics.unique_assemblers()
+        context['unique_departments'] = DashboardStatistics.unique_departments()
 
-        if date_to:
-            assemblies = assemblies.filter(created_at__date__lte=date_to)
-            products = products.filter(assembly__created_at__date__lte=date_to)
+        return context
 
-        if assembler:
-            assemblies = assemblies.filter(assembler__icontains=assembler)
-            products = products.filter(assembly__assembler__icontains=assembler)
 
-        if department_id:
-            products = products.filter(department_id=department_id)
-            assemblies = assemblies.filter(products__department_id=department_id).distinct()
+class StatisticsSectionView(LoginRequiredMixin, View):
+    """
+    Один раздел дашборда: HTML-фрагмент или JSON (?format=json).
+    Каждый раздел кешируется отдельно и отдается с собственным ETag
+    """
+    login_url = "home:login"
 
-        # 1. Общая статистика за период
-        context['total_stats'] = self.get_total_stats(assemblies, products)
+    def get(self, request, section, *args, **kwargs):
+        if section not in DashboardStatistics.SECTIONS:
+            raise Http404
 
-        # 2. Статистика по сборщикам
-        context['assembler_stats'] = self.get_assembler_stats(assemblies)
+        filters = DashboardFilters.from_request(request.GET)
+        version = get_data_version()
+        response_format = 'json' if request.GET.get('format') == 'json' else 'html'
+        key = section_key(filters, f'{section}:{response_format}', version)
 
-        # 3. Статистика по товарам
-        context['product_stats'] = self.get_product_stats(products)
+        def build_response():
+            data = get_section(DashboardStatistics(filters, version), section, version)
+            if response_format == 'json':
+                return JsonResponse({section: data}, encoder=DjangoJSONEncoder)
+            return render(request, f'particles/dashboard/{section}.html', {section: data})
 
-        # 4. Статистика по отделам
-        context['department_stats'] = self.get_department_stats(products)
+        return _conditional_response(request, key, build_response)
 
-        # 5. Временная статистика (по дням, часам)
-        context['time_stats'] = self.get_time_stats(assemblies)
 
-        # 6. Критические товары
-        context['critical_stats'] = self.get_critical_stats(products)
+class StatisticsAPIView(LoginRequiredMixin, View):
+    """
+    API данных графиков дашборда.
+    Ответ кешируется по фильтрам и версии данных, поэтому повторный запрос
+    без изменений данных получает 304 без расчета
+    """
+    login_url = "home:login"
 
-        # Фильтры для отображения
-        context['date_from'] = date_from
-        context['date_to'] = date_to
-        context['assembler'] = assembler
-        context['department_id'] = department_id
+    def get(self, request, *args, **kwargs):
+        chart_type = request.GET.get('chart_type', 'daily_assemblies')
+        if chart_type not in ChartData.CHART_TYPES:
+            return JsonResponse({'error': f'Неизвестный тип графика: {chart_type}'}, status=400)
 
-        # Уникальные значения для фильтров
-        context['unique_assemblers'] = PartiallyPickedAssembly.objects.values(
-            'assembler'
-        ).exclude(assembler__isnull=True).exclude(assembler='').distinct().order_by('assembler')
+        filters = DashboardFilters.from_request(request.GET)
+        chart = ChartData(filters, request.GET.get('bucket'))
+        # Без границ периода выбор интервала читает крайние даты из агрегатов (один запрос)
+        key = section_key(filters, f'chart:{chart_type}:{chart.bucket}', get_data_version())
 
-        context['unique_departments'] = PartiallyPickedProduct.objects.values(
-            'department_id'
-        ).exclude(department_id__isnull=True).exclude(department_id='').distinct().order_by('department_id')
+        return _conditional_response(request, key, lambda: JsonResponse(get_or_compute(
+            key,
+            lambda: chart.compute(chart_type),
+            name=chart_type
+        )))
 
-        return context
 
-    def get_total_stats(self, assemblies, products):
-        """Общая статистика за период"""
-        total_assemblies = assemblies.count()
-        total_products = products.count()
-
-        # Сборки с товарами и без
-        assemblies_with_products = assemblies.filter(products_count__gt=0).count()
-        assemblies_without_products = total_assemblies - assemblies_with_products
-
-        # Товарная статистика
-        total_missing_quantity = products.aggregate(
-            total=Sum('missing_quantity')
-        )['total'] or 0
-
-        total_required_quantity = products.aggregate(
-            total=Sum('quantity')
-        )['total'] or 0
-
-        total_collected_quantity = products.aggregate(
-            total=Sum('collected_quantity')
-        )['total'] or 0
-
-        # Критические товары
-        critical_products = products.filter(is_critical=True).count()
-
-        return {
-            'total_assemblies': total_assemblies,
-            'total_products': total_products,
-            'assemblies_with_products': assemblies_with_products,
-            'assemblies_without_products': assemblies_without_products,
-            'total_missing_quantity': total_missing_quantity,
-            'total_required_quantity': total_required_quantity,
-            'total_collected_quantity': total_collected_quantity,
-            'collection_rate': (total_collected_quantity / total_required_quantity * 100
-                                if total_required_quantity > 0 else 0),
-            'critical_products': critical_products,
-            'critical_percentage': (critical_products / total_products * 100
-                                    if total_products > 0 else 0),
-        }
+class StatisticsAggregationView(LoginRequiredMixin, View):
+    """
+    Произвольные разрезы статистики: наборы разрезов и меры из белого списка (particles.olap),
+    все наборы и промежуточные итоги считаются одним запросом GROUPING SETS.
+    Пример: ?sets=zone,department;assembler,hour&measures=products,missing_quantity&subtotals=1
+    """
+    login_url = "home:login"
 
-    def get_assembler_stats(self, assemblies):
-        """Статистика по сборщикам"""
-        stats = assemblies.values('assembler').annotate(
-            assembly_count=Count('id'),
-            total_products=Sum('products_count'),
-            total_missing=Sum('total_missing_quantity'),
-            avg_products_per_assembly=Avg('products_count'),
-            last_activity=Max('created_at'),
-        ).order_by('-assembly_count')
-
-        # Рассчитываем дополнительные метрики
-        for item in stats:
-            # Среднее время между сборками
-            assembler_assemblies = assemblies.filter(assembler=item['assembler'])
-            if assembler_assemblies.count() > 1:
-                time_diffs = []
-                prev_time = None
-                for assembly in assembler_assemblies.order_by('created_at'):
-                    if prev_time:
-                        time_diffs.append((assembly.created_at - prev_time).total_seconds() / 60)  # в минутах
-                    prev_time = assembly.created_at
-                if time_diffs:
-                    item['avg_time_between'] = sum(time_diffs) / len(time_diffs)
-                else:
-                    item['avg_time_between'] = 0
-            else:
-                item['avg_time_between'] = None
-
-            # Часы пиковой активности
-            hours = assembler_assemblies.annotate(
-                hour=ExtractHour('created_at')
-            ).values('hour').annotate(
-                count=Count('id')
-            ).order_by('-count')
-
-            if hours.exists():
-                peak_hour = hours.first()
-                item['peak_hour'] = f"{peak_hour['hour']}:00"
-                item['peak_hour_count'] = peak_hour['count']
-            else:
-                item['peak_hour'] = None
-                item['peak_hour_count'] = 0
-
-        return list(stats)
-
-    def get_product_stats(self, products):
-        """Статистика по товарам"""
-        # Топ товаров по количеству недостачи
-        top_by_missing = products.values('lm_code', 'title', 'department_id').annotate(
-            total_missing=Sum('missing_quantity'),
-            occurrences=Count('id'),
-            avg_missing=Avg('missing_quantity'),
-            max_missing=Max('missing_quantity'),
-            assemblies_count=Count('assembly', distinct=True),
-            assemblers_count=Count('assembly__assembler', distinct=True),
-        ).order_by('-total_missing')[:20]
-
-        # Товары с повторными попаданиями в течение суток
-        # Для этого нужен более сложный запрос
-        repeated_products = []
-        today = timezone.now().date()
-
-        for product in products.filter(assembly__created_at__date=today).values(
-                'lm_code', 'title', 'department_id'
-        ).annotate(
-            today_count=Count('id')
-        ).filter(today_count__gt=1):
-            # Получаем подробности о повторениях
-            product_details = products.filter(
-                lm_code=product['lm_code'],
-                assembly__created_at__date=today
-            ).values('assembly__order_number', 'missing_quantity',
-                     'assembly__created_at', 'assembly__assembler')
-
-            repeated_products.append({
-                'lm_code': product['lm_code'],
-                'title': product['title'],
-                'department_id': product['department_id'],
-                'today_count': product['today_count'],
-                'details': list(product_details),
-            })
-
-        # Частота появления товаров
-        frequency_stats = products.values('lm_code', 'title').annotate(
-            total_occurrences=Count('id'),
-            days_active=Count('assembly__created_at__date', distinct=True),
-            avg_per_day=Count('id') / Count('assembly__created_at__date', distinct=True),
-            last_seen=Max('assembly__created_at'),
-        ).order_by('-total_occurrences')[:15]
-
-        return {
-            'top_by_missing': list(top_by_missing),
-            'repeated_today': repeated_products,
-            'frequency_stats': list(frequency_stats),
-        }
+    def get(self, request, *args, **kwargs):
+        filters = DashboardFilters.from_request(request.GET)
+        try:
+            aggregation = Aggregation.from_request(filters, request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
 
-    def get_department_stats(self, products):
-        """Статистика по отделам"""
-        stats = products.values('department_id').exclude(
-            department_id__isnull=True
-        ).exclude(
-            department_id=''
-        ).annotate(
-            product_count=Count('id'),
-            total_missing=Sum('missing_quantity'),
-            total_required=Sum('quantity'),
-            total_collected=Sum('collected_quantity'),
-            avg_missing=Avg('missing_quantity'),
-            unique_products=Count('lm_code', distinct=True),
-            unique_assemblies=Count('assembly', distinct=True),
-            unique_assemblers=Count('assembly__assembler', distinct=True),
-        ).order_by('-total_missing')
-
-        # Рассчитываем проценты
-        for item in stats:
-            if item['total_required'] > 0:
-                item['collection_rate'] = (item['total_collected'] / item['total_required'] * 100)
-            else:
-                item['collection_rate'] = 0
-
-            if item['product_count'] > 0:
-                item['avg_per_assembly'] = item['product_count'] / item['unique_assemblies']
-            else:
-                item['avg_per_assembly'] = 0
-
-        return list(stats)
-
-    def get_time_stats(self, assemblies):
-        """Статистика по времени"""
-        # По дням
-        daily_stats = assemblies.annotate(
-            date=TruncDate('created_at')
-        ).values('date').annotate(
-            count=Count('id'),
-            total_products=Sum('products_count'),
-            total_missing=Sum('total_missing_quantity'),
-        ).order_by('date')
-
-        # По часам (среднее за период)
-        hourly_stats = assemblies.annotate(
-            hour=ExtractHour('created_at')
-        ).values('hour').annotate(
-            count=Count('id'),
-            avg_products=Avg('products_count'),
-            avg_missing=Avg('total_missing_quantity'),
-        ).order_by('hour')
-
-        # Тренды
-        trend_data = []
-        current_date = None
-        current_count = 0
-        for stat in daily_stats:
-            if stat['date'] != current_date:
-                if current_date:
-                    trend_data.append({
-                        'date': current_date,
-                        'count': current_count
-                    })
-                current_date = stat['date']
-                current_count = 0
-            current_count += stat['count']
-
-        if current_date:
-            trend_data.append({
-                'date': current_date,
-                'count': current_count
-            })
-
-        return {
-            'daily': list(daily_stats),
-            'hourly': list(hourly_stats),
-            'trend': trend_data,
-        }
+        name = aggregation.cache_name()
+        key = section_key(filters, name, get_data_version())
 
-    def get_critical_stats(self, products):
-        """Статистика по критическим товарам"""
-        critical = products.filter(is_critical=True)
-
-        # По отделам
-        by_department = critical.values('department_id').annotate(
-            count=Count('id'),
-            total_missing=Sum('missing_quantity'),
-            avg_missing=Avg('missing_quantity'),
-        ).order_by('-count')
-
-        # По сборщикам
-        by_assembler = critical.values('assembly__assembler').annotate(
-            count=Count('id'),
-            total_missing=Sum('missing_quantity'),
-        ).order_by('-count')
-
-        # По товарам
-        by_product = critical.values('lm_code', 'title').annotate(
-            count=Count('id'),
-            total_missing=Sum('missing_quantity'),
-            assemblies=Count('assembly', distinct=True),
-        ).order_by('-total_missing')[:10]
-
-        # Временное распределение
-        by_time = critical.annotate(
-            date=TruncDate('assembly__created_at'),
-            hour=ExtractHour('assembly__created_at')
-        ).values('date', 'hour').annotate(
-            count=Count('id')
-        ).order_by('-count')[:10]
-
-        return {
-            'by_department': list(by_department),
-            'by_assembler': list(by_assembler),
-            'by_product': list(by_product),
-            'by_time': list(by_time),
-            'total_critical': critical.count(),
-        }
+        return _conditional_response(request, key, lambda: JsonResponse(
+            get_or_compute(key, aggregation.execute, name=name),
+            encoder=DjangoJSONEncoder
+        ))
 
 
-class StatisticsAPIView(LoginRequiredMixin, TemplateView):
-    """API для динамической загрузки статистики (для графиков)"""
+class StatisticsHeatmapsView(LoginRequiredMixin, View):
+    """
+    Тепловые карты недостачи для планирования смен: зона x час, отдел x час, отдел x день недели.
+    ?heatmap=zone_hour - только одна карта; все карты считаются и кешируются вместе
+    """
+    login_url = "home:login"
 
     def get(self, request, *args, **kwargs):
-        return None
-        chart_type = request.GET.get('chart_type', 'daily_assemblies')
-        date_from = request.GET.get('date_from')
-        date_to = request.GET.get('date_to')
+        filters = DashboardFilters.from_request(request.GET)
+        name = request.GET.get('heatmap')
+        if name and name not in HEATMAPS:
+            return JsonResponse({'error': f"Неизвестная карта: {name}"}, status=400)
 
-        # Базовый QuerySet с фильтрами
-        assemblies = PartiallyPickedAssembly.objects.all()
-        products = PartiallyPickedProduct.objects.all()
+        version = get_data_version()
+        key = section_key(filters, 'heatmaps', version)
 
-        if date_from:
-            assemblies = assemblies.filter(created_at__date__gte=date_from)
-            products = products.filter(assembly__created_at__date__gte=date_from)
+        def build_response():
+            heatmaps = get_or_compute(key, Heatmaps(filters).build, name='heatmaps')
+            return JsonResponse({name: heatmaps[name]} if name else heatmaps)
 
-        if date_to:
-            assemblies = assemblies.filter(created_at__date__lte=date_to)
-            products = products.filter(assembly__created_at__date__lte=date_to)
-
-        data = {}
-
-        if chart_type == 'daily_assemblies':
-            # Сборки по дням
-            stats = assemblies.annotate(
-                date=TruncDate('created_at')
-            ).values('date').annotate(
-                count=Count('id')
-            ).order_by('date')
-
-            data = {
-                'labels': [item['date'].strftime('%d.%m') for item in stats],
-                'datasets': [{
-                    'label': 'Количество сборок',
-                    'data': [item['count'] for item in stats],
-                    'borderColor': 'rgb(75, 192, 192)',
-                    'tension': 0.1
-                }]
-            }
+        # ETag различается для отдельных карт, кеш расчета у них общий
+        return _conditional_response(request, section_key(filters, f'heatmaps:{name}', version), build_response)
 
-        elif chart_type == 'assembler_performance':
-            # Производительность сборщиков
-            stats = assemblies.values('assembler').annotate(
-                count=Count('id'),
-                avg_products=Avg('products_count'),
-                avg_missing=Avg('total_missing_quantity'),
-            ).order_by('-count')[:10]
-
-            data = {
-                'labels': [item['assembler'] or 'Не указан' for item in stats],
-                'datasets': [
-                    {
-                        'label': 'Количество сборок',
-                        'data': [item['count'] for item in stats],
-                        'backgroundColor': 'rgba(255, 99, 132, 0.5)',
-                    },
-                    {
-                        'label': 'Среднее кол-во товаров',
-                        'data': [item['avg_products'] for item in stats],
-                        'backgroundColor': 'rgba(54, 162, 235, 0.5)',
-                    }
-                ]
-            }
 
-        elif chart_type == 'department_distribution':
-            # Распределение по отделам
-            stats = products.values('department_id').annotate(
-                count=Count('id'),
-                total_missing=Sum('missing_quantity'),
-            ).order_by('-count')[:10]
-
-            data = {
-                'labels': [f"Отдел {item['department_id']}" for item in stats],
-                'datasets': [{
-                    'label': 'Количество товаров',
-                    'data': [item['count'] for item in stats],
-                    'backgroundColor': [
-                        'rgba(255, 99, 132, 0.5)',
-                        'rgba(54, 162, 235, 0.5)',
-                        'rgba(255, 206, 86, 0.5)',
-                        'rgba(75, 192, 192, 0.5)',
-                        'rgba(153, 102, 255, 0.5)',
-                    ],
-                }]
-            }
+class ChronicShortageView(LoginRequiredMixin, TemplateView):
+    """
+    Индекс хронической недостачи по LM кодам из ночного пересчета (particles.chronic).
+    ?department_id=, ?sort=-days_active (поле из SORT_FIELDS, '-' - по убыванию), ?page=, ?format=json
+    """
+    template_name = "particles/chronic_shortages.html"
+    login_url = "home:login"
+    paginate_by = 50
 
-        elif chart_type == 'missing_quantity_trend':
-            # Тренд недостающего количества
-            stats = assemblies.annotate(
-                date=TruncDate('created_at')
-            ).values('date').annotate(
-                total_missing=Sum('total_missing_quantity'),
-                total_products=Sum('products_count'),
-            ).order_by('date')
-
-            data = {
-                'labels': [item['date'].strftime('%d.%m') for item in stats],
-                'datasets': [
-                    {
-                        'label': 'Недостающее количество',
-                        'data': [item['total_missing'] for item in stats],
-                        'borderColor': 'rgb(255, 99, 132)',
-                        'tension': 0.1
-                    },
-                    {
-                        'label': 'Количество товаров',
-                        'data': [item['total_products'] for item in stats],
-                        'borderColor': 'rgb(54, 162, 235)',
-                        'tension': 0.1
-                    }
-                ]
+    def get_queryset(self):
+        queryset = ChronicShortage.objects.all()
+
+        department_id = self.request.GET.get('department_id')
+        if department_id:
+            queryset = queryset.filter(department_id=department_id)
+
+        sort = self.request.GET.get('sort') or 'rank'
+        if sort.lstrip('-') not in CHRONIC_SORT_FIELDS:
+            sort = 'rank'
+        return queryset.order_by(sort, 'rank'), sort
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('format') != 'json':
+            return super().get(request, *args, **kwargs)
+
+        queryset, sort = self.get_queryset()
+        page = Paginator(queryset.values(), self.paginate_by).get_page(request.GET.get('page'))
+        return JsonResponse({
+            'sort': sort,
+            'page': page.number,
+            'pages': page.paginator.num_pages,
+            'count': page.paginator.count,
+            'items': list(page),
+        }, encoder=DjangoJSONEncoder)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        queryset, sort = self.get_queryset()
+
+        context['page'] = Paginator(queryset, self.paginate_by).get_page(self.request.GET.get('page'))
+        context['sort'] = sort
+        # Столбцы таблицы: повторный клик по столбцу меняет направление, числа сначала по убыванию
+        context['columns'] = [
+            {
+                'field': field,
+                'label': label,
+                'active': sort.lstrip('-') == field,
+                'next_sort': field if sort == f'-{field}' or (field in ('rank', 'lm_code') and sort != field)
+                else f'-{field}',
             }
+            for field, label in (
+                ('rank', 'Место'),
+                ('lm_code', 'LM код'),
+                ('days_active', 'Дней'),
+                ('occurrences', 'Попаданий'),
+                ('total_missing', 'Недостача'),
+                ('weighted_missing', 'С учетом давности'),
+                ('assemblers_count', 'Сборщиков'),
+                ('last_seen', 'Последний день'),
+                ('score', 'Индекс'),
+            )
+        ]
+        context['filter_department'] = self.request.GET.get('department_id') or ''
+        context['unique_departments'] = ChronicShortage.objects.exclude(
+            department_id=''
+        ).values_list('department_id', flat=True).distinct().order_by('department_id')
+        context['computed_at'] = ChronicShortage.objects.values_list('computed_at', flat=True).first()
+        return context
 
-        return JsonResponse(data, safe=False)
 
+class ShortageForecastView(LoginRequiredMixin, View):
+    """
+    Сохраненный прогноз недостачи по (отдел, час) на день (particles.forecasting): раздел дашборда.
+    ?date= (по умолчанию сегодня), ?department_id=, ?format=json
+    """
+    login_url = "home:login"
+
+    def get(self, request, *args, **kwargs):
+        try:
+            day = parse_date(request.GET.get('date') or '') or timezone.localdate()
+        except ValueError:
+            return JsonResponse({'error': "Некорректная дата"}, status=400)
+        forecast = forecast_table(day, request.GET.get('department_id') or None)
+        if request.GET.get('format') == 'json':
+            return JsonResponse(forecast, encoder=DjangoJSONEncoder)
+        return render(request, 'particles/dashboard/forecast.html', {'forecast': forecast})
 
-class StatisticsExportView(LoginRequiredMixin, TemplateView):
-    """Экспорт статистики в JSON"""
+
+class TopProductsView(LoginRequiredMixin, View):
+    """
+    Топ LM кодов по недостаче (metric=missing) или попаданиям (metric=occurrences)
+    за последний час, сегодня или 7 дней. Сразу из часовых скетчей с оценкой погрешности,
+    с ?exact=1 - точный расчет по исходным данным
+    """
+    login_url = "home:login"
+    max_k = 100
+
+    def get(self, request, *args, **kwargs):
+        window = request.GET.get('window', 'today')
+        metric = request.GET.get('metric', 'missing')
+        if window not in WINDOWS:
+            return JsonResponse({'error': f'Неизвестное окно: {window}'}, status=400)
+        if metric not in METRICS:
+            return JsonResponse({'error': f'Неизвестная метрика: {metric}'}, status=400)
+
+        try:
+            k = min(max(int(request.GET.get('k', 10)), 1), self.max_k)
+        except ValueError:
+            return JsonResponse({'error': 'k должно быть числом'}, status=400)
+
+        exact = request.GET.get('exact') in ('1', 'true')
+        return JsonResponse(top_products(window, metric, k, exact=exact), encoder=DjangoJSONEncoder)
+
+
+class StatisticsExportView(LoginRequiredMixin, View):
+    """
+    Экспорт статистики в JSON (потоком).
+    С ?rows=1 ответ в NDJSON: разделы статистики, затем все исходные строки периода
+    """
+    login_url = "home:login"
 
     def get(self, request, *args, **kwargs):
         date_from = request.GET.get('date_from')
         date_to = request.GET.get('date_to')
 
-        # Собираем все данные
-        dashboard_view = StatisticsDashboard()
-        dashboard_view.request = request
-
-        context = dashboard_view.get_context_data()
-
-        # Формируем структуру для экспорта
-        export_data = {
-            'period': {
-                'date_from': date_from,
-                'date_to': date_to,
-                'generated_at': timezone.now().isoformat(),
-            },
-            'total_statistics': context['total_stats'],
-            'assembler_statistics': context['assembler_stats'],
-            'department_statistics': context['department_stats'],
-            'product_statistics': context['product_stats'],
-            'critical_statistics': context['critical_stats'],
+        filters = DashboardFilters.from_request(request.GET)
+        statistics = DashboardStatistics(filters, get_data_version())
+
+        # Разделы берутся из кеша дашборда, недостающие считаются параллельно
+        sections = get_sections(statistics, parallel=True)
+
+        period = {
+            'date_from': date_from,
+            'date_to': date_to,
+            'generated_at': timezone.now().isoformat(),
+            'filters': filters.as_dict(),
         }
-        export_data = {}
-        response = JsonResponse(export_data, json_dumps_params={'indent': 2})
-        response['Content-Disposition'] = f'attachment; filename="statistics_{date_from}_{date_to}.json"'
-        return response
 
+        if request.GET.get('rows') in ('1', 'true'):
+            response = StreamingHttpResponse(
+                iter_statistics_ndjson(period, sections, iter_raw_rows(statistics)),
+                content_type='application/x-ndjson; charset=utf-8'
+            )
+            extension = 'ndjson'
+        else:
+            response = StreamingHttpResponse(
+                iter_statistics_json(period, sections),
+                content_type='application/json; charset=utf-8'
+            )
+            extension = 'json'
 
+        response['Content-Disposition'] = f'attachment; filename="statistics_{date_from}_{date_to}.{extension}"'
+        return response